@@ -1,5 +1,5 @@
 #!/usr/bin/env python3
-import os,sys,shutil,subprocess
+import os,sys,shutil,subprocess,socket,argparse,atexit
 from typing import AsyncIterable
 os.environ["ANONYMIZED_TELEMETRY"] = "false"
 import asyncio
@@ -9,38 +9,179 @@ import traceback
 from dotenv import load_dotenv
 import signal
 import time
+from datetime import timedelta
 import json
+import aiohttp
+from hypercorn.config import Config as HypercornConfig
+from hypercorn.asyncio import serve as hypercorn_serve
 
-from buweb.service.session import SessionStore, BwSession
+from buweb.service.session import SessionStore, BwSession, TASK_BACKENDS, SHUTDOWN_DEADLINE
+from buweb.service.vnc import VNC_PROFILES
+from buweb.task.pw_runtime import PlaywrightPool
 from buweb.model.model import LLM
+from buweb.service.admission import PRIORITY_HIGH, PRIORITY_NORMAL, PRIORITY_LOW
+from buweb.service.sse import SseEncoder, parse_event_id, SSE_BATCH_WINDOW, SSE_STATUS_INTERVAL, SSE_HEARTBEAT, SSE_RETRY_MS
+from buweb.utils.metrics import REGISTRY, SESSIONS, MAX_SESSIONS, CONNECTIONS, QUEUE_DEPTH, WARM_READY, POOL_SIZE
+from buweb.service.cluster import WorkerRegistry, WorkerNode, heartbeat_loop, sniff_session_id, CLUSTER_TOKEN_HEADER
+from buweb.service.directory import SessionDirectory, DirectoryPublisher
+from buweb.service.assets import StaticAssets, etag_matches
+from buweb.service.upload import UploadError
+from buweb.utils.log_queue import install_queue_logging
 
 from logging import Logger,getLogger
 logger:Logger = getLogger(__name__)
 
-Pool:ThreadPoolExecutor = ThreadPoolExecutor(20)
 SessionsDir="./tmp/sessions"
 novncdir="third_party/noVNC-1.5.0"
+# HTML is revalidated on every load; the noVNC modules are kept for a week
+static_assets:StaticAssets = StaticAssets('static', cache_control='no-cache')
+novnc_assets:StaticAssets = StaticAssets(novncdir, cache_control='public, max-age=604800')
+_assets_task:asyncio.Task|None = None
+SSE_GZIP:bool = False
+# room for the multipart headers around an upload of the maximum size
+UPLOAD_OVERHEAD:int = 64*1024
+SHUTDOWN_TIME:float = SHUTDOWN_DEADLINE
 
-session_store = SessionStore( dir=SessionsDir, Pool=Pool )
+# cluster mode: 'standalone', 'coordinator' or 'worker'
+CLUSTER_ROLE:str = 'standalone'
+COORDINATOR_URL:str = ''
+NODE_ID:str = ''
+NODE_URL:str = ''
+PUBLIC_HOST:str = ''
+CLUSTER_TOKEN:str = ''
+# timeout of a forwarded non-stream api call
+CLUSTER_API_TIMEOUT:float = 120.0
+registry:WorkerRegistry = WorkerRegistry()
+_upstream:aiohttp.ClientSession|None = None
+_heartbeat_task:asyncio.Task|None = None
+# set on a request forwarded by a coordinator or a sibling worker
+FORWARDED_HEADER:str = 'X-Buw-Forwarded'
+
+# several worker processes on one port (--workers): sessions are owned by the worker
+# that created them, and the others find the owner in the shared directory
+LOCAL_WORKERS:int = 1
+WORKER_INDEX:int = 0
+directory:SessionDirectory|None = None
+DIRECTORY_INTERVAL:float = 1.0
+_publisher:DirectoryPublisher|None = None
+
+# built in main(): a spawned task process imports this module as __mp_main__ and must not build them
+Pool:ThreadPoolExecutor
+# a few Playwright drivers, each on its own loop, shared by the sessions and their tasks
+playwright_runtime:PlaywrightPool
+session_store:SessionStore
 
 def cleanup_sessions():
     print("### CLEANUP SESSIONS ###")
     # Clean up all sessions
-    if session_store:
-        asyncio.run( session_store.cleanup_all() )
+    # normally already done on the serving loop in shutdown()
+    if session_store and session_store.sessions:
+        asyncio.run( session_store.cleanup_all(SHUTDOWN_TIME) )
+    playwright_runtime.stop()
 
 app = Quart(__name__)
 
+@app.before_serving
+async def startup():
+    global SSE_GZIP, SHUTDOWN_TIME, _upstream, _heartbeat_task, _publisher, _assets_task
+    SSE_GZIP = os.getenv('BUW_SSE_GZIP','0').lower() in ('1','true','yes')
+    # files are served from disk until their compressed variants are ready
+    _assets_task = asyncio.create_task(build_assets())
+    SHUTDOWN_TIME = float(os.getenv('BUW_SHUTDOWN_DEADLINE',str(SHUTDOWN_DEADLINE)))
+    session_store.upload_max = int(os.getenv('BUW_UPLOAD_MAX',str(session_store.upload_max>>20)))<<20
+    session_store.upload_quota = int(os.getenv('BUW_UPLOAD_QUOTA',str(session_store.upload_quota>>20)))<<20
+    # upload bodies are streamed to disk, this only caps them
+    app.config['MAX_CONTENT_LENGTH'] = session_store.upload_max+UPLOAD_OVERHEAD
+    if CLUSTER_ROLE=='coordinator':
+        # the coordinator runs no browsers, it only places and forwards
+        _upstream = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=None, sock_connect=10))
+        return
+    if directory is not None:
+        _upstream = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=None, sock_connect=10))
+        publisher = _publisher = DirectoryPublisher(directory, NODE_ID, NODE_URL, directory_snapshot, interval=DIRECTORY_INTERVAL)
+        # siblings must find a session at once, not at the next interval
+        session_store.on_removed = lambda session_id: publisher.kick()
+        publisher.start()
+    warm_low = int(os.getenv('BUW_WARM_LOW','0'))
+    warm_high = int(os.getenv('BUW_WARM_HIGH','0'))
+    session_store.configure_warm_pool(warm_low, max(warm_low,warm_high))
+    session_store.stream_grace = float(os.getenv('BUW_STREAM_GRACE','30'))
+    session_store.session_timeout = timedelta(seconds=float(os.getenv('BUW_SESSION_TIMEOUT','7200')))
+    if os.getenv('BUW_ADBLOCK','1').lower() not in ('1','true','yes'):
+        session_store.blocklist.paths.clear()
+    session_store.blocklist.paths.extend( path for path in os.getenv('BUW_BLOCKLIST','').split(os.pathsep) if path )
+    task_backend = os.getenv('BUW_TASK_BACKEND','thread').lower()
+    if task_backend not in TASK_BACKENDS:
+        raise ValueError(f"invalid BUW_TASK_BACKEND {task_backend}")
+    session_store.task_backend = task_backend
+    session_store.profile_template.enabled = os.getenv('BUW_PROFILE_TEMPLATE','1').lower() in ('1','true','yes')
+    vnc_profile = os.getenv('BUW_VNC_PROFILE',session_store.vnc_profile).lower()
+    if vnc_profile not in VNC_PROFILES:
+        raise ValueError(f"invalid BUW_VNC_PROFILE {vnc_profile}")
+    session_store.vnc_profile = vnc_profile
+    await session_store.start()
+    if CLUSTER_ROLE=='worker':
+        _heartbeat_task = asyncio.create_task(
+            heartbeat_loop(COORDINATOR_URL, NODE_ID, NODE_URL, PUBLIC_HOST, session_store.get_capacity, token=CLUSTER_TOKEN) )
+
+@app.after_serving
+async def shutdown():
+    if _heartbeat_task is not None:
+        _heartbeat_task.cancel()
+    if _publisher is not None:
+        await _publisher.close()
+    if directory is not None:
+        await asyncio.to_thread(directory.drop, NODE_ID)
+    if _upstream is not None:
+        await _upstream.close()
+    if CLUSTER_ROLE!='coordinator':
+        # on the loop that started the sessions' child processes
+        await session_store.cleanup_all(SHUTDOWN_TIME)
+
+async def directory_snapshot() -> tuple[dict,list[dict]]:
+    """This worker's capacity and sessions for the shared directory"""
+    info = await session_store.get_capacity()
+    info.pop('session_ids', None)
+    info['public_host'] = PUBLIC_HOST
+    return info, session_store.session_rows()
+
+async def build_assets():
+    for assets in (static_assets, novnc_assets):
+        try:
+            await asyncio.to_thread(assets.build)
+        except Exception:
+            logger.exception(f"error while building {assets.root}")
+
+async def serve_asset(assets:StaticAssets, directory:str, path:str):
+    """A precompressed file with a strong ETag, or the file from disk if it is not indexed"""
+    asset = assets.lookup(path)
+    if asset is None:
+        return await send_from_directory(directory, path)
+    variant = assets.select(asset, request.headers.get('Accept-Encoding',''))
+    headers = {
+        'ETag': variant.etag,
+        'Cache-Control': 'no-cache' if asset.content_type.startswith('text/html') else assets.cache_control,
+        'Vary': 'Accept-Encoding',
+    }
+    if_none_match = request.headers.get('If-None-Match')
+    if if_none_match and etag_matches(if_none_match, asset):
+        assets.not_modified += 1
+        return Response(b'', status=304, headers=headers)
+    assets.hits += 1
+    if variant.encoding:
+        headers['Content-Encoding'] = variant.encoding
+    return Response(variant.body, content_type=asset.content_type, headers=headers)
+
 @app.route('/', defaults={'path': 'index.html'})
 @app.route('/<path:path>')
 async def style_css(path):
-    print(f"REQ:{path}")
-    return await send_from_directory('static', path)
+    logger.debug(f"REQ:{path}")
+    return await serve_asset(static_assets, 'static', path)
 
 @app.route('/novnc/<path:path>')
 async def novnc_files(path):
     """Provide noVNC files"""
-    return await send_from_directory(novncdir, path)
+    return await serve_asset(novnc_assets, novncdir, path)
 
 @app.route('/api/llm_list')
 async def llm_list():
@@ -54,9 +195,166 @@ async def llm_list():
     except Exception as e:
         return jsonify({'status': 'error', 'msg': str(e)}), 500
 
+@app.route('/cluster/heartbeat', methods=['POST'])
+async def cluster_heartbeat():
+    """A worker reports its address and capacity"""
+    if CLUSTER_ROLE!='coordinator':
+        return jsonify({'status': 'error', 'msg': 'not a coordinator'}), 404
+    if CLUSTER_TOKEN and request.headers.get(CLUSTER_TOKEN_HEADER)!=CLUSTER_TOKEN:
+        return jsonify({'status': 'error', 'msg': 'unauth'}), 401
+    try:
+        info = await request.get_json()
+        registry.heartbeat(info)
+        return jsonify({'status': 'success'})
+    except Exception as e:
+        return jsonify({'status': 'error', 'msg': str(e)}), 400
+
+@app.route('/cluster/nodes')
+async def cluster_nodes():
+    """Return the live workers"""
+    if CLUSTER_ROLE!='coordinator':
+        return jsonify({'status': 'error', 'msg': 'not a coordinator'}), 404
+    return jsonify({'status': 'success', 'nodes': registry.get_status()})
+
+@app.route('/metrics')
+async def metrics():
+    """Prometheus text format"""
+    current_connections,current_sessions,max_sessions,queue_depth = await session_store.get_status()
+    CONNECTIONS.set(current_connections)
+    SESSIONS.set(current_sessions)
+    MAX_SESSIONS.set(max_sessions)
+    QUEUE_DEPTH.set(queue_depth)
+    WARM_READY.set(session_store.get_warm_pool_status()['ready'])
+    POOL_SIZE.set(Pool._max_workers)
+    return Response(REGISTRY.render(), mimetype='text/plain; version=0.0.4; charset=utf-8')
+
+@app.route('/admin/resources')
+async def admin_resources():
+    """CPU, memory, threads and fds of every session's process trees"""
+    try:
+        res = session_store.get_resource_status()
+        res['assets'] = { 'static': static_assets.get_status(), 'novnc': novnc_assets.get_status() }
+        res['status'] = 'success'
+        return jsonify(res)
+    except Exception as e:
+        traceback.print_exc()
+        return jsonify({'status': 'error','msg': str(e)}), 500
+
+def _forward_headers() -> dict[str,str]:
+    headers = { k:v for k in ('Content-Type','X-Session-ID','Last-Event-ID') if (v:=request.headers.get(k)) }
+    headers['X-Forwarded-For'] = request.headers.get('X-Forwarded-For') or request.remote_addr or ''
+    headers[FORWARDED_HEADER] = '1'
+    # the coordinator reads the event ids, so the worker must not compress the stream
+    headers['Accept-Encoding'] = 'identity'
+    if CLUSTER_TOKEN:
+        headers[CLUSTER_TOKEN_HEADER] = CLUSTER_TOKEN
+    return headers
+
+async def _forward_json(node:WorkerNode, method:str, path:str, data:dict|None) -> dict:
+    assert _upstream is not None
+    timeout = aiohttp.ClientTimeout(total=CLUSTER_API_TIMEOUT)
+    async with _upstream.request(method, node.url+path, json=data, headers=_forward_headers(), timeout=timeout) as resp:
+        return await resp.json()
+
+async def cluster_config(data:dict|None, nodes:list[WorkerNode]):
+    """Apply the settings on every worker and sum up their status"""
+    results = await asyncio.gather( *[ _forward_json(node, 'POST' if data else 'GET', '/api/config', data) for node in nodes ], return_exceptions=True )
+    oks = [ r for r in results if isinstance(r,dict) and r.get('status')=='success' ]
+    for node,r in zip(nodes,results):
+        if not (isinstance(r,dict) and r.get('status')=='success'):
+            logger.warning(f"config on worker {node.node_id} failed: {r}")
+    if not oks:
+        return jsonify({'status': 'error', 'msg': 'no worker available'}), 503
+    res = dict(oks[0])
+    for key in ('current_conneections','current_sessions','max_sessions','queue_depth'):
+        res[key] = sum( r.get(key) or 0 for r in oks )
+    res.pop('warm_pool',None)
+    res['nodes'] = [ node.to_dict() for node in nodes ]
+    return jsonify(res)
+
+async def proxy_session_stream(node:WorkerNode, resp:aiohttp.ClientResponse, session_id:str|None) ->AsyncIterable[bytes]:
+    """Coordinator: pass a worker's event stream through, learning the session id from the first frame id"""
+    buf = ''
+    try:
+        async for chunk in resp.content.iter_any():
+            if session_id is None:
+                buf += chunk.decode('utf-8','replace')
+                session_id, buf = sniff_session_id(buf)
+                if session_id is not None:
+                    registry.bind(session_id, node)
+            yield chunk
+    except aiohttp.ClientError as ex:
+        logger.warning(f"stream from worker {node.node_id} ended: {ex}")
+    finally:
+        resp.release()
+
+async def cluster_api(api:str):
+    """Coordinator: forward an api call to the worker that owns the session, or place a new one"""
+    assert _upstream is not None
+    if api == 'session':
+        resume = parse_event_id(request.headers.get('Last-Event-ID'))
+        node = registry.owner(resume[0]) if resume is not None else None
+        session_id = resume[0] if node is not None else None
+        if node is None:
+            node = registry.place()
+        if node is None:
+            return jsonify({'status': 'error', 'msg': 'no worker available'}), 503
+        return await forward_session(node, session_id)
+
+    node = registry.owner(request.headers.get("X-Session-ID"))
+    if node is None:
+        return jsonify({'status': 'error', 'msg': 'unauth'}), 401
+    return await forward_api(node, api)
+
+async def forward_session(node:WorkerNode, session_id:str|None):
+    """Open the event stream on the worker and pass it through"""
+    assert _upstream is not None
+    try:
+        resp = await _upstream.get(node.url+'/api/session', params=dict(request.args), headers=_forward_headers())
+    except aiohttp.ClientError as ex:
+        return jsonify({'status': 'error', 'msg': f"worker {node.node_id}: {ex}"}), 502
+    if resp.status != 200:
+        body = await resp.read()
+        resp.release()
+        return Response(body, status=resp.status, content_type=resp.headers.get('Content-Type'))
+    headers = { "Cache-Control": "no-cache", "X-Accel-Buffering": "no" }
+    ress = Response(proxy_session_stream(node,resp,session_id), headers=headers, mimetype='text/event-stream')
+    ress.timeout = None # disable timeout
+    return ress
+
+async def _stream_body() -> AsyncIterable[bytes]:
+    async for chunk in request.body:
+        yield chunk
+
+async def forward_api(node:WorkerNode, api:str):
+    """Pass a non-stream api call to the worker that owns the session"""
+    assert _upstream is not None
+    timeout = aiohttp.ClientTimeout(total=CLUSTER_API_TIMEOUT)
+    try:
+        headers = _forward_headers()
+        if api=='store_file':
+            # uploads are passed on as they arrive
+            data = _stream_body()
+            if request.content_length is not None:
+                headers['Content-Length'] = str(request.content_length)
+        else:
+            data = await request.get_data()
+        async with _upstream.request(request.method, f"{node.url}/api/{api}", params=dict(request.args),
+                                     data=data, headers=headers, timeout=timeout) as resp:
+            body = await resp.read()
+            return Response(body, status=resp.status, content_type=resp.headers.get('Content-Type'))
+    except (aiohttp.ClientError, asyncio.TimeoutError) as ex:
+        return jsonify({'status': 'error', 'msg': f"worker {node.node_id}: {ex}"}), 502
+
 @app.route('/api/config', methods=['GET','POST'])
 async def config_api():
     try:
+        if CLUSTER_ROLE == 'coordinator':
+            return await cluster_config( await request.get_json() if request.method == 'POST' else None, registry.live_nodes() )
+        if directory is not None and not request.headers.get(FORWARDED_HEADER):
+            # every worker process applies the settings and reports its share
+            nodes = await asyncio.to_thread(directory.live_nodes)
+            return await cluster_config( await request.get_json() if request.method == 'POST' else None, nodes )
         if request.method == 'POST':
             data = await request.get_json()
             operator = data.get('operator_llm')
@@ -66,10 +364,14 @@ async def config_api():
             # Get LLM from name
             operator_llm = LLM[operator]
             planner_llm = LLM[planner] if planner else None
-            max_sessions = int(max_sessions)
+            max_sessions = _worker_share(int(max_sessions))
             session_store.configure(operator_llm, planner_llm, max_sessions)
+            warm_low = data.get('warm_low')
+            warm_high = data.get('warm_high')
+            if warm_low is not None and warm_high is not None:
+                session_store.configure_warm_pool(int(warm_low), int(warm_high))
         # Return the current LLM settings
-        current_connections,current_sessions,max_sessions = await session_store.get_status()
+        current_connections,current_sessions,max_sessions,queue_depth = await session_store.get_status()
         return jsonify({
             'status': 'success',
             'operator_llm': session_store._operator_llm.name,
@@ -77,64 +379,86 @@ async def config_api():
             'current_conneections': current_connections,
             'current_sessions': current_sessions,
             'max_sessions': max_sessions,
+            'queue_depth': queue_depth,
+            'warm_pool': session_store.get_warm_pool_status(),
+            'blocklist': session_store.blocklist.get_status(),
         })
     except Exception as e:
         traceback.print_exc()
         return jsonify({'status': 'error','msg': str(e)}), 500
 
-def compare_dicts(d1, d2):
-    if d1.keys() != d2.keys():
-        return False
-    for key in d1:
-        if isinstance(d1[key], dict) and isinstance(d2[key], dict):
-            if not compare_dicts(d1[key], d2[key]):
-                return False
-        else:
-            if d1[key] != d2[key]:
-                return False
-    return True
-
-async def session_stream(server_addr,client_addr) ->AsyncIterable[str]:
+async def session_stream(server_addr,client_addr,gzip:bool=False,last_event_id:str|None=None,priority:int=PRIORITY_NORMAL,headless:bool=False,vnc_profile:str|None=None) ->AsyncIterable[bytes]:
+    enc = SseEncoder(gzip=gzip)
     ses = None
+    gen = 0
     try:
         await session_store.incr()
-        ses = await session_store.create(server_addr,client_addr)
-        if ses is None:
-            res = { 'status': 'success', 'msg': 'Connections are limited' }
-            yield f"data: {json.dumps(res, ensure_ascii=False)}\n\n"
-            while ses is None:
-                await asyncio.sleep(1)
-                ses = await session_store.create(server_addr,client_addr)
-
-        res = ses.get_status()
-        res['msg'] = 'Connection complete'
-        yield f"data: {json.dumps(res, ensure_ascii=False)}\n\n"
-
-        before_res = {}
-        before_time = 0.0
-        while ses is not None:
+        yield enc.encode(enc.retry(SSE_RETRY_MS))
+        # A reconnecting EventSource sends the id of the last frame it received
+        resume = parse_event_id(last_event_id)
+        if resume is not None:
+            ses = session_store.attach(resume[0])
+        if ses is not None and resume is not None:
+            gen = ses.stream_gen
+            frames = ses.replay.since(resume[1])
+            if frames is not None:
+                for frame in frames:
+                    yield enc.encode(frame)
+                msg = 'Reconnected'
+            else:
+                msg = 'Reconnected, some messages were lost'
+        else:
+            # wait for a slot in arrival order, reporting the position and estimated wait
+            ticket = session_store.admit(priority)
+            try:
+                last_sent = time.monotonic()
+                before_pos = -1
+                while not ticket.granted:
+                    pos, eta = session_store.queue_position(ticket)
+                    if pos!=before_pos:
+                        before_pos = pos
+                        msg = f"Connections are limited. Waiting for a free session: #{pos}"
+                        if eta is not None:
+                            msg += f" (about {max(1,round(eta/60))} min)"
+                        res = { 'status': 'success', 'queue': pos, 'eta': round(eta) if eta is not None else None }
+                        yield enc.encode(enc.frame(res, [(0,0,0,0,'',msg,None)]) or '')
+                        last_sent = time.monotonic()
+                    elif time.monotonic()-last_sent>=SSE_HEARTBEAT:
+                        yield enc.encode(enc.heartbeat())
+                        last_sent = time.monotonic()
+                    await ticket.wait(SSE_STATUS_INTERVAL)
+                ses = await session_store.create(server_addr,client_addr,ticket,headless=headless,vnc_profile=vnc_profile)
+                if ses is not None and _publisher is not None:
+                    _publisher.kick()
+            finally:
+                if ses is None:
+                    session_store.leave(ticket)
+            if ses is None:
+                return
+            gen = ses.stream_gen
+            msg = 'Connection complete'
+
+        yield enc.encode(ses.replay.add(enc.frame(ses.get_status(), [(0,0,0,0,'',msg,None)]) or ''))
+
+        last_sent = time.monotonic()
+        while ses.stream_gen==gen:
             try:
-                n_task,n_agent,n_step,n_act,header,msg,progress = await ses.get_msg(timeout=1)
-                res = ses.get_status()
-                now = time.time()
-                if msg is None:
-                    if (now-before_time)<10 and compare_dicts(before_res, res):
+                # messages written in a burst are coalesced into one frame
+                msgs = await ses.get_msgs(timeout=SSE_STATUS_INTERVAL, window=SSE_BATCH_WINDOW)
+                if ses.stream_gen!=gen:
+                    # the client has reconnected on another stream
+                    ses.unread_msgs(msgs)
+                    break
+                frame = enc.frame(ses.get_status(), msgs)
+                now = time.monotonic()
+                if frame is None:
+                    if (now-last_sent)<SSE_HEARTBEAT:
                         continue
+                    frame = enc.heartbeat()
                 else:
-                    if n_task>0:
-                        res['task'] = n_task
-                    if n_agent>0:
-                        res['agent'] = n_agent
-                    if n_step>0:
-                        res['step'] = n_step
-                    if n_act>0:
-                        res['act'] = n_act
-                    res['header'] = header
-                    res['msg'] = msg
-                    res['progress'] = progress
-                yield f"data: {json.dumps(res, ensure_ascii=False)}\n\n"
-                before_res = res
-                before_time = now
+                    frame = ses.replay.add(frame)
+                yield enc.encode(frame)
+                last_sent = now
             except Exception as ex:
                 traceback.print_exc()
                 break
@@ -142,22 +466,63 @@ async def session_stream(server_addr,client_addr) ->AsyncIterable[str]:
         traceback.print_exc()
     finally:
         if ses is not None:
-            await session_store.remove(ses.session_id)
+            # keep the session for a while so that the client can resume
+            await session_store.detach(ses.session_id, gen)
         await session_store.decr()
 
+def _worker_share(total:int) -> int:
+    """This worker process's part of a session limit that is given for all of them"""
+    return total//LOCAL_WORKERS + (1 if WORKER_INDEX < total%LOCAL_WORKERS else 0)
+
+async def route_to_owner(api:str, session_id:str|None):
+    """--workers: forward a call for a session of a sibling worker process to it, None if it is not one"""
+    assert directory is not None
+    if api == 'session':
+        # only a reconnecting stream names its session
+        resume = parse_event_id(request.headers.get('Last-Event-ID'))
+        if resume is None or resume[0] in session_store.sessions:
+            return None
+        session_id = resume[0]
+    if not session_id:
+        return None
+    node = await asyncio.to_thread(directory.owner, session_id)
+    if node is None or node.node_id == NODE_ID:
+        return None
+    if api == 'session':
+        return await forward_session(node, session_id)
+    return await forward_api(node, api)
+
 @app.route('/api/<path:api>', methods=['GET','POST'])
 async def service_api(api):
     try:
+        if CLUSTER_ROLE == 'coordinator':
+            return await cluster_api(api)
         client_addr = request.remote_addr
-        server_addr = request.host.split(':')[0]
+        if (CLUSTER_ROLE == 'worker' or request.headers.get(FORWARDED_HEADER)) and request.headers.get('X-Forwarded-For'):
+            client_addr = request.headers['X-Forwarded-For']
+        # noVNC connects straight to this node, so report the address clients can reach
+        server_addr = PUBLIC_HOST or request.host.split(':')[0]
         session_id = request.headers.get("X-Session-ID")
         ses:BwSession|None = await session_store.get(session_id)
+        if ses is None and directory is not None and not request.headers.get(FORWARDED_HEADER):
+            res = await route_to_owner(api, session_id)
+            if res is not None:
+                return res
         # In case of session
         if api == 'session':
             if ses is not None:
                 return jsonify({'status': 'error', 'msg': 'unauth'}), 401
-            headers = { "Content-Type": "text/event-stream" }
-            ress = Response(session_stream(server_addr,client_addr), headers=headers, mimetype='text/event-stream')   
+            headers = { "Content-Type": "text/event-stream", "Cache-Control": "no-cache", "X-Accel-Buffering": "no" }
+            gzip = SSE_GZIP and 'gzip' in request.headers.get('Accept-Encoding','')
+            if gzip:
+                headers['Content-Encoding'] = 'gzip'
+            last_event_id = request.headers.get('Last-Event-ID')
+            priority = min(PRIORITY_LOW, max(PRIORITY_HIGH, request.args.get('priority', PRIORITY_NORMAL, type=int)))
+            headless = request.args.get('headless','0').lower() in ('1','true','yes')
+            vnc_profile = request.args.get('vnc')
+            if vnc_profile is not None and vnc_profile not in VNC_PROFILES:
+                return jsonify({'status': 'error', 'msg': f"invalid vnc profile {vnc_profile}"}), 400
+            ress = Response(session_stream(server_addr,client_addr,gzip,last_event_id,priority,headless,vnc_profile), headers=headers, mimetype='text/event-stream')
             ress.timeout = None # disable timeout
             return ress
   
@@ -166,9 +531,28 @@ async def service_api(api):
             return jsonify({'status': 'error', 'msg': 'unauth'}), 401
 
         if api=='browser_start':
+            if request.args.get('headless') is not None:
+                await ses.set_headless( request.args.get('headless','0').lower() in ('1','true','yes') )
+            if request.args.get('vnc') is not None:
+                await ses.set_vnc_profile( request.args.get('vnc','') )
             res = await ses.start_browser()
             return jsonify(res)
 
+        elif api=='vnc_attach':
+            # websockify runs only while a viewer is connected
+            res = await ses.attach_viewer()
+            return jsonify(res)
+
+        elif api=='vnc_detach':
+            res = await ses.detach_viewer()
+            return jsonify(res)
+
+        elif api=='screenshot':
+            image = await ses.screenshot( min(100, max(10, request.args.get('quality', 60, type=int))) )
+            if image is None:
+                return jsonify({'status': 'error', 'msg': 'browser is not running'}), 404
+            return Response(image, content_type='image/jpeg', headers={'Cache-Control': 'no-store'})
+
         elif api=='task_start':
             data = await request.get_json()
             mode = data.get('mode',0)
@@ -176,6 +560,8 @@ async def service_api(api):
             sensitive_data = data.get('sensitive_data', None)
             expand:bool = data.get('expand','') == 'true'
             msg = None
+            if data.get('headless') is not None:
+                await ses.set_headless( bool(data.get('headless')) )
             if task:
                 await ses.start_task(mode, task,
                                     session_store._operator_llm, session_store._planner_llm,
@@ -197,20 +583,15 @@ async def service_api(api):
             return jsonify(res)
 
         elif api=='store_file':
-            upfiles = await request.files
-            if 'file' not in upfiles:
-                return jsonify({'status': 'error', 'msg': 'No file part'})
-            
-            file = upfiles['file']
-            if file.filename is None or file.filename == '':
-                return jsonify({'status': 'error', 'msg': 'No selected file'})
-            
+            # multipart/form-data with a 'file' part, or the raw file with ?name=
+            length = request.content_length
+            if length is not None and length>ses.upload_max+UPLOAD_OVERHEAD:
+                return jsonify({'status': 'error', 'msg': f"file too large, limit {ses.upload_max>>20}MB"}), 413
             try:
-                # Read the file contents
-                content = file.read()
-                # Save file
-                await ses.store_file(file.filename, content)
+                await ses.receive_upload(request.body, request.content_type, request.args.get('name'), length=length)
                 return jsonify({'status': 'success', 'msg': ''})
+            except UploadError as e:
+                return jsonify({'status': 'error', 'msg': str(e)}), e.status
             except Exception as e:
                 return jsonify({'status': 'error', 'msg': str(e)})
 
@@ -225,20 +606,91 @@ async def service_api(api):
         except:
             pass
 
+def serve_worker(listen_fd:int, private_port:int) -> None:
+    """--workers child: serve the shared listening socket, and a private port for the sibling workers"""
+    config = HypercornConfig()
+    config.bind = [ f"fd://{listen_fd}", f"127.0.0.1:{private_port}" ]
+    try:
+        import uvloop
+        uvloop.install()
+    except ImportError:
+        pass
+    async def _serve():
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(sig, stop.set)
+        await hypercorn_serve(app, config, shutdown_trigger=stop.wait)
+    asyncio.run(_serve())
+
+def run_workers(args:argparse.Namespace) -> int:
+    """--workers: own the listening socket and keep the worker processes running on it"""
+    sock = socket.create_server(('0.0.0.0', args.port), backlog=1024)
+    sock.set_inheritable(True)
+    # session ownership of a previous run went away with its processes
+    os.makedirs(SessionsDir, exist_ok=True)
+    for suffix in ('','-wal','-shm'):
+        try:
+            os.remove(os.path.join(SessionsDir,'directory.db')+suffix)
+        except FileNotFoundError:
+            pass
+    def spawn(index:int) -> tuple[subprocess.Popen,float]:
+        cmd = [ sys.executable, os.path.abspath(__file__), *sys.argv[1:], '--worker-index', str(index), '--listen-fd', str(sock.fileno()) ]
+        return subprocess.Popen(cmd, pass_fds=(sock.fileno(),)), time.monotonic()
+    stopping = False
+    def on_signal(signum, frame) -> None:
+        nonlocal stopping
+        stopping = True
+    signal.signal(signal.SIGTERM, on_signal)
+    signal.signal(signal.SIGINT, on_signal)
+    procs = { index:spawn(index) for index in range(args.workers) }
+    print(f"### {args.workers} workers on port {args.port}, private ports {args.port+1}-{args.port+args.workers} ###")
+    rc = 0
+    try:
+        while not stopping:
+            time.sleep(1.0)
+            for index,(proc,started) in list(procs.items()):
+                if proc.poll() is None or stopping:
+                    continue
+                if time.monotonic()-started<10.0:
+                    # failing at startup, a restart would fail the same way
+                    logger.error(f"worker {index} exited with {proc.returncode} right after start")
+                    stopping, rc = True, 1
+                    break
+                logger.warning(f"worker {index} exited with {proc.returncode}, restarting")
+                procs[index] = spawn(index)
+    finally:
+        for proc,_ in procs.values():
+            if proc.poll() is None:
+                proc.send_signal(signal.SIGTERM)
+        end = time.monotonic() + float(os.getenv('BUW_SHUTDOWN_DEADLINE',str(SHUTDOWN_DEADLINE))) + 5.0
+        for proc,_ in procs.values():
+            try:
+                proc.wait(max(0.1, end-time.monotonic()))
+            except subprocess.TimeoutExpired:
+                proc.kill()
+        sock.close()
+    return rc
+
 def main():
-    # Environment check
-    check_result = subprocess.run(['bash', 'buweb/scripts/check_environment.sh'], 
-                                capture_output=True, text=True)
-    
-    # Always display standard output
-    if check_result.stdout:
-        print(check_result.stdout.strip())
-    if check_result.stderr:
-        print(check_result.stderr.strip(), file=sys.stderr)
-    
-    # Exit if there is an error
-    if check_result.returncode != 0:
-        sys.exit(1)
+    global CLUSTER_ROLE, COORDINATOR_URL, NODE_ID, NODE_URL, PUBLIC_HOST, CLUSTER_TOKEN
+    global LOCAL_WORKERS, WORKER_INDEX, directory, Pool, playwright_runtime, session_store
+    parser = argparse.ArgumentParser(description='BrowserUseWeb server')
+    parser.add_argument('--port', type=int, default=5000, help='listen port')
+    parser.add_argument('--coordinator', action='store_true', help='run as cluster coordinator: place sessions on workers and forward to them')
+    parser.add_argument('--join', metavar='URL', help='run as worker and register with the coordinator at URL')
+    parser.add_argument('--public-host', default='', help='host name of this worker that browsers can reach (noVNC connects to it directly)')
+    parser.add_argument('--advertise', metavar='URL', default='', help='URL the coordinator uses to reach this worker')
+    parser.add_argument('--node-id', default='', help='worker name in the cluster')
+    parser.add_argument('--port-slice', metavar='I/N', default='', help='use the I-th of N parts of the display and port ranges, for several workers on one host')
+    parser.add_argument('--workers', type=int, default=1, help='serve the port from N processes under hypercorn (uvloop if installed); they also listen on port+1..port+N on localhost')
+    parser.add_argument('--worker-index', type=int, default=-1, help=argparse.SUPPRESS)
+    parser.add_argument('--listen-fd', type=int, default=-1, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.coordinator and args.join:
+        parser.error('--coordinator and --join are exclusive')
+    if args.workers>1 and (args.coordinator or args.join):
+        parser.error('--workers cannot be used with --coordinator or --join')
 
     # Load .env file
     for envfile in ('config.env','.env'):
@@ -247,6 +699,52 @@ def main():
                 load_dotenv(envfile)
         except:
             pass
+    CLUSTER_TOKEN = os.getenv('BUW_CLUSTER_TOKEN','')
+    # log records are written by a listener thread, not by the code that logs them
+    atexit.register( install_queue_logging().stop )
+
+    if args.coordinator:
+        CLUSTER_ROLE = 'coordinator'
+    elif args.worker_index<0:
+        # Environment check
+        check_result = subprocess.run(['bash', 'buweb/scripts/check_environment.sh'], 
+                                    capture_output=True, text=True)
+        
+        # Always display standard output
+        if check_result.stdout:
+            print(check_result.stdout.strip())
+        if check_result.stderr:
+            print(check_result.stderr.strip(), file=sys.stderr)
+        
+        # Exit if there is an error
+        if check_result.returncode != 0:
+            sys.exit(1)
+
+    if args.workers>1 and args.worker_index<0:
+        sys.exit( run_workers(args) )
+
+    if args.join:
+        CLUSTER_ROLE = 'worker'
+        COORDINATOR_URL = args.join
+        PUBLIC_HOST = args.public_host or socket.gethostname()
+        NODE_ID = args.node_id or f"{socket.gethostname()}:{args.port}"
+        NODE_URL = args.advertise or f"http://{PUBLIC_HOST}:{args.port}"
+    if args.worker_index>=0:
+        LOCAL_WORKERS, WORKER_INDEX = args.workers, args.worker_index
+        NODE_ID = f"worker{WORKER_INDEX}"
+        NODE_URL = f"http://127.0.0.1:{args.port+1+WORKER_INDEX}"
+        PUBLIC_HOST = args.public_host
+    Pool = ThreadPoolExecutor(20)
+    playwright_runtime = PlaywrightPool(int(os.getenv('BUW_PW_LOOPS','4')))
+    # each local worker keeps its own sessions, profile template and trash
+    session_store = SessionStore( dir=os.path.join(SessionsDir, NODE_ID) if args.worker_index>=0 else SessionsDir, Pool=Pool, playwright=playwright_runtime )
+    if args.port_slice:
+        index, _, count = args.port_slice.partition('/')
+        session_store.ports.restrict(int(index), int(count))
+    if args.worker_index>=0:
+        session_store.ports.restrict(WORKER_INDEX, LOCAL_WORKERS)
+        session_store.configure(session_store._operator_llm, session_store._planner_llm, _worker_share(session_store._max_sessions))
+        directory = SessionDirectory(os.path.join(SessionsDir, 'directory.db'))
     # Signal handlers
     def sig_handler(signum, frame) -> None:
         sys.exit(1)
@@ -254,12 +752,16 @@ def main():
 
     try:
         # Start the server
-        app.run(host='0.0.0.0', port=5000, debug=False )
+        if args.worker_index>=0:
+            serve_worker(args.listen_fd, args.port+1+WORKER_INDEX)
+        else:
+            app.run(host='0.0.0.0', port=args.port, debug=False )
     finally:
         # Termination process
         signal.signal(signal.SIGTERM, signal.SIG_IGN)
         signal.signal(signal.SIGINT, signal.SIG_IGN)
-        cleanup_sessions()
+        if CLUSTER_ROLE != 'coordinator':
+            cleanup_sessions()
         signal.signal(signal.SIGTERM, signal.SIG_DFL)
         signal.signal(signal.SIGINT, signal.SIG_DFL)
 
@@ -1,4 +1,5 @@
 import json
+import asyncio
 import logging
 import pdb
 import traceback
@@ -132,7 +133,8 @@ class CustomAgent(Agent):
             max_input_tokens=max_input_tokens,
             validate_output=validate_output,
             message_context=message_context,
-            generate_gif=generate_gif,
+            # built in run(), in a thread: browser_use would draw it with PIL on the event loop
+            generate_gif=False,
             available_file_paths=available_file_paths,
             include_attributes=include_attributes,
             max_actions_per_step=max_actions_per_step,
@@ -147,6 +149,7 @@ class CustomAgent(Agent):
         )
         self.add_infos = add_infos
         self._writer:BuwWriter|None = writer
+        self._gif_path:str|None = generate_gif if isinstance(generate_gif,str) else 'agent_history.gif' if generate_gif else None
 		# Initialize message manager with state
         self._message_manager = CustomMessageManager(
             task=task,
@@ -290,6 +293,8 @@ class CustomAgent(Agent):
             return await super().run(max_steps)
         finally:
             self.custom_step_info = None
+            if self._gif_path:
+                await asyncio.to_thread(create_history_gif, task=self.task, history=self.state.history, output_path=self._gif_path)
 
     async def multi_act( self, actions: list[ActionModel], check_for_new_elements: bool = True ) -> list[ActionResult]:
         try:
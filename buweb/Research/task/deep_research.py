@@ -40,11 +40,16 @@ from typing import Callable
 def dmy_write(msg):
     pass
 
+def _write_text(path:str, text:str) -> None:
+    with open(path, "w", encoding="utf-8") as fw:
+        fw.write(text)
+
 async def deep_research(task:str, llm:BaseChatModel, agent_state=None,
                         browser:Browser|None=None,
                         browser_context:BrowserContext|None=None,
                         sensitive_data:dict|None=None,
                         writer:BuwWriter|None=None, inter:dict={},
+                        close_browser:bool=True,
                         **kwargs) ->tuple[str,str|None]:
     def log_info(msg):
         if writer:
@@ -205,12 +210,13 @@ Provide your output as a JSON formatted list. Each item in the list must adhere
             history_infos_ = json.dumps(history_infos, indent=4)
             query_prompt = f"This is search {search_iteration} of {max_search_iterations} maximum searches allowed.\n User Instruction:{task} \n Previous Queries:\n {history_query_} \n Previous Search Results:\n {history_infos_}\n"
             search_messages.append(HumanMessage(content=query_prompt))
-            ai_query_msg = llm.invoke(search_messages[:1] + search_messages[1:][-1:])
+            ai_query_msg = await llm.ainvoke(search_messages[:1] + search_messages[1:][-1:])
             search_messages.append(ai_query_msg)
             if hasattr(ai_query_msg, "reasoning_content"):
                 logTrans(f"{ititle} Reasoning",ai_query_msg.reasoning_content) # type:ignore
             ai_query_contents:str = ai_query_msg.content.replace("```json", "").replace("```", "")
-            ai_query_contenta = repair_json(ai_query_contents)
+            # repair_json and the writes below run in a thread: the event loop is shared with other sessions
+            ai_query_contenta = await asyncio.to_thread(repair_json, ai_query_contents)
             ai_query_content = json.loads(ai_query_contenta) # type: ignore
             query_plan = ai_query_content["plan"]
             logTrans(f"{ititle} Plan",query_plan)
@@ -265,9 +271,7 @@ Provide your output as a JSON formatted list. Each item in the list must adhere
                         continue
                     querr_save_path = os.path.join(query_result_dir, f"{search_iteration}-{i}.md")
                     logger.info(f"{title} save query: {query_tasks[i]} at {querr_save_path}")
-                    with open(querr_save_path, "w", encoding="utf-8") as fw:
-                        fw.write(f"Query: {query_tasks[i]}\n")
-                        fw.write(query_result)
+                    await asyncio.to_thread(_write_text, querr_save_path, f"Query: {query_tasks[i]}\n{query_result}")
 
                     # split query result in case the content is too long
                     query_results_split = query_result.split("Extracted page content:")
@@ -280,12 +284,12 @@ Provide your output as a JSON formatted list. Each item in the list must adhere
                         history_infos_ = json.dumps(history_infos, indent=4)
                         record_prompt = f"User Instruction:{task}. \nPrevious Recorded Information:\n {history_infos_}\n Current Search Iteration: {search_iteration}\n Current Search Plan:\n{query_plan}\n Current Search Query:\n {query_tasks[i]}\n Current Search Results: {query_result_}\n "
                         record_messages.append(HumanMessage(content=record_prompt))
-                        ai_record_msg = llm.invoke(record_messages[:1] + record_messages[-1:])
+                        ai_record_msg = await llm.ainvoke(record_messages[:1] + record_messages[-1:])
                         record_messages.append(ai_record_msg)
                         if hasattr(ai_record_msg, "reasoning_content"):
                             logTrans("Reason",ai_record_msg.reasoning_content) # type: ignore
                         record_content = ai_record_msg.content
-                        record_content = repair_json(record_content)
+                        record_content = await asyncio.to_thread(repair_json, record_content)
                         new_record_infos = json.loads(record_content)  # type: ignore
                         history_infos.extend(new_record_infos)
                 finally:
@@ -303,9 +307,11 @@ Provide your output as a JSON formatted list. Each item in the list must adhere
         log_error(f"Deep research Error: {e}")
         return await generate_final_report(task, history_infos, save_dir, llm, str(e))
     finally:
-        await safe_close(browser)
-        await safe_close(browser_context)
-        log_info("Browser closed.")
+        # a browser borrowed from the session stays open for its next task
+        if close_browser:
+            await safe_close(browser)
+            await safe_close(browser_context)
+            log_info("Browser closed.")
 
 async def generate_final_report(task, history_infos, save_dir, llm, error_msg=None, writer:BuwWriter|None=None ) ->tuple[str,str|None]:
     """Generate report from collected information with error handling"""
@@ -357,12 +363,11 @@ async def generate_final_report(task, history_infos, save_dir, llm, error_msg=No
         history_infos_ = json.dumps(history_infos, indent=4)
         record_json_path = os.path.join(save_dir, "record_infos.json")
         log_info(f"save All recorded information at {record_json_path}")
-        with open(record_json_path, "w") as fw:
-            json.dump(history_infos, fw, indent=4)
+        await asyncio.to_thread(_write_text, record_json_path, history_infos_)
         report_prompt = f"User Instruction:{task} \n Search Information:\n {history_infos_}"
         report_messages = [SystemMessage(content=writer_system_prompt),
                            HumanMessage(content=report_prompt)]  # New context for report generation
-        ai_report_msg = llm.invoke(report_messages)
+        ai_report_msg = await llm.ainvoke(report_messages)
         if hasattr(ai_report_msg, "reasoning_content"):
             log_info("🤯 Start Report Deep Thinking: ")
             log_info(ai_report_msg.reasoning_content)
@@ -378,8 +383,7 @@ async def generate_final_report(task, history_infos, save_dir, llm, error_msg=No
                             f"{report_content}"
             
         report_file_path = os.path.join(save_dir, "final_report.md")
-        with open(report_file_path, "w", encoding="utf-8") as f:
-            f.write(report_content)
+        await asyncio.to_thread(_write_text, report_file_path, report_content)
         log_info(f"Save Report at: {report_file_path}")
         return report_content, report_file_path
 
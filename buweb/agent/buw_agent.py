@@ -30,6 +30,7 @@ from typing import Callable, Optional, Dict,Literal, Type
 from pydantic import BaseModel
 from logging import Logger,getLogger,ERROR as LvError
 from buweb.model.translate import Translate
+from buweb.utils.metrics import STEP_SECONDS, TRANSLATE_SECONDS
 
 logger:Logger = getLogger(__name__)
 
@@ -43,12 +44,21 @@ class BuwWriter:
         self._n_agents:int=0
         self._n_steps:int=0
         self._n_actions:int=0
+        # start of the current agent step
+        self._step_t0:float|None = None
 
     async def trans(self, text:str|None) ->str|None:
         if text and self._trans:
-            return await self._trans.translate(text)
+            with TRANSLATE_SECONDS.time():
+                return await self._trans.translate(text)
         return text
 
+    def _end_step(self, next_step:bool) -> None:
+        now = time.monotonic()
+        if self._step_t0 is not None:
+            STEP_SECONDS.observe(now-self._step_t0)
+        self._step_t0 = now if next_step else None
+
     def print(self, *, header:str="", msg:str|dict="", progress:str|None=None):
         """
         header: task name
@@ -99,6 +109,8 @@ class BuwWriter:
         self.print( msg=f"Plan: {plan}",progress="")
 
     async def start_get_next_action(self, n_steps:int):
+        # a step runs from one model call to the next
+        self._end_step(True)
         self._n_steps = n_steps
         self._n_actions = 0
         if self._n_steps>1:
@@ -152,6 +164,7 @@ class BuwWriter:
             self.print( msg=f"extracted_content:{content}", progress="" )
 
     async def done_agent(self, history: AgentHistoryList):
+        self._end_step(False)
         self._agent_task = ""
         self._n_steps = 0
         self._n_actions = 0
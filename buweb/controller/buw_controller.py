@@ -32,6 +32,7 @@ import pyperclip
 from logging import Logger,getLogger
 
 from buweb.agent.buw_agent import BuwWriter
+from buweb.utils.metrics import ACTION_SECONDS
 
 logger:Logger = getLogger(__name__)
 
@@ -182,7 +183,9 @@ class BwController(Controller):
 
         if self.act_callback is not None:
             await self.act_callback(action)
-        ret = await super().act(action,browser_context,page_extraction_llm,sensitive_data,available_file_paths,context)
+        names = [ name for name,params in action.model_dump(exclude_unset=True).items() if params is not None ]
+        with ACTION_SECONDS.time( names[0] if names else 'unknown' ):
+            ret = await super().act(action,browser_context,page_extraction_llm,sensitive_data,available_file_paths,context)
         if self.act_callback is not None:
             await self.act_callback(ret)
         return ret
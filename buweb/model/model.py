@@ -18,6 +18,7 @@ from langchain_core.caches import InMemoryCache
 from langchain_community.cache import SQLiteCache
 from langchain_google_genai import ChatGoogleGenerativeAI
 from langchain_core.rate_limiters import BaseRateLimiter, InMemoryRateLimiter
+from langchain_core.callbacks import BaseCallbackHandler
 from google.api_core.exceptions import ResourceExhausted as GoogleResourceExhausted
 from openai import RateLimitError as OpenaiRateLimitError
 
@@ -35,68 +36,29 @@ import asyncio
 from typing import Callable, Optional, Dict,Literal, Type
 from pydantic import BaseModel
 from logging import Logger,getLogger
+from uuid import UUID
+
+from buweb.utils.metrics import LLM_SECONDS
+from buweb.model.rate_limit import RateBucket, RateLimits, get_registry
 
 logger:Logger = getLogger(__name__)
 
 os.environ["ANONYMIZED_TELEMETRY"] = "false"
 
 class CustomRateLimiter(BaseRateLimiter):
-    def __init__(self, requests_per_minute:int, requests_per_day:int, record_file_path:str|None ):
-        self.requests_per_minute = requests_per_minute
-        self.requests_per_day = requests_per_day
-        self.requests_in_day:int = 0
-        self.requests_in_minute:list[float] = []
-        dt = datetime.now().strftime("%Y-%m-%d")
-        self.current_date = dt
-        self.record_file_path = record_file_path
-        if record_file_path and os.path.exists(record_file_path):
-            with open(record_file_path, "r") as fr:
-                aaa = json.load(fr)
-                b = aaa.get(f'requests_in_{dt}',0.0)
-                if isinstance(b,int|float):
-                    self.requests_in_day = int(b)
-                c = aaa.get('requests_in_minute',[])
-                if isinstance(c,list):
-                    self.requests_in_minute = c
-    def _save(self,dt):
-        if self.record_file_path:
-            with open(self.record_file_path, "w") as fr:
-                json.dump( {f'requests_in_{dt}': self.requests_in_day, 'requests_in_minute': self.requests_in_minute},fr)
-
-    def _can_acquire(self) ->bool:
-        dt = datetime.now().strftime("%Y-%m-%d")
-        if dt != self.current_date:
-            self.requests_in_day = 0
-            self.current_date = dt
-        if self.requests_in_day>=self.requests_per_day:
-            print(f"RateLimit: requests per day {self.requests_in_day}/{self.requests_per_day}")
-            return False
-        now = time.time()
-        while len(self.requests_in_minute)>0 and now-self.requests_in_minute[0]>60.0:
-            print(f"RateLimit: RPM {len(self.requests_in_minute)}/{self.requests_per_minute}")
-            self.requests_in_minute.pop(0)
-        if len(self.requests_in_minute)>=self.requests_per_minute:
-            return False
-        self.requests_in_day += 1
-        self.requests_in_minute.append(now)
-        self._save(dt)
-        return True
+    """langchain rate limiter on a RateBucket; models of the same provider and model share one bucket"""
+
+    def __init__(self, requests_per_minute:int|None=None, requests_per_day:int|None=None, record_file_path:str|None=None, *,
+                 tokens_per_minute:int|None=None, bucket:RateBucket|None=None):
+        if bucket is None:
+            bucket = RateBucket('custom', RateLimits(requests_per_minute, requests_per_day, tokens_per_minute), record_file_path)
+        self.bucket:RateBucket = bucket
 
     def acquire(self, *, blocking: bool = True) -> bool:
-        if blocking:
-            while not self._can_acquire():
-                time.sleep(1.0)
-            return True
-        else:
-            return self._can_acquire()
+        return self.bucket.acquire(blocking=blocking)
 
     async def aacquire(self, *, blocking: bool = True) -> bool:
-        if blocking:
-            while not self._can_acquire():
-                await asyncio.sleep(1.0)
-            return True
-        else:
-            return self._can_acquire()
+        return await self.bucket.aacquire(blocking=blocking)
 
 class CustomChatGoogleGenerativeAI(ChatGoogleGenerativeAI):
 
@@ -192,14 +154,61 @@ class LLM(Enum):
                 return llm
         return None
 
+class LlmMetricsCallback(BaseCallbackHandler):
+    """Records the latency of every call of one model"""
+    # called in the caller's thread, no executor hop
+    run_inline = True
+
+    def __init__(self, llm_name:str):
+        self._llm_name:str = llm_name
+        self._t0:dict[UUID,float] = {}
+
+    def on_chat_model_start(self, serialized, messages, *, run_id:UUID, **kwargs) -> None:
+        self._t0[run_id] = time.monotonic()
+
+    def on_llm_start(self, serialized, prompts, *, run_id:UUID, **kwargs) -> None:
+        self._t0[run_id] = time.monotonic()
+
+    def on_llm_end(self, response, *, run_id:UUID, **kwargs) -> None:
+        t0 = self._t0.pop(run_id, None)
+        if t0 is not None:
+            LLM_SECONDS.observe(time.monotonic()-t0, self._llm_name)
+
+    def on_llm_error(self, error, *, run_id:UUID, **kwargs) -> None:
+        self._t0.pop(run_id, None)
+
+class TokenUsageCallback(BaseCallbackHandler):
+    """Charges the tokens of every completed call to the model's rate limit"""
+    run_inline = True
+
+    def __init__(self, bucket:RateBucket):
+        self._bucket:RateBucket = bucket
+
+    def on_llm_end(self, response, *, run_id:UUID, **kwargs) -> None:
+        tokens = 0
+        for gens in response.generations:
+            for gen in gens:
+                usage = getattr(getattr(gen,'message',None),'usage_metadata',None)
+                if usage:
+                    tokens += usage.get('total_tokens',0)
+        if not tokens and response.llm_output:
+            tokens = (response.llm_output.get('token_usage') or {}).get('total_tokens',0)
+        self._bucket.charge_tokens(tokens)
+
 def create_model( model:str|LLM,temperature:float=0.0,cache:BaseCache|None=None) -> BaseChatModel:
     llm = LLM.get_llm(model)
     if llm:
+        callbacks:list[BaseCallbackHandler] = [LlmMetricsCallback(llm.name)]
+        # shared by every model of this provider and model in all processes of the server
+        bucket = get_registry().bucket(llm._grp.name, llm._full_name)
+        rate_limiter = CustomRateLimiter(bucket=bucket) if bucket is not None else None
+        if bucket is not None:
+            callbacks.append(TokenUsageCallback(bucket))
         if llm._grp==LLMProvider.openai:
             openai_api_key = os.getenv('OPENAI_API_KEY')
             if not openai_api_key:
                 raise ValueError('OPENAI_API_KEY is not set')
-            return ChatOpenAI(model=llm._full_name, temperature=temperature, cache=cache)
+            return ChatOpenAI(model=llm._full_name, temperature=temperature, cache=cache, callbacks=callbacks, rate_limiter=rate_limiter)
         elif llm._grp==LLMProvider.google:
             kw = None
             if os.getenv('GEMINI_API_KEY') is not None:
@@ -209,12 +218,12 @@ def create_model( model:str|LLM,temperature:float=0.0,cache:BaseCache|None=None)
             if kw is None:
                 raise ValueError('GEMINI_API_KEY or GOOGLE_API_KEY is not set')
             if llm==LLM.Gemini20FlashThink:
-                return CustomChatGoogleGenerativeAI(model=llm._full_name, cache=cache, api_key=kw)
+                return CustomChatGoogleGenerativeAI(model=llm._full_name, cache=cache, api_key=kw, callbacks=callbacks, rate_limiter=rate_limiter)
             else:
-                return CustomChatGoogleGenerativeAI(model=llm._full_name,temperature=temperature, cache=cache, api_key=kw)
+                return CustomChatGoogleGenerativeAI(model=llm._full_name,temperature=temperature, cache=cache, api_key=kw, callbacks=callbacks, rate_limiter=rate_limiter)
         elif llm._grp==LLMProvider.ollama:
             ollama_url = os.getenv('OLLAMA_HOST')
             if not ollama_url:
                 raise ValueError('OLLAMA_HOST is not set')
-            return ChatOllama(model=llm._full_name, num_ctx=llm._sz, cache=cache)
+            return ChatOllama(model=llm._full_name, num_ctx=llm._sz, cache=cache, callbacks=callbacks, rate_limiter=rate_limiter)
     raise ValueError(f"Invalid model name: {model}")
\ No newline at end of file
@@ -0,0 +1,260 @@
+import os
+import time
+import mmap
+import fcntl
+import struct
+import asyncio
+import atexit
+import threading
+from datetime import datetime, timedelta
+from typing import NamedTuple, Iterator
+from contextlib import contextmanager
+from logging import Logger,getLogger
+
+from buweb.utils.metrics import RATE_LIMIT_WAIT_SECONDS
+
+logger:Logger = getLogger(__name__)
+
+# state files shared by every process of the server, unless BUW_RATE_LIMIT_DIR says otherwise;
+# '' keeps the budgets in this process only
+RATE_LIMIT_DIR:str = os.path.join('tmp','ratelimit')
+# seconds between writes of the counters to disk
+PERSIST_INTERVAL:float = 5.0
+
+class RateLimits(NamedTuple):
+    """None for no limit"""
+    rpm:int|None = None
+    rpd:int|None = None
+    tpm:int|None = None
+
+    @property
+    def unlimited(self) -> bool:
+        return self.rpm is None and self.rpd is None and self.tpm is None
+
+def parse_limits(spec:str) -> dict[str,RateLimits]:
+    """'gemini-2.0-flash-exp=10/1500/1000000,openai=500//' -> limits by model or provider name"""
+    res:dict[str,RateLimits] = {}
+    for item in spec.replace(';',',').split(','):
+        name, _, values = item.strip().partition('=')
+        if not name or not values:
+            continue
+        parts = [ v.strip() for v in values.split('/') ]
+        if len(parts)>3:
+            raise ValueError(f"invalid rate limit {item}")
+        nums = [ int(v) if v else None for v in parts ] + [None]*(3-len(parts))
+        res[name.strip()] = RateLimits(*nums)
+    return res
+
+def _midnight(now:float) -> float:
+    """Start of the next local day, when the daily count resets"""
+    day = datetime.fromtimestamp(now).date()+timedelta(days=1)
+    return datetime(day.year, day.month, day.day).timestamp()
+
+def _on_event_loop() -> bool:
+    try:
+        asyncio.get_running_loop()
+        return True
+    except RuntimeError:
+        return False
+
+# rpm tokens, tpm tokens, last refill time, day ordinal, requests in that day
+_STATE = struct.Struct('<dddqq')
+
+class RateBucket:
+    """Token buckets for requests per minute and tokens per minute, and a daily request count
+
+    The state is 40 bytes in a bytearray, or in a memory mapped file that every
+    process of the server maps, guarded by flock for the few microseconds of each
+    update. Tokens are only known after a call, so they are charged afterwards and
+    the bucket may go into debt; new requests wait until it is paid back.
+    """
+
+    def __init__(self, key:str, limits:RateLimits, path:str|None=None):
+        self.key:str = key
+        self.limits:RateLimits = limits
+        self.path:str|None = path
+        self._lock:threading.Lock = threading.Lock()
+        self._fd:int = -1
+        self._buf:bytearray|mmap.mmap
+        self._dirty:bool = False
+        self._persisted:float = time.monotonic()
+        if path:
+            os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+            self._fd = os.open(path, os.O_RDWR|os.O_CREAT, 0o644)
+            with self._flock():
+                size = os.fstat(self._fd).st_size
+                if size not in (0, _STATE.size):
+                    # not a state file, such as the JSON record of the old limiter: start from full buckets
+                    logger.warning(f"rate limit {key}: replacing {path}, {size} bytes is not a state file")
+                    os.ftruncate(self._fd, 0)
+                if size!=_STATE.size:
+                    os.ftruncate(self._fd, _STATE.size)
+            self._buf = mmap.mmap(self._fd, _STATE.size)
+        else:
+            self._buf = bytearray(_STATE.size)
+
+    @contextmanager
+    def _flock(self) -> Iterator[None]:
+        if self._fd<0:
+            yield
+            return
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def _refill(self, now:float) -> tuple[float,float,int,int]:
+        rpm_level, tpm_level, last, day, count = _STATE.unpack_from(self._buf)
+        rpm, tpm = self.limits.rpm or 0, self.limits.tpm or 0
+        if last<=0.0:
+            # a new state starts with full buckets
+            rpm_level, tpm_level, last = float(rpm), float(tpm), now
+        elapsed = max(0.0, now-last)
+        rpm_level = min(float(rpm), rpm_level+elapsed*rpm/60.0)
+        tpm_level = min(float(tpm), tpm_level+elapsed*tpm/60.0)
+        today = datetime.fromtimestamp(now).toordinal()
+        if day!=today:
+            day, count = today, 0
+        return rpm_level, tpm_level, day, count
+
+    def _wait_time(self, now:float, rpm_level:float, tpm_level:float, count:int) -> float:
+        """0.0 when a request can go now, otherwise the seconds until it can"""
+        wait = 0.0
+        if self.limits.rpd is not None and count>=self.limits.rpd:
+            wait = max(wait, _midnight(now)-now)
+        if self.limits.rpm is not None and rpm_level<1.0:
+            wait = max(wait, (1.0-rpm_level)*60.0/max(1,self.limits.rpm))
+        if self.limits.tpm is not None and tpm_level<0.0:
+            wait = max(wait, -tpm_level*60.0/max(1,self.limits.tpm))
+        return wait
+
+    def try_acquire(self) -> float:
+        """Take one request if the limits allow it; returns 0.0, or the seconds to wait before trying again"""
+        if self.limits.unlimited:
+            return 0.0
+        with self._lock, self._flock():
+            now = time.time()
+            rpm_level, tpm_level, day, count = self._refill(now)
+            wait = self._wait_time(now, rpm_level, tpm_level, count)
+            if wait<=0.0:
+                rpm_level -= 1.0
+                count += 1
+            _STATE.pack_into(self._buf, 0, rpm_level, tpm_level, now, day, count)
+            self._dirty = True
+        self._maybe_persist()
+        return wait
+
+    def charge_tokens(self, tokens:int) -> None:
+        """Tokens used by a call that has completed"""
+        if self.limits.tpm is None or tokens<=0:
+            return
+        with self._lock, self._flock():
+            now = time.time()
+            rpm_level, tpm_level, day, count = self._refill(now)
+            _STATE.pack_into(self._buf, 0, rpm_level, tpm_level-tokens, now, day, count)
+            self._dirty = True
+        self._maybe_persist()
+
+    def acquire(self, *, blocking:bool=True) -> bool:
+        """Waits with time.sleep: not for an event loop thread, where aacquire is the one to use"""
+        if blocking and _on_event_loop():
+            raise RuntimeError(f"rate limit {self.key}: blocking acquire on an event loop, use aacquire")
+        waited = 0.0
+        while (wait:=self.try_acquire())>0.0:
+            if not blocking:
+                return False
+            if waited==0.0:
+                logger.info(f"rate limit {self.key}: waiting {wait:.1f}s")
+            time.sleep(wait)
+            waited += wait
+        if waited>0.0:
+            RATE_LIMIT_WAIT_SECONDS.observe(waited, self.key)
+        return True
+
+    async def aacquire(self, *, blocking:bool=True) -> bool:
+        waited = 0.0
+        while (wait:=self.try_acquire())>0.0:
+            if not blocking:
+                return False
+            if waited==0.0:
+                logger.info(f"rate limit {self.key}: waiting {wait:.1f}s")
+            # wakes when the bucket has refilled, another waiter may still take it first
+            await asyncio.sleep(wait)
+            waited += wait
+        if waited>0.0:
+            RATE_LIMIT_WAIT_SECONDS.observe(waited, self.key)
+        return True
+
+    def get_status(self) -> dict:
+        with self._lock, self._flock():
+            rpm_level, tpm_level, day, count = self._refill(time.time())
+        return { 'key': self.key, 'limits': self.limits._asdict(), 'rpm_tokens': round(rpm_level,2),
+                 'tpm_tokens': round(tpm_level), 'requests_today': count }
+
+    def _maybe_persist(self) -> None:
+        if self._dirty and isinstance(self._buf, mmap.mmap) and time.monotonic()-self._persisted>=PERSIST_INTERVAL:
+            self.persist()
+
+    def persist(self) -> None:
+        """Write the counters to disk; other processes see them without this"""
+        with self._lock:
+            if self._dirty and isinstance(self._buf, mmap.mmap):
+                self._buf.flush()
+            self._dirty = False
+            self._persisted = time.monotonic()
+
+    def close(self) -> None:
+        self.persist()
+        with self._lock:
+            if isinstance(self._buf, mmap.mmap):
+                self._buf.close()
+                self._buf = bytearray(_STATE.size)
+            if self._fd>=0:
+                os.close(self._fd)
+                self._fd = -1
+
+class RateLimitRegistry:
+    """One bucket per provider and model for the whole process"""
+
+    def __init__(self, limits:dict[str,RateLimits], dir:str):
+        self.limits:dict[str,RateLimits] = limits
+        self.dir:str = dir
+        self._lock:threading.Lock = threading.Lock()
+        self._buckets:dict[str,RateBucket] = {}
+
+    def limits_for(self, provider:str, model:str) -> RateLimits:
+        return self.limits.get(model) or self.limits.get(provider) or RateLimits()
+
+    def bucket(self, provider:str, model:str) -> RateBucket|None:
+        """None when no limits are configured for the model"""
+        key = f"{provider}:{model}"
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                limits = self.limits_for(provider, model)
+                if limits.unlimited:
+                    return None
+                path = os.path.join(self.dir, key.replace('/','_').replace(':','_')+'.bucket') if self.dir else None
+                bucket = self._buckets[key] = RateBucket(key, limits, path)
+            return bucket
+
+    def close(self) -> None:
+        with self._lock:
+            for bucket in self._buckets.values():
+                bucket.close()
+            self._buckets.clear()
+
+_registry:RateLimitRegistry|None = None
+_registry_lock:threading.Lock = threading.Lock()
+
+def get_registry() -> RateLimitRegistry:
+    """Limits come from BUW_RATE_LIMITS and BUW_RATE_LIMIT_DIR, read here, after the .env file
+    is loaded, because task processes create models too"""
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            _registry = RateLimitRegistry(parse_limits(os.getenv('BUW_RATE_LIMITS','')), os.getenv('BUW_RATE_LIMIT_DIR', RATE_LIMIT_DIR))
+            # the counters of the last few seconds
+            atexit.register(_registry.close)
+        return _registry
@@ -3,6 +3,7 @@ import asyncio
 import json
 import logging
 import time
+import threading
 from typing import TypedDict
 from googletrans import Translator
 
@@ -22,6 +23,9 @@ class Translate:
         self._cache: dict[str, TransEntry] = {}  # {text: {"translation": translated_text, "tm": access_time}}
         self.cachefile = cachefile
         self._current_size = 0 # Current cache size (estimated)
+        # saves run in a worker thread, one at a time; a save writes every entry added before it
+        self._save_lock = threading.Lock()
+        self._dirty = False
         
         # Configuring the logger
         self.logger = logging.getLogger(__name__)
@@ -79,15 +83,28 @@ class Translate:
         
         # If a cache file is specified, try to save it
         if self.cachefile:
+            self._dirty = True
+            # the file is several MB: keep the dump off the event loop, which other sessions share
+            await asyncio.to_thread(self._save)
+        
+        return to_text
+    
+    def _save(self):
+        with self._save_lock:
+            if not self._dirty:
+                return
+            self._dirty = False
+            snapshot = dict(self._cache)
             try:
-                with open(self.cachefile, 'w', encoding='utf-8') as f:
-                    json.dump(self._cache, f, ensure_ascii=False, indent=2)
+                # write a temporary file and rename it, so that task processes sharing the file never read half of it
+                tmpfile = f"{self.cachefile}.{os.getpid()}.tmp"
+                with open(tmpfile, 'w', encoding='utf-8') as f:
+                    json.dump(snapshot, f, ensure_ascii=False, indent=2)
+                os.replace(tmpfile, self.cachefile)
             except Exception as e:
                 self.logger.error(f"Failed to save cache to {self.cachefile}: {str(e)}")
                 # Processing continues even if saving fails
-        
-        return to_text
-    
+
     def _trim_cache(self, needed_space):
         """Remove old entries from the cache to free up the specified amount of space"""
         if needed_space > self.MAX_CACHE_SIZE:
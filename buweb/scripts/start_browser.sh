@@ -9,6 +9,7 @@ workdir="$HOME/tmp"
 hosts=""
 cdpport=""
 wsport=""
+headless=""
 
 pid_vnc=""
 pid_ws=""
@@ -62,6 +63,10 @@ while [[ $# -gt 0 ]]; do
       cdpport=$2
       shift 2
       ;;
+    --headless)
+      headless="1"
+      shift
+      ;;
     --wsport)
       if [ -z "$2" ]; then
           echo "ERROR: invalid option wsport $2" >&2
@@ -104,7 +109,12 @@ if [ ! -x "$CHROME_BIN" ]; then
 fi
 
 CHROME_OPT=""
-CHROME_OPT="$CHROME_OPT --no-first-run --no-default-browser-check --disable-infobars --ozone-platform=x11"
+CHROME_OPT="$CHROME_OPT --no-first-run --no-default-browser-check --disable-infobars"
+if [ -n "$headless" ]; then
+    CHROME_OPT="$CHROME_OPT --headless=new"
+else
+    CHROME_OPT="$CHROME_OPT --ozone-platform=x11"
+fi
 CHROME_OPT="$CHROME_OPT --disable-sync --password-store=basic"
 CHROME_OPT="$CHROME_OPT --disable-extensions --disable-metrics --disable-metrics-reporting --disable-crash-reporter --disable-logging"
 CHROME_OPT="$CHROME_OPT --disable-smooth-scrolling --disable-spell-checking --disable-remote-fonts --disable-dev-shm-usage"
@@ -119,11 +129,11 @@ export GOOGLE_API_KEY=no
 export GOOGLE_DEFAULT_CLIENT_ID=no
 export GOOGLE_DEFAULT_CLIENT_SECRET=no
 
-if [ -n "$display_num" ]; then
+if [ -n "$display_num" -a -z "$headless" ]; then
     export DISPLAY=":${display_num}"
 fi
 
-BWRAP_OPT="--bind / / --dev /dev --bind /tmp /tmp"
+BWRAP_OPT="--die-with-parent --bind / / --dev /dev --bind /tmp /tmp"
 if [ -n "$workdir" ]; then
     mkdir -p "$workdir"
     BWRAP_OPT="$BWRAP_OPT --bind $workdir $HOME --chdir $HOME"
@@ -6,19 +6,15 @@ echo "$ScrDir/$ScrName $*"
 
 display_num="10"
 geometry="1024x768"
+depth="24"
+framerate="60"
 rfbport="5910"
-wsport="5920"
 
 pid_vnc=""
-pid_ws=""
 
 function fn_cleanup(){
   echo "cleanup" >&2
   set +u +e
-  if [ -n "$pid_ws" ]; then
-    echo "cleanup kill ws $pid_ws" >&2
-    kill -9 "$pid_ws"
-  fi
   if [ -n "$pid_vnc" ]; then
     echo "cleanup kill vnc $pid_vnc" >&2
     kill -9 "$pid_vnc"
@@ -45,20 +41,28 @@ while [[ $# -gt 0 ]]; do
       geometry=$2
       shift 2
       ;;
-    --rfbport)
+    --depth)
+      if [ "$2" != "16" -a "$2" != "24" ]; then
+          echo "ERROR: invalid option depth $2" >&2
+          exit 5
+      fi
+      depth=$2
+      shift 2
+      ;;
+    --framerate)
       if [ -z "$2" ]; then
-          echo "ERROR: invalid option rfbport $2" >&2
+          echo "ERROR: invalid option framerate $2" >&2
           exit 5
       fi
-      rfbport=$2
+      framerate=$2
       shift 2
       ;;
-    --wsport)
+    --rfbport)
       if [ -z "$2" ]; then
-          echo "ERROR: invalid option wsport $2" >&2
+          echo "ERROR: invalid option rfbport $2" >&2
           exit 5
       fi
-      wsport=$2
+      rfbport=$2
       shift 2
       ;;
     *)
@@ -67,30 +71,18 @@ while [[ $# -gt 0 ]]; do
   esac
 done
 
-if [ -z "$display_num" -o -z "$geometry" -o -z "$rfbport" -o -z "$wsport" ]; then
+if [ -z "$display_num" -o -z "$geometry" -o -z "$rfbport" ]; then
     echo "ERROR: invalid option" >&2
     exit 2
 fi
 
-if [ -n "${VIRTUAL_ENV:-}" -a -f "$VIRTUAL_ENV/bin/activate" ]; then
-  if ! type deactivate >/dev/null 2>&1; then
-    source "$VIRTUAL_ENV/bin/activate"
-  fi
-fi
-
 if ! type Xvnc >/dev/null 2>&1 ; then
     echo "ERROR: not found Xvnc" >&2
     exit 2
 fi
 
-if ! type websockify >/dev/null 2>&1 ; then
-    echo "ERROR: not found websockify" >&2
-    exit 2
-fi
-
-VNC_OPT="-depth 24 -SecurityTypes None -localhost -alwaysshared -ac -quiet"
-Xvnc ":$display_num" -geometry "$geometry" -rfbport "$rfbport" $VNC_OPT >/dev/null 2>&1 &
+# websockify is started by start_websockify.sh when a viewer attaches
+VNC_OPT="-SecurityTypes None -localhost -alwaysshared -ac -quiet"
+Xvnc ":$display_num" -geometry "$geometry" -depth "$depth" -FrameRate "$framerate" -rfbport "$rfbport" $VNC_OPT >/dev/null 2>&1 &
 pid_vnc=$!
-websockify --heartbeat 30 0.0.0.0:${wsport} localhost:${rfbport} >/dev/null 2>&1 &
-pid_ws=$!
 wait
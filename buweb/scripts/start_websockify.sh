@@ -0,0 +1,60 @@
+#!/bin/bash
+set -ue
+ScrDir=$(cd $(dirname $0);pwd)
+ScrName=$(basename $0)
+echo "$ScrDir/$ScrName $*"
+
+rfbport="5910"
+wsport="5920"
+idle_timeout="0"
+
+while [[ $# -gt 0 ]]; do
+  key="$1"
+  case $key in
+    --rfbport)
+      if [ -z "$2" ]; then
+          echo "ERROR: invalid option rfbport $2" >&2
+          exit 5
+      fi
+      rfbport=$2
+      shift 2
+      ;;
+    --wsport)
+      if [ -z "$2" ]; then
+          echo "ERROR: invalid option wsport $2" >&2
+          exit 5
+      fi
+      wsport=$2
+      shift 2
+      ;;
+    --idle-timeout)
+      if [ -z "$2" ]; then
+          echo "ERROR: invalid option idle-timeout $2" >&2
+          exit 5
+      fi
+      idle_timeout=$2
+      shift 2
+      ;;
+    *)
+     exit 5
+     ;;
+  esac
+done
+
+if [ -n "${VIRTUAL_ENV:-}" -a -f "$VIRTUAL_ENV/bin/activate" ]; then
+  if ! type deactivate >/dev/null 2>&1; then
+    source "$VIRTUAL_ENV/bin/activate"
+  fi
+fi
+
+if ! type websockify >/dev/null 2>&1 ; then
+    echo "ERROR: not found websockify" >&2
+    exit 2
+fi
+
+WS_OPT="--heartbeat 30"
+if [ "$idle_timeout" != "0" ]; then
+    # exit when the last viewer has been gone for this many seconds
+    WS_OPT="$WS_OPT --idle-timeout $idle_timeout"
+fi
+exec websockify $WS_OPT 0.0.0.0:${wsport} localhost:${rfbport} >/dev/null 2>&1
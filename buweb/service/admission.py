@@ -0,0 +1,115 @@
+import math
+import time
+import heapq
+import itertools
+import asyncio
+from collections import deque
+from typing import Callable
+
+PRIORITY_HIGH:int = 0
+PRIORITY_NORMAL:int = 1
+PRIORITY_LOW:int = 2
+
+class Ticket:
+    """A client's place in the admission queue"""
+
+    def __init__(self, priority:int, seq:int):
+        self.priority:int = priority
+        self.seq:int = seq
+        self.enqueued:float = time.monotonic()
+        self.granted:bool = False
+        self.cancelled:bool = False
+        self.used:bool = False
+        self._event:asyncio.Event = asyncio.Event()
+
+    def __lt__(self, other:"Ticket") -> bool:
+        return (self.priority,self.seq) < (other.priority,other.seq)
+
+    async def wait(self, timeout:float|None=None) -> bool:
+        """Wait until a slot is granted, and return whether it was"""
+        try:
+            await asyncio.wait_for(self._event.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        return self.granted
+
+class AdmissionQueue:
+    """FIFO queue with priority classes in front of the session slots
+
+    A slot is granted to the head of the queue the moment one is free, and stays
+    reserved for that ticket until the session is created or the ticket is cancelled.
+    """
+
+    def __init__(self, free_slots:Callable[[],int], *, history:int=20):
+        self._free_slots:Callable[[],int] = free_slots
+        self._heap:list[Ticket] = []
+        self._seq = itertools.count()
+        self._waiting:int = 0
+        self._reserved:int = 0
+        # recent session lifetimes, used to estimate the wait
+        self._durations:deque[float] = deque(maxlen=history)
+
+    @property
+    def depth(self) -> int:
+        return self._waiting
+
+    def available(self) -> int:
+        """Free slots that are not reserved for a granted ticket"""
+        return self._free_slots()-self._reserved
+
+    def enter(self, priority:int=PRIORITY_NORMAL) -> Ticket:
+        ticket = Ticket(priority, next(self._seq))
+        heapq.heappush(self._heap, ticket)
+        self._waiting += 1
+        self.wake()
+        return ticket
+
+    def wake(self) -> None:
+        """Grant free slots to the tickets at the head of the queue"""
+        while self._heap and self.available()>0:
+            ticket = heapq.heappop(self._heap)
+            if ticket.cancelled:
+                continue
+            self._waiting -= 1
+            self._reserved += 1
+            ticket.granted = True
+            ticket._event.set()
+        # drop cancelled tickets at the head
+        while self._heap and self._heap[0].cancelled:
+            heapq.heappop(self._heap)
+
+    def use(self, ticket:Ticket) -> None:
+        """The granted slot is now taken by a session"""
+        if ticket.granted and not ticket.used:
+            ticket.used = True
+            self._reserved -= 1
+
+    def cancel(self, ticket:Ticket) -> None:
+        """The client left: give up its place or its reserved slot"""
+        if ticket.used or ticket.cancelled:
+            return
+        ticket.cancelled = True
+        if ticket.granted:
+            self._reserved -= 1
+        else:
+            self._waiting -= 1
+        self.wake()
+
+    def position(self, ticket:Ticket) -> int:
+        """1-based position among the waiting tickets, 0 once granted"""
+        if ticket.granted or ticket.cancelled:
+            return 0
+        return 1 + sum( 1 for t in self._heap if not t.cancelled and t<ticket )
+
+    def record_duration(self, sec:float) -> None:
+        self._durations.append(sec)
+
+    def eta(self, position:int, slots:int) -> float|None:
+        """Estimated seconds until the ticket at this position gets a slot"""
+        if position<=0:
+            return 0.0
+        if not self._durations or slots<=0:
+            return None
+        avg = sum(self._durations)/len(self._durations)
+        # about half a lifetime until the first slot frees, then one lifetime per round
+        return avg * (math.ceil(position/slots) - 0.5)
@@ -0,0 +1,143 @@
+import os
+import gzip
+import time
+import hashlib
+import mimetypes
+from typing import NamedTuple
+from logging import Logger,getLogger
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+logger:Logger = getLogger(__name__)
+
+# smaller files are not worth a Content-Encoding
+MIN_COMPRESS:int = 512
+COMPRESSIBLE:tuple[str,...] = ('text/','application/javascript','application/json','application/xml','image/svg+xml','application/wasm')
+mimetypes.add_type('application/javascript', '.mjs')
+
+class Variant(NamedTuple):
+    body:bytes
+    etag:str
+    # '' for identity
+    encoding:str
+
+class Asset(NamedTuple):
+    content_type:str
+    mtime:float
+    # by encoding, always with ''
+    variants:dict[str,Variant]
+
+def _compressible(content_type:str) -> bool:
+    return content_type.startswith(COMPRESSIBLE)
+
+def build_asset(path:str) -> Asset:
+    with open(path,'rb') as f:
+        data = f.read()
+    content_type = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+    if content_type.startswith('text/') or content_type=='application/javascript':
+        content_type += '; charset=utf-8'
+    tag = hashlib.blake2b(data, digest_size=12).hexdigest()
+    # strong validators, one per representation
+    variants = { '': Variant(data, f'"{tag}"', '') }
+    if len(data)>=MIN_COMPRESS and _compressible(content_type):
+        gz = gzip.compress(data, 9, mtime=0)
+        if len(gz)<len(data):
+            variants['gzip'] = Variant(gz, f'"{tag}-gz"', 'gzip')
+        if brotli is not None:
+            br = brotli.compress(data, mode=brotli.MODE_TEXT, quality=11)
+            if len(br)<len(data):
+                variants['br'] = Variant(br, f'"{tag}-br"', 'br')
+    return Asset(content_type, os.path.getmtime(path), variants)
+
+def accepted(accept_encoding:str) -> set[str]:
+    """Encodings the client takes, ignoring those with q=0"""
+    res:set[str] = set()
+    for part in accept_encoding.split(','):
+        name, _, params = part.strip().partition(';')
+        q = params.strip()
+        if q.startswith('q=') and q[2:].strip() in ('0','0.0','0.00','0.000'):
+            continue
+        if name:
+            res.add(name.strip().lower())
+    return res
+
+def etag_matches(if_none_match:str, asset:Asset) -> bool:
+    """If-None-Match names one of the asset's representations (weak comparison)"""
+    if if_none_match.strip()=='*':
+        return True
+    tags = { t.strip().removeprefix('W/') for t in if_none_match.split(',') }
+    return any( v.etag in tags for v in asset.variants.values() )
+
+class StaticAssets:
+    """The files of a directory in memory, with gzip and brotli variants built once
+
+    Files that appear or change after the build are not served from here; the caller
+    serves those from disk.
+    """
+
+    def __init__(self, root:str, *, cache_control:str):
+        self.root:str = os.path.abspath(root)
+        self.cache_control:str = cache_control
+        self._assets:dict[str,Asset] = {}
+        self.ready:bool = False
+        self.build_time:float = 0.0
+        self.hits:int = 0
+        self.not_modified:int = 0
+
+    def build(self) -> None:
+        """Read and compress every file under root; blocks, run it in a thread"""
+        t0 = time.monotonic()
+        assets:dict[str,Asset] = {}
+        for dirpath, dirnames, filenames in os.walk(self.root):
+            dirnames[:] = [ d for d in dirnames if not d.startswith('.') ]
+            for name in filenames:
+                path = os.path.join(dirpath, name)
+                try:
+                    assets[os.path.relpath(path, self.root).replace(os.sep,'/')] = build_asset(path)
+                except OSError as ex:
+                    logger.warning(f"static asset {path}: {ex}")
+        self._assets = assets
+        self.ready = True
+        self.build_time = time.monotonic()-t0
+        logger.info(f"{self.root}: {len(assets)} assets, {self.size('')>>10}KB, gzip {self.size('gzip')>>10}KB"
+                    + (f", br {self.size('br')>>10}KB" if brotli is not None else "") + f" built in {self.build_time:.2f}s")
+
+    def size(self, encoding:str) -> int:
+        return sum( len((a.variants.get(encoding) or a.variants['']).body) for a in self._assets.values() )
+
+    def paths(self) -> list[str]:
+        return list(self._assets.keys())
+
+    def lookup(self, path:str) -> Asset|None:
+        asset = self._assets.get(path)
+        if asset is None:
+            return None
+        try:
+            if os.path.getmtime(os.path.join(self.root, path))!=asset.mtime:
+                return None
+        except OSError:
+            return None
+        return asset
+
+    def select(self, asset:Asset, accept_encoding:str) -> Variant:
+        """The smallest representation the client accepts"""
+        ok = accepted(accept_encoding)
+        for encoding in ('br','gzip'):
+            if encoding in ok and encoding in asset.variants:
+                return asset.variants[encoding]
+        return asset.variants['']
+
+    def get_status(self) -> dict:
+        return {
+            'ready': self.ready,
+            'assets': len(self._assets),
+            'bytes': self.size(''),
+            'gzip_bytes': self.size('gzip'),
+            'br_bytes': self.size('br') if brotli is not None else None,
+            'build_ms': round(self.build_time*1000,1),
+            'hits': self.hits,
+            'not_modified': self.not_modified,
+        }
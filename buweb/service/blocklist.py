@@ -0,0 +1,152 @@
+import os
+import time
+import asyncio
+from typing import NamedTuple
+from logging import Logger,getLogger
+
+logger:Logger = getLogger(__name__)
+
+# names found in every hosts file that must not be blocked
+IGNORED_NAMES:frozenset[str] = frozenset((
+    'localhost', 'localhost.localdomain', 'local', 'broadcasthost', '0.0.0.0',
+    'ip6-localhost', 'ip6-loopback', 'ip6-localnet', 'ip6-mcastprefix',
+    'ip6-allnodes', 'ip6-allrouters', 'ip6-allhosts',
+))
+# a hosts file line blocks its names when it points them here
+SINK_ADDRESSES:frozenset[str] = frozenset(('0.0.0.0', '127.0.0.1', '::', '::1'))
+
+class CompiledList(NamedTuple):
+    # the host itself (hosts file entries)
+    exact:frozenset[str]
+    # the domain and every subdomain (plain domain lines)
+    domains:frozenset[str]
+    # subdomains only (`*.domain` lines)
+    wildcards:frozenset[str]
+    # mtime of each source when it was compiled, None when it was missing
+    mtimes:dict[str,float|None]
+    compile_time:float
+
+    def __len__(self) -> int:
+        return len(self.exact)+len(self.domains)+len(self.wildcards)
+
+EMPTY:CompiledList = CompiledList(frozenset(), frozenset(), frozenset(), {}, 0.0)
+
+def _mtimes(paths:list[str]) -> dict[str,float|None]:
+    res:dict[str,float|None] = {}
+    for path in paths:
+        try:
+            res[path] = os.path.getmtime(path)
+        except OSError:
+            res[path] = None
+    return res
+
+def compile_lists(paths:list[str]) -> CompiledList:
+    """Read host lists and compile them into sets
+
+    Accepted lines:
+      0.0.0.0 ads.example.com   hosts file format, blocks that host
+      example.com               blocks the domain and its subdomains
+      *.example.com             blocks the subdomains
+    """
+    t0 = time.monotonic()
+    mtimes = _mtimes(paths)
+    exact:set[str] = set()
+    domains:set[str] = set()
+    wildcards:set[str] = set()
+    for path in paths:
+        if mtimes[path] is None:
+            logger.warning(f"blocklist {path} not found")
+            continue
+        with open(path, encoding='utf-8', errors='replace') as f:
+            for line in f:
+                line = line.split('#',1)[0].strip().lower()
+                if not line:
+                    continue
+                words = line.split()
+                if len(words)>1:
+                    if words[0] in SINK_ADDRESSES:
+                        exact.update( name.rstrip('.') for name in words[1:] if name not in IGNORED_NAMES )
+                elif line.startswith('*.'):
+                    wildcards.add(line[2:].rstrip('.'))
+                elif line not in IGNORED_NAMES:
+                    domains.add(line.rstrip('.'))
+    return CompiledList(frozenset(exact), frozenset(domains), frozenset(wildcards), mtimes, time.monotonic()-t0)
+
+def is_blocked(compiled:CompiledList, host:str) -> bool:
+    """One set lookup per label of the host name"""
+    if host in compiled.exact or host in compiled.domains:
+        return True
+    i = host.find('.')
+    while i>=0:
+        parent = host[i+1:]
+        if parent in compiled.domains or parent in compiled.wildcards:
+            return True
+        i = host.find('.', i+1)
+    return False
+
+class Blocklist:
+    """Host lists compiled once and shared by every session
+
+    The sources are checked for changes and compiled again in a thread; the
+    compiled sets are swapped in one assignment, so lookups never wait and
+    running browsers pick up the new list with their next request.
+    """
+
+    def __init__(self, paths:list[str]|None=None, *, check_interval:float=30.0):
+        self.paths:list[str] = list(paths or [])
+        self.check_interval:float = check_interval
+        self._compiled:CompiledList = EMPTY
+        self.version:int = 0
+        self._task:asyncio.Task|None = None
+
+    @property
+    def enabled(self) -> bool:
+        return len(self.paths)>0
+
+    def __len__(self) -> int:
+        return len(self._compiled)
+
+    def blocked(self, host:str) -> bool:
+        return is_blocked(self._compiled, host.lower().rstrip('.'))
+
+    async def reload(self, force:bool=False) -> bool:
+        """Compile the sources again if one of them changed, return True if it did"""
+        if not self.enabled:
+            return False
+        if not force and _mtimes(self.paths)==self._compiled.mtimes:
+            return False
+        compiled = await asyncio.to_thread(compile_lists, self.paths)
+        self._compiled = compiled
+        self.version += 1
+        logger.info(f"blocklist v{self.version}: {len(compiled)} entries compiled in {compiled.compile_time*1000:.0f}ms")
+        return True
+
+    def start(self) -> None:
+        if self.enabled and self._task is None:
+            self._task = asyncio.create_task(self._watch())
+
+    async def _watch(self) -> None:
+        while True:
+            try:
+                await self.reload()
+            except asyncio.CancelledError:
+                raise
+            except:
+                logger.exception("error while compiling the blocklist")
+            await asyncio.sleep(self.check_interval)
+
+    async def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def get_status(self) -> dict:
+        c = self._compiled
+        return {
+            'version': self.version,
+            'sources': self.paths,
+            'exact': len(c.exact),
+            'domains': len(c.domains),
+            'wildcards': len(c.wildcards),
+            'compile_ms': round(c.compile_time*1000,1),
+        }
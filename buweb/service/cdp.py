@@ -0,0 +1,262 @@
+import json
+import base64
+import asyncio
+from typing import Any, Callable
+from urllib.parse import urlsplit
+from logging import Logger,getLogger
+
+import aiohttp
+
+from buweb.service.blocklist import Blocklist
+
+logger:Logger = getLogger(__name__)
+
+# params, session id (None for the browser session)
+EventHandler = Callable[[dict,str|None],None]
+
+class CdpError(Exception):
+    pass
+
+class CdpConnection:
+    """A DevTools protocol connection to the browser endpoint, with flat sessions"""
+
+    def __init__(self, http:aiohttp.ClientSession, ws:aiohttp.ClientWebSocketResponse):
+        self._http:aiohttp.ClientSession = http
+        self._ws:aiohttp.ClientWebSocketResponse = ws
+        self._next_id:int = 0
+        self._pending:dict[int,asyncio.Future] = {}
+        self._handlers:dict[str,EventHandler] = {}
+        # commands are written in order by one task, also those nobody waits for
+        self._out:asyncio.Queue[str] = asyncio.Queue()
+        self._reader:asyncio.Task = asyncio.create_task(self._read())
+        self._writer:asyncio.Task = asyncio.create_task(self._write_loop())
+
+    @staticmethod
+    async def connect(port:int, *, timeout:float=5.0) -> "CdpConnection":
+        http = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=timeout))
+        try:
+            async with http.get(f"http://127.0.0.1:{port}/json/version") as resp:
+                info = await resp.json(content_type=None)
+            ws = await http.ws_connect(info['webSocketDebuggerUrl'], max_msg_size=0, timeout=timeout)
+        except:
+            await http.close()
+            raise
+        return CdpConnection(http, ws)
+
+    @property
+    def closed(self) -> bool:
+        return self._reader.done()
+
+    async def wait_closed(self) -> None:
+        await asyncio.wait((self._reader,))
+
+    def on(self, method:str, handler:EventHandler) -> None:
+        self._handlers[method] = handler
+
+    def _write(self, method:str, params:dict|None, session_id:str|None) -> int:
+        self._next_id += 1
+        msg:dict[str,Any] = {'id': self._next_id, 'method': method, 'params': params or {}}
+        if session_id:
+            msg['sessionId'] = session_id
+        self._out.put_nowait(json.dumps(msg))
+        return self._next_id
+
+    async def _write_loop(self) -> None:
+        try:
+            while True:
+                await self._ws.send_str(await self._out.get())
+        except asyncio.CancelledError:
+            raise
+        except Exception as ex:
+            logger.debug(f"CDP connection lost: {ex}")
+            self._reader.cancel()
+
+    def send_nowait(self, method:str, params:dict|None=None, session_id:str|None=None) -> None:
+        """Send a command without waiting for its result"""
+        if not self.closed:
+            self._write(method, params, session_id)
+
+    async def send(self, method:str, params:dict|None=None, session_id:str|None=None, *, timeout:float=10.0) -> dict:
+        if self.closed:
+            raise CdpError("connection closed")
+        fut = asyncio.get_running_loop().create_future()
+        msg_id = self._write(method, params, session_id)
+        self._pending[msg_id] = fut
+        try:
+            return await asyncio.wait_for(fut, timeout)
+        finally:
+            self._pending.pop(msg_id, None)
+
+    async def _read(self) -> None:
+        try:
+            async for frame in self._ws:
+                if frame.type!=aiohttp.WSMsgType.TEXT:
+                    continue
+                msg = json.loads(frame.data)
+                msg_id = msg.get('id')
+                if msg_id is not None:
+                    fut = self._pending.get(msg_id)
+                    if fut is not None and not fut.done():
+                        if 'error' in msg:
+                            fut.set_exception(CdpError(msg['error'].get('message','error')))
+                        else:
+                            fut.set_result(msg.get('result',{}))
+                    continue
+                handler = self._handlers.get(msg.get('method',''))
+                if handler is not None:
+                    try:
+                        handler(msg.get('params',{}), msg.get('sessionId'))
+                    except Exception:
+                        logger.exception(f"error in CDP handler {msg.get('method')}")
+        except Exception as ex:
+            logger.debug(f"CDP connection lost: {ex}")
+        finally:
+            for fut in self._pending.values():
+                if not fut.done():
+                    fut.set_exception(CdpError("connection closed"))
+
+    async def close(self) -> None:
+        self._writer.cancel()
+        self._reader.cancel()
+        await self._ws.close()
+        await self._http.close()
+
+async def capture_screenshot(port:int, *, quality:int=60) -> bytes|None:
+    """JPEG of the most recently opened page, None when there is no page"""
+    conn = await CdpConnection.connect(port)
+    try:
+        targets = (await conn.send('Target.getTargets'))['targetInfos']
+        pages = [ t for t in targets if t.get('type')=='page' and not t.get('url','').startswith('devtools://') ]
+        if not pages:
+            return None
+        # Chrome lists the most recently opened page first, which is the one the agent works on
+        attached = await conn.send('Target.attachToTarget', {'targetId': pages[0]['targetId'], 'flatten': True})
+        shot = await conn.send('Page.captureScreenshot', {'format': 'jpeg', 'quality': quality}, attached['sessionId'])
+        return base64.b64decode(shot['data'])
+    finally:
+        await conn.close()
+
+# targets whose requests can be paused with the Fetch domain
+FETCH_TARGETS:frozenset[str] = frozenset(('page','iframe','worker','shared_worker','service_worker'))
+AUTO_ATTACH:dict = {'autoAttach': True, 'waitForDebuggerOnStart': True, 'flatten': True}
+# seconds between attempts to reconnect a blocker, doubled up to the maximum
+RECONNECT_MIN:float = 0.5
+RECONNECT_MAX:float = 5.0
+
+class CdpBlocker:
+    """Fails requests to blocked hosts in every target of one Chrome
+
+    Each page, frame and worker is attached as soon as it is created and held
+    until request interception is enabled in it, so that no request goes out
+    before the blocklist applies. A lost connection is made again until stop().
+    """
+
+    def __init__(self, port:int, blocklist:Blocklist, *, name:str=''):
+        self.port:int = port
+        self.blocklist:Blocklist = blocklist
+        self.name:str = name
+        self._conn:CdpConnection|None = None
+        self._setup:set[asyncio.Task] = set()
+        self._watch:asyncio.Task|None = None
+        self._stopped:bool = False
+        self.requests:int = 0
+        self.blocked:int = 0
+        self.reconnects:int = 0
+
+    @property
+    def running(self) -> bool:
+        return self._conn is not None and not self._conn.closed
+
+    async def start(self) -> None:
+        self._stopped = False
+        await self._connect()
+        self._watch = asyncio.create_task(self._supervise())
+
+    async def _connect(self) -> None:
+        conn = await CdpConnection.connect(self.port)
+        conn.on('Target.attachedToTarget', self._on_attached)
+        conn.on('Fetch.requestPaused', self._on_paused)
+        self._conn = conn
+        try:
+            # on the browser session this also attaches the pages that are already open
+            await conn.send('Target.setAutoAttach', AUTO_ATTACH)
+        except:
+            self._conn = None
+            await conn.close()
+            raise
+
+    async def _supervise(self) -> None:
+        """Reconnect when the connection drops; until then requests go out unfiltered"""
+        while not self._stopped:
+            conn = self._conn
+            if conn is not None:
+                await conn.wait_closed()
+                if self._stopped:
+                    return
+                self._conn = None
+                try:
+                    await conn.close()
+                except Exception:
+                    pass
+            logger.warning(f"{self.name} blocker lost its CDP connection to port {self.port}, reconnecting")
+            delay = RECONNECT_MIN
+            while not self._stopped:
+                await asyncio.sleep(delay)
+                try:
+                    await self._connect()
+                except (OSError, aiohttp.ClientError, CdpError, asyncio.TimeoutError) as ex:
+                    logger.debug(f"{self.name} blocker reconnect failed: {ex}")
+                    delay = min(delay*2, RECONNECT_MAX)
+                    continue
+                self.reconnects += 1
+                logger.warning(f"{self.name} blocker reconnected and re-attached its targets")
+                break
+
+    def _on_attached(self, params:dict, parent:str|None) -> None:
+        task = asyncio.create_task(self._attach(params['sessionId'], params['targetInfo'].get('type',''), params.get('waitingForDebugger',False)))
+        self._setup.add(task)
+        task.add_done_callback(self._setup.discard)
+
+    async def _attach(self, session_id:str, target_type:str, waiting:bool) -> None:
+        conn = self._conn
+        if conn is None:
+            return
+        try:
+            if target_type in FETCH_TARGETS:
+                await conn.send('Fetch.enable', {'patterns':[{'urlPattern':'*','requestStage':'Request'}]}, session_id)
+            # frames and workers started by this target
+            await conn.send('Target.setAutoAttach', AUTO_ATTACH, session_id)
+        except (CdpError, asyncio.TimeoutError) as ex:
+            logger.debug(f"{self.name} {target_type} {session_id}: {ex}")
+        finally:
+            if waiting:
+                conn.send_nowait('Runtime.runIfWaitingForDebugger', None, session_id)
+
+    def _on_paused(self, params:dict, session_id:str|None) -> None:
+        conn = self._conn
+        if conn is None:
+            return
+        self.requests += 1
+        host = urlsplit(params['request']['url']).hostname
+        if host and self.blocklist.blocked(host):
+            self.blocked += 1
+            conn.send_nowait('Fetch.failRequest', {'requestId': params['requestId'], 'errorReason': 'BlockedByClient'}, session_id)
+        else:
+            conn.send_nowait('Fetch.continueRequest', {'requestId': params['requestId']}, session_id)
+
+    async def stop(self) -> None:
+        self._stopped = True
+        if self._watch is not None:
+            watch, self._watch = self._watch, None
+            watch.cancel()
+        for task in list(self._setup):
+            task.cancel()
+        if self._conn is not None:
+            conn, self._conn = self._conn, None
+            try:
+                await conn.close()
+            except Exception:
+                pass
+
+    def get_status(self) -> dict:
+        return { 'running': self.running, 'requests': self.requests, 'blocked': self.blocked, 'reconnects': self.reconnects }
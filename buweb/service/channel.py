@@ -0,0 +1,117 @@
+import asyncio
+import threading
+from collections import deque
+from typing import Generic, Literal, TypeVar
+from logging import Logger,getLogger
+
+logger:Logger = getLogger(__name__)
+
+T = TypeVar('T')
+
+Overflow = Literal['drop_oldest','drop_new']
+
+class Subscription(Generic[T]):
+    """A bounded buffer of one subscriber of a MsgChannel"""
+
+    def __init__(self, channel:"MsgChannel[T]", maxsize:int, overflow:Overflow):
+        self._channel:MsgChannel[T] = channel
+        self._buf:deque[T] = deque()
+        self._maxsize:int = maxsize
+        self._overflow:Overflow = overflow
+        self._waiter:asyncio.Future|None = None
+        self.dropped:int = 0
+
+    def __len__(self) -> int:
+        return len(self._buf)
+
+    def _push(self, item:T) -> None:
+        # always called on the channel's loop
+        if len(self._buf)>=self._maxsize:
+            self.dropped += 1
+            if self._overflow=='drop_new':
+                return
+            self._buf.popleft()
+        self._buf.append(item)
+        waiter = self._waiter
+        if waiter is not None and not waiter.done():
+            waiter.set_result(None)
+
+    def unget(self, items:list[T]) -> None:
+        """Put items back at the front, in their original order"""
+        self._buf.extendleft(reversed(items))
+
+    def get_nowait(self) -> T|None:
+        return self._buf.popleft() if self._buf else None
+
+    async def get(self, timeout:float|None=None) -> T|None:
+        """Wait for the next item, or return None after the timeout or when another get() takes over"""
+        if not self._buf:
+            previous = self._waiter
+            waiter = self._waiter = self._channel._loop.create_future()
+            if previous is not None and not previous.done():
+                # a second reader, such as the stream of a client that resumed:
+                # the first one returns None and leaves the items to it
+                previous.set_result(False)
+            superseded = False
+            try:
+                superseded = await asyncio.wait_for(waiter, timeout) is False
+            except asyncio.TimeoutError:
+                pass
+            finally:
+                if self._waiter is waiter:
+                    self._waiter = None
+            if superseded:
+                return None
+        return self.get_nowait()
+
+    async def get_batch(self, timeout:float|None, window:float, limit:int=100) -> list[T]:
+        """Wait for an item, then collect the items that arrive within the window"""
+        first = await self.get(timeout)
+        if first is None:
+            return []
+        items:list[T] = [first]
+        loop = self._channel._loop
+        deadline = loop.time() + window
+        while len(items)<limit:
+            remaining = deadline - loop.time()
+            item = self.get_nowait() if remaining<=0 else await self.get(remaining)
+            if item is None:
+                break
+            items.append(item)
+        return items
+
+    def close(self) -> None:
+        self._channel.unsubscribe(self)
+
+class MsgChannel(Generic[T]):
+    """Fan-out channel: publish() may be called from any thread and wakes every subscriber on the loop"""
+
+    def __init__(self, loop:asyncio.AbstractEventLoop|None=None, *, maxsize:int=1000, overflow:Overflow='drop_oldest'):
+        self._loop:asyncio.AbstractEventLoop = loop if loop is not None else asyncio.get_running_loop()
+        self._loop_thread:int = threading.get_ident()
+        self._maxsize:int = maxsize
+        self._overflow:Overflow = overflow
+        self._subscribers:list[Subscription[T]] = []
+
+    def subscribe(self, maxsize:int|None=None, overflow:Overflow|None=None) -> Subscription[T]:
+        sub = Subscription(self, maxsize or self._maxsize, overflow or self._overflow)
+        self._subscribers.append(sub)
+        return sub
+
+    def unsubscribe(self, sub:Subscription[T]) -> None:
+        if sub in self._subscribers:
+            self._subscribers.remove(sub)
+
+    def _deliver(self, item:T) -> None:
+        for sub in self._subscribers:
+            sub._push(item)
+
+    def publish(self, item:T) -> None:
+        if threading.get_ident()==self._loop_thread:
+            self._deliver(item)
+            return
+        try:
+            self._loop.call_soon_threadsafe(self._deliver, item)
+        except RuntimeError:
+            # the loop is already closed
+            logger.debug("message dropped, loop is closed")
@@ -0,0 +1,207 @@
+import os
+import time
+import asyncio
+import aiohttp
+from typing import Any, Awaitable, Callable
+from logging import Logger,getLogger
+
+logger:Logger = getLogger(__name__)
+
+# how often a worker reports to the coordinator
+HEARTBEAT_INTERVAL:float = 5.0
+# a worker that has not reported for this long is taken out of placement
+NODE_EXPIRE:float = 15.0
+# shared secret sent by workers when BUW_CLUSTER_TOKEN is set
+CLUSTER_TOKEN_HEADER:str = 'X-Cluster-Token'
+
+def read_meminfo() -> tuple[int,int]:
+    """MemTotal and MemAvailable in kB"""
+    total = avail = 0
+    try:
+        with open('/proc/meminfo') as f:
+            for line in f:
+                if line.startswith('MemTotal:'):
+                    total = int(line.split()[1])
+                elif line.startswith('MemAvailable:'):
+                    avail = int(line.split()[1])
+    except OSError:
+        pass
+    return total, avail
+
+def host_capacity() -> dict[str,Any]:
+    """CPU and memory figures of this host"""
+    mem_total, mem_avail = read_meminfo()
+    try:
+        load = os.getloadavg()[0]
+    except OSError:
+        load = 0.0
+    return {
+        'cpus': os.cpu_count() or 1,
+        'load': round(load,2),
+        'mem_total': mem_total,
+        'mem_available': mem_avail,
+    }
+
+class WorkerNode:
+    """What the coordinator knows about one worker"""
+
+    def __init__(self, node_id:str, url:str):
+        self.node_id:str = node_id
+        self.url:str = url.rstrip('/')
+        self.public_host:str = ''
+        self.cpus:int = 1
+        self.load:float = 0.0
+        self.mem_total:int = 0
+        self.mem_available:int = 0
+        self.max_sessions:int = 0
+        self.sessions:int = 0
+        self.queue:int = 0
+        self.last_seen:float = 0.0
+        # sessions placed here since the last report, not yet counted by the worker
+        self.pending:int = 0
+
+    def update(self, info:dict[str,Any]) -> None:
+        self.public_host = info.get('public_host') or self.public_host
+        self.cpus = int(info.get('cpus') or 1)
+        self.load = float(info.get('load') or 0.0)
+        self.mem_total = int(info.get('mem_total') or 0)
+        self.mem_available = int(info.get('mem_available') or 0)
+        self.max_sessions = int(info.get('max_sessions') or 0)
+        self.sessions = int(info.get('sessions') or 0)
+        self.queue = int(info.get('queue') or 0)
+        self.last_seen = time.monotonic()
+        self.pending = 0
+
+    @property
+    def free_slots(self) -> int:
+        return self.max_sessions - self.sessions - self.queue - self.pending
+
+    def score(self) -> float:
+        """Higher is better: free slots first, then spare memory and CPU"""
+        if self.max_sessions<=0:
+            return 0.0
+        slots = max(0,self.free_slots) / self.max_sessions
+        mem = self.mem_available/self.mem_total if self.mem_total>0 else 0.5
+        cpu = 1.0 - min(1.0, self.load/max(1,self.cpus))
+        return slots*0.5 + mem*0.3 + cpu*0.2
+
+    def to_dict(self) -> dict[str,Any]:
+        return {
+            'node_id': self.node_id,
+            'url': self.url,
+            'public_host': self.public_host,
+            'cpus': self.cpus,
+            'load': self.load,
+            'mem_total': self.mem_total,
+            'mem_available': self.mem_available,
+            'max_sessions': self.max_sessions,
+            'sessions': self.sessions,
+            'queue': self.queue,
+            'free_slots': self.free_slots,
+            'age': round(time.monotonic()-self.last_seen,1),
+        }
+
+class WorkerRegistry:
+    """Coordinator side: the live workers and which worker owns which session"""
+
+    def __init__(self, *, expire:float=NODE_EXPIRE):
+        self._expire:float = expire
+        self.nodes:dict[str,WorkerNode] = {}
+        self._owners:dict[str,str] = {}
+        # when the coordinator itself saw a session start, until a report confirms it
+        self._bound_at:dict[str,float] = {}
+
+    def heartbeat(self, info:dict[str,Any]) -> WorkerNode:
+        node_id = str(info['node_id'])
+        url = str(info['url'])
+        node = self.nodes.get(node_id)
+        if node is None or node.url!=url.rstrip('/'):
+            logger.info(f"worker {node_id} joined at {url}")
+            node = WorkerNode(node_id, url)
+            self.nodes[node_id] = node
+        node.update(info)
+        # the worker's session list is the source of truth for ownership,
+        # except for sessions that started after the report was taken
+        now = time.monotonic()
+        for sid,owner in list(self._owners.items()):
+            if owner==node_id and now-self._bound_at.get(sid,0.0)>2*HEARTBEAT_INTERVAL:
+                del self._owners[sid]
+                self._bound_at.pop(sid,None)
+        for sid in info.get('session_ids') or []:
+            self._owners[sid] = node_id
+        return node
+
+    def live_nodes(self) -> list[WorkerNode]:
+        now = time.monotonic()
+        for node_id,node in list(self.nodes.items()):
+            if now-node.last_seen>self._expire:
+                logger.warning(f"worker {node_id} expired")
+                del self.nodes[node_id]
+                for sid,owner in list(self._owners.items()):
+                    if owner==node_id:
+                        del self._owners[sid]
+                        self._bound_at.pop(sid,None)
+        return list(self.nodes.values())
+
+    def place(self) -> WorkerNode|None:
+        """Pick the worker for a new session"""
+        nodes = self.live_nodes()
+        if not nodes:
+            return None
+        free = [ n for n in nodes if n.free_slots>0 ]
+        if free:
+            node = max(free, key=lambda n: n.score())
+        else:
+            # everyone is full: queue where the line is shortest for its size
+            node = min(nodes, key=lambda n: (n.queue+n.pending+1)/max(1,n.max_sessions))
+        node.pending += 1
+        return node
+
+    def bind(self, session_id:str, node:WorkerNode) -> None:
+        self._owners[session_id] = node.node_id
+        self._bound_at[session_id] = time.monotonic()
+
+    def owner(self, session_id:str|None) -> WorkerNode|None:
+        if not session_id:
+            return None
+        node_id = self._owners.get(session_id)
+        return self.nodes.get(node_id) if node_id else None
+
+    def get_status(self) -> list[dict[str,Any]]:
+        return [ n.to_dict() for n in self.live_nodes() ]
+
+async def heartbeat_loop(coordinator:str, node_id:str, url:str, public_host:str, capacity:Callable[[],Awaitable[dict[str,Any]]], *, token:str='', interval:float=HEARTBEAT_INTERVAL) -> None:
+    """Worker side: report this node and its capacity to the coordinator until cancelled"""
+    endpoint = coordinator.rstrip('/') + '/cluster/heartbeat'
+    timeout = aiohttp.ClientTimeout(total=interval)
+    headers = { CLUSTER_TOKEN_HEADER: token } if token else None
+    joined = False
+    async with aiohttp.ClientSession(timeout=timeout, headers=headers) as session:
+        while True:
+            try:
+                info = host_capacity()
+                info.update(await capacity())
+                info.update({ 'node_id': node_id, 'url': url, 'public_host': public_host })
+                async with session.post(endpoint, json=info) as resp:
+                    if resp.status!=200:
+                        raise aiohttp.ClientError(f"status {resp.status}")
+                if not joined:
+                    logger.info(f"joined coordinator {coordinator} as {node_id}")
+                    joined = True
+            except asyncio.CancelledError:
+                raise
+            except Exception as ex:
+                if joined:
+                    logger.warning(f"heartbeat to {coordinator} failed: {ex}")
+                joined = False
+            await asyncio.sleep(interval)
+
+def sniff_session_id(buf:str) -> tuple[str|None,str]:
+    """Look for the first 'id:' line of an event stream, return (session_id, unconsumed text)"""
+    while '\n' in buf:
+        line, _, buf = buf.partition('\n')
+        if line.startswith('id:'):
+            sid, _, seq = line[3:].strip().rpartition('.')
+            if sid and seq.isdigit():
+                return sid, buf
+    return None, buf
@@ -0,0 +1,170 @@
+import os
+import json
+import time
+import sqlite3
+import asyncio
+import threading
+from typing import Any, Awaitable, Callable
+from buweb.service.cluster import WorkerNode, NODE_EXPIRE
+from logging import Logger,getLogger
+
+logger:Logger = getLogger(__name__)
+
+SCHEMA:str = """
+CREATE TABLE IF NOT EXISTS workers (
+    node_id TEXT PRIMARY KEY,
+    url TEXT NOT NULL,
+    pid INTEGER NOT NULL,
+    info TEXT NOT NULL,
+    updated REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS sessions (
+    session_id TEXT PRIMARY KEY,
+    node_id TEXT NOT NULL,
+    display INTEGER NOT NULL,
+    ws_port INTEGER NOT NULL,
+    cdp_port INTEGER NOT NULL,
+    status TEXT NOT NULL,
+    msg_seq INTEGER NOT NULL,
+    updated REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS sessions_node ON sessions(node_id);
+"""
+
+class SessionDirectory:
+    """Which worker process on this host owns which session, shared by the workers through SQLite in WAL mode
+
+    Each worker publishes its capacity and its sessions about once a second, and
+    right after it creates or removes one (DirectoryPublisher); any worker can then look up the owner of a session
+    and forward the request to it. Reads do not block the writers in WAL mode.
+    The calls block, run them in a thread.
+    """
+
+    def __init__(self, path:str, *, expire:float=NODE_EXPIRE):
+        self.path:str = path
+        self._expire:float = expire
+        self._lock:threading.Lock = threading.Lock()
+        self._db:sqlite3.Connection|None = None
+
+    def _conn(self) -> sqlite3.Connection:
+        if self._db is None:
+            db = sqlite3.connect(self.path, timeout=5.0, isolation_level=None, check_same_thread=False)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            db.executescript(SCHEMA)
+            self._db = db
+        return self._db
+
+    def publish(self, node_id:str, url:str, pid:int, info:dict[str,Any], rows:list[dict[str,Any]]) -> None:
+        """Replace what is known about one worker and its sessions"""
+        now = time.time()
+        with self._lock:
+            db = self._conn()
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                db.execute("INSERT OR REPLACE INTO workers VALUES (?,?,?,?,?)", (node_id, url, pid, json.dumps(info), now))
+                db.execute("DELETE FROM sessions WHERE node_id=?", (node_id,))
+                db.executemany("INSERT OR REPLACE INTO sessions VALUES (?,?,?,?,?,?,?,?)", [
+                    ( r['session_id'], node_id, r.get('display',0), r.get('ws_port',0), r.get('cdp_port',0),
+                      json.dumps(r.get('status',{})), r.get('msg_seq',0), now ) for r in rows ])
+                db.execute("COMMIT")
+            except:
+                db.execute("ROLLBACK")
+                raise
+
+    def drop(self, node_id:str) -> None:
+        """The worker is going away"""
+        with self._lock:
+            db = self._conn()
+            db.execute("DELETE FROM sessions WHERE node_id=?", (node_id,))
+            db.execute("DELETE FROM workers WHERE node_id=?", (node_id,))
+
+    def _node(self, row:tuple) -> WorkerNode:
+        node_id, url, info, updated = row
+        node = WorkerNode(node_id, url)
+        node.update(json.loads(info))
+        # the report age, not when it was read
+        node.last_seen -= max(0.0, time.time()-updated)
+        return node
+
+    def owner(self, session_id:str|None) -> WorkerNode|None:
+        """The live worker that owns the session"""
+        if not session_id:
+            return None
+        with self._lock:
+            row = self._conn().execute(
+                "SELECT w.node_id, w.url, w.info, w.updated FROM sessions s JOIN workers w ON s.node_id=w.node_id"
+                " WHERE s.session_id=? AND w.updated>=?", (session_id, time.time()-self._expire)).fetchone()
+        return self._node(row) if row is not None else None
+
+    def live_nodes(self) -> list[WorkerNode]:
+        with self._lock:
+            rows = self._conn().execute(
+                "SELECT node_id, url, info, updated FROM workers WHERE updated>=? ORDER BY node_id", (time.time()-self._expire,)).fetchall()
+        return [ self._node(row) for row in rows ]
+
+    def sessions(self) -> list[dict[str,Any]]:
+        with self._lock:
+            rows = self._conn().execute(
+                "SELECT session_id, node_id, display, ws_port, cdp_port, status, msg_seq, updated FROM sessions ORDER BY session_id").fetchall()
+        return [ { 'session_id': sid, 'node_id': node_id, 'display': display, 'ws_port': ws_port, 'cdp_port': cdp_port,
+                   'status': json.loads(status), 'msg_seq': msg_seq, 'age': round(time.time()-updated,1) }
+                 for sid, node_id, display, ws_port, cdp_port, status, msg_seq, updated in rows ]
+
+    def close(self) -> None:
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+class DirectoryPublisher:
+    """Publishes one worker to the directory every interval, and at once when kicked
+
+    A worker kicks it when it has created or removed a session, so that its
+    siblings can forward the new session's requests before the next interval.
+    """
+
+    def __init__(self, directory:SessionDirectory, node_id:str, url:str,
+                 snapshot:Callable[[],Awaitable[tuple[dict[str,Any],list[dict[str,Any]]]]], *, interval:float=1.0):
+        self.directory:SessionDirectory = directory
+        self.node_id:str = node_id
+        self.url:str = url
+        # the worker's capacity and its session rows
+        self._snapshot:Callable[[],Awaitable[tuple[dict[str,Any],list[dict[str,Any]]]]] = snapshot
+        self.interval:float = interval
+        self._kick:asyncio.Event = asyncio.Event()
+        self._task:asyncio.Task|None = None
+        self.published:int = 0
+
+    def kick(self) -> None:
+        self._kick.set()
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            # a kick during the publish is picked up by the next one
+            self._kick.clear()
+            try:
+                info, rows = await self._snapshot()
+                await asyncio.to_thread(self.directory.publish, self.node_id, self.url, os.getpid(), info, rows)
+                self.published += 1
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("error while publishing to the session directory")
+            try:
+                await asyncio.wait_for(self._kick.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
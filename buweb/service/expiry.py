@@ -0,0 +1,104 @@
+import time
+import heapq
+import asyncio
+from typing import Awaitable, Callable
+from logging import Logger,getLogger
+
+logger:Logger = getLogger(__name__)
+
+class ExpiryScheduler:
+    """Expires keys at their deadline, with no periodic scan
+
+    Deadlines are kept in a heap and a single task sleeps until the earliest one.
+    Extending a deadline does not touch the heap: when an entry comes due,
+    deadline_of() is asked for the current deadline and the entry is pushed back
+    if it has moved. A key that is used all the time is therefore re-queued
+    at most once per timeout, however often it is touched.
+    """
+
+    def __init__(self, deadline_of:Callable[[str],float|None], on_expire:Callable[[str],Awaitable[None]]):
+        # current deadline (time.monotonic) of a key, None when it is gone
+        self._deadline_of:Callable[[str],float|None] = deadline_of
+        self._on_expire:Callable[[str],Awaitable[None]] = on_expire
+        self._heap:list[tuple[float,str]] = []
+        # the deadline each key is queued with, older heap entries are stale
+        self._queued:dict[str,float] = {}
+        self._wake:asyncio.Event = asyncio.Event()
+        self._task:asyncio.Task|None = None
+        self._expiring:set[asyncio.Task] = set()
+        self.expired:int = 0
+        # how late the last expiry ran after its deadline
+        self.last_delay:float = 0.0
+
+    def __len__(self) -> int:
+        return len(self._queued)
+
+    def add(self, key:str, deadline:float) -> None:
+        """Queue a key, O(log n); a later deadline than the queued one is picked up when that one comes due"""
+        queued = self._queued.get(key)
+        if queued is not None and queued<=deadline:
+            return
+        self._queued[key] = deadline
+        heapq.heappush(self._heap, (deadline,key))
+        if self._heap[0][1]==key:
+            # new earliest deadline
+            self._wake.set()
+
+    def discard(self, key:str) -> None:
+        # the heap entry becomes stale and is dropped when it comes due
+        self._queued.pop(key, None)
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            now = time.monotonic()
+            while self._heap and self._heap[0][0]<=now:
+                deadline, key = heapq.heappop(self._heap)
+                if self._queued.get(key)!=deadline:
+                    continue
+                del self._queued[key]
+                current = self._deadline_of(key)
+                if current is None:
+                    continue
+                if current>now:
+                    self.add(key, current)
+                    continue
+                self.expired += 1
+                self.last_delay = now-current
+                # not awaited: a slow cleanup must not delay the next deadline
+                task = asyncio.create_task(self._expire(key))
+                self._expiring.add(task)
+                task.add_done_callback(self._expiring.discard)
+            self._wake.clear()
+            timeout = self._heap[0][0]-now if self._heap else None
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _expire(self, key:str) -> None:
+        try:
+            await self._on_expire(key)
+        except Exception:
+            logger.exception(f"[{key}] error while expiring")
+
+    def get_status(self) -> dict:
+        return {
+            'queued': len(self._queued),
+            'heap': len(self._heap),
+            'next_in': round(self._heap[0][0]-time.monotonic(),3) if self._heap else None,
+            'expired': self.expired,
+            'last_delay': round(self.last_delay,3),
+        }
@@ -0,0 +1,111 @@
+import os
+import socket
+from threading import Lock
+from logging import Logger,getLogger
+
+logger:Logger = getLogger(__name__)
+
+class CanNotStartException(Exception):
+    pass
+
+def is_port_available(port: int) -> bool:
+    # Check if the specified port is available
+    try:
+        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+            s.bind(('localhost', port))
+            return True
+    except (socket.error, OSError):
+        return False
+
+def is_display_available(num:int) -> bool:
+    # An X server leaves a lock file and a unix socket for its display
+    return not os.path.exists(f"/tmp/.X{num}-lock") and not os.path.exists(f"/tmp/.X11-unix/X{num}")
+
+class PortLease:
+    """A set of display and port numbers reserved for one session"""
+    def __init__(self, allocator:"PortAllocator", display_num:int, vnc_port:int, ws_port:int, cdp_port:int):
+        self._allocator:PortAllocator|None = allocator
+        self.display_num:int = display_num
+        self.vnc_port:int = vnc_port
+        self.ws_port:int = ws_port
+        self.cdp_port:int = cdp_port
+
+    def release(self) -> None:
+        allocator = self._allocator
+        self._allocator = None
+        if allocator is not None:
+            allocator._release(self)
+
+    def __repr__(self) -> str:
+        return f"PortLease(:{self.display_num} rfb:{self.vnc_port} ws:{self.ws_port} cdp:{self.cdp_port})"
+
+class PortAllocator:
+    """Leases (display, rfbport, wsport, cdpport) tuples so that sessions can start in parallel"""
+
+    def __init__(self, *, displays:range=range(10,100), ws_ports:range=range(5030,5100), cdp_ports:range=range(9222,9322)):
+        self._lock:Lock = Lock()
+        self._displays:range = displays
+        self._ws_ports:range = ws_ports
+        self._cdp_ports:range = cdp_ports
+        self._used_displays:set[int] = set()
+        self._used_ws:set[int] = set()
+        self._used_cdp:set[int] = set()
+        # next-fit positions, so that a just released port is not reused immediately
+        self._next:dict[str,int] = {'display':0, 'ws':0, 'cdp':0}
+
+    def restrict(self, index:int, count:int) -> None:
+        """Use only the index-th of count equal parts of each range, for several workers on one host"""
+        def part(r:range) -> range:
+            return r[ index*len(r)//count : (index+1)*len(r)//count ]
+        with self._lock:
+            self._displays = part(self._displays)
+            self._ws_ports = part(self._ws_ports)
+            self._cdp_ports = part(self._cdp_ports)
+            self._next = {'display':0, 'ws':0, 'cdp':0}
+
+    def _pick(self, key:str, candidates:range, used:set[int], usable) -> int|None:
+        n = len(candidates)
+        start = self._next[key]
+        for i in range(n):
+            idx = (start+i) % n
+            value = candidates[idx]
+            if value not in used and usable(value):
+                self._next[key] = (idx+1) % n
+                return value
+        return None
+
+    def lease(self, *, display:bool=True) -> PortLease:
+        """Reserve a display and all ports for a session, atomically; without display only the CDP port"""
+        with self._lock:
+            display_num, ws_port = 0, 0
+            if display:
+                num = self._pick('display', self._displays, self._used_displays,
+                                 lambda num: is_display_available(num) and is_port_available(5900+num))
+                if num is None:
+                    raise CanNotStartException("No available display number found")
+                port = self._pick('ws', self._ws_ports, self._used_ws, is_port_available)
+                if port is None:
+                    raise CanNotStartException("No available websock port found")
+                display_num, ws_port = num, port
+            cdp_port = self._pick('cdp', self._cdp_ports, self._used_cdp, is_port_available)
+            if cdp_port is None:
+                raise CanNotStartException("No available CDP port found")
+            if display:
+                self._used_displays.add(display_num)
+                self._used_ws.add(ws_port)
+            self._used_cdp.add(cdp_port)
+        return PortLease(self, display_num, 5900+display_num if display else 0, ws_port, cdp_port)
+
+    def _release(self, lease:PortLease) -> None:
+        with self._lock:
+            self._used_displays.discard(lease.display_num)
+            self._used_ws.discard(lease.ws_port)
+            self._used_cdp.discard(lease.cdp_port)
+
+    def get_status(self) -> dict:
+        with self._lock:
+            return {
+                'displays': len(self._used_displays),
+                'ws_ports': len(self._used_ws),
+                'cdp_ports': len(self._used_cdp),
+            }
@@ -0,0 +1,67 @@
+import os
+import signal
+import asyncio
+from asyncio import Task
+from asyncio.subprocess import Process
+from logging import Logger,getLogger
+
+logger:Logger = getLogger(__name__)
+
+# seconds to wait for the exit after SIGKILL; a process in uninterruptible sleep may never go
+KILL_WAIT:float = 2.0
+
+class SupervisedProcess:
+    """A child process started in its own process group, whose exit is reported by the event loop
+
+    Liveness is cached from the exit notification, so checking it costs no system call.
+    """
+
+    def __init__(self, proc:Process, name:str):
+        self._proc:Process = proc
+        self.name:str = name
+        self.pid:int = proc.pid
+        # the child is the leader of its own process group
+        self.pgid:int = proc.pid
+        self.returncode:int|None = None
+        self._exited:asyncio.Event = asyncio.Event()
+        self._watcher:Task = asyncio.create_task(self._watch())
+
+    @classmethod
+    async def start(cls, args:list[str], *, name:str, cwd:str|None=None, stdout=asyncio.subprocess.DEVNULL, stderr=None) -> "SupervisedProcess":
+        proc = await asyncio.create_subprocess_exec( *args, cwd=cwd, stdout=stdout, stderr=stderr, start_new_session=True )
+        return cls(proc, name)
+
+    async def _watch(self) -> None:
+        # the child watcher (pidfd where available) wakes us on exit
+        self.returncode = await self._proc.wait()
+        self._exited.set()
+        logger.debug(f"{self.name} pid:{self.pid} exited with {self.returncode}")
+
+    @property
+    def alive(self) -> bool:
+        return not self._exited.is_set()
+
+    async def wait(self, timeout:float|None=None) -> bool:
+        """Wait for the exit and return True if the process has exited"""
+        try:
+            await asyncio.wait_for(self._exited.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        return self._exited.is_set()
+
+    def killpg(self, sig:int) -> None:
+        try:
+            os.killpg(self.pgid, sig)
+        except (ProcessLookupError, PermissionError):
+            pass
+
+    async def stop(self, deadline:float=2.0) -> None:
+        """Terminate the whole process group, and kill it if it is still there after the deadline"""
+        if self.alive:
+            self.killpg(signal.SIGTERM)
+            if not await self.wait(deadline):
+                logger.warning(f"{self.name} pid:{self.pid} did not exit in {deadline}s, killing")
+        # also take down children that outlived the group leader
+        self.killpg(signal.SIGKILL)
+        if not await self.wait(KILL_WAIT):
+            logger.error(f"{self.name} pid:{self.pid} still there {KILL_WAIT}s after SIGKILL, giving up")
@@ -0,0 +1,128 @@
+import os
+import time
+import shutil
+import asyncio
+from importlib.resources import files
+from logging import Logger,getLogger
+
+from buweb.service.ports import PortAllocator, PortLease
+from buweb.service.procs import SupervisedProcess
+from buweb.service.readiness import wait_ready, probe_cdp
+
+logger:Logger = getLogger(__name__)
+
+# written into a finished template, bump it when the preparation changes
+TEMPLATE_VERSION:str = '1'
+MARKER:str = '.buw_template'
+# files that tie a profile to the Chrome instance that wrote it
+SINGLETON_FILES:tuple[str,...] = ('SingletonLock','SingletonSocket','SingletonCookie')
+
+class ProfileTemplate:
+    """A home directory whose Chrome profile has already been through its first run
+
+    Chrome is started once headless on an empty home, allowed to finish its first-run
+    work (profile files, component and font caches) and shut down cleanly. Every session
+    then starts from a copy of that directory. The copy uses reflinks where the
+    filesystem supports them, so it shares blocks with the template until Chrome writes.
+    Hard links are not used: Chrome rewrites some files in place and would change the
+    template.
+    """
+
+    def __init__(self, dir:str, *, ports:PortAllocator|None=None, max_age:float=7*24*3600.0, settle:float=3.0):
+        self.dir:str = dir
+        # the template browser's CDP port is leased like a session's
+        self.ports:PortAllocator = ports if ports is not None else PortAllocator()
+        self.max_age:float = max_age
+        # time the template browser is left running after it is ready
+        self.settle:float = settle
+        self.enabled:bool = True
+        self._ready:bool = False
+        self._preparing:asyncio.Task|None = None
+        self.prepare_time:float = 0.0
+
+    @property
+    def ready(self) -> bool:
+        return self.enabled and self._ready
+
+    def _is_valid(self) -> bool:
+        marker = os.path.join(self.dir, MARKER)
+        try:
+            with open(marker) as f:
+                if f.read().strip()!=TEMPLATE_VERSION:
+                    return False
+            return time.time()-os.path.getmtime(marker) < self.max_age
+        except OSError:
+            return False
+
+    def start(self) -> None:
+        """Prepare the template in the background, unless a valid one exists"""
+        if not self.enabled:
+            return
+        if self._is_valid():
+            self._ready = True
+            return
+        if self._preparing is None or self._preparing.done():
+            self._preparing = asyncio.create_task(self._prepare())
+
+    async def _prepare(self) -> None:
+        t0 = time.monotonic()
+        tmpdir = f"{self.dir}.tmp{os.getpid()}"
+        await asyncio.to_thread(shutil.rmtree, tmpdir, True)
+        os.makedirs(os.path.join(tmpdir,'.config','google-chrome','Default'))
+        proc:SupervisedProcess|None = None
+        lease:PortLease|None = None
+        try:
+            lease = self.ports.lease(display=False)
+            port = lease.cdp_port
+            script_path = str(files('buweb.scripts').joinpath('start_browser.sh'))
+            proc = await SupervisedProcess.start( [script_path, "--headless", "--workdir", tmpdir, "--cdpport", str(port)],
+                                                  name="template chrome", cwd=tmpdir )
+            await wait_ready(lambda: probe_cdp(port), name="template chrome", timeout_sec=60.0, alive=lambda: proc is not None and proc.alive)
+            # let the first-run work and the caches finish
+            await asyncio.sleep(self.settle)
+            # SIGTERM: Chrome shuts down cleanly and flushes its profile
+            await proc.stop(deadline=10.0)
+            proc = None
+            for root, _, names in os.walk(tmpdir):
+                for name in names:
+                    if name in SINGLETON_FILES:
+                        os.unlink(os.path.join(root,name))
+            with open(os.path.join(tmpdir, MARKER),'w') as f:
+                f.write(TEMPLATE_VERSION)
+            # replace the old template in one step; sessions copying from it keep their open files
+            old = f"{self.dir}.old{os.getpid()}"
+            if os.path.exists(self.dir):
+                os.rename(self.dir, old)
+            os.rename(tmpdir, self.dir)
+            await asyncio.to_thread(shutil.rmtree, old, True)
+            self._ready = True
+            self.prepare_time = time.monotonic()-t0
+            logger.info(f"chrome profile template prepared in {self.prepare_time:.1f}s")
+        except Exception as ex:
+            logger.warning(f"chrome profile template could not be prepared: {ex}")
+        finally:
+            if proc is not None:
+                await proc.stop()
+            if lease is not None:
+                lease.release()
+            await asyncio.to_thread(shutil.rmtree, tmpdir, True)
+
+    async def copy_to(self, home:str) -> bool:
+        """Populate a session's home from the template, return False if it was not used"""
+        if not self.ready:
+            return False
+        if os.path.exists(os.path.join(home,'.config','google-chrome')):
+            # the session already has a profile (restarted browser)
+            return False
+        os.makedirs(home, exist_ok=True)
+        proc = await asyncio.create_subprocess_exec( 'cp', '-a', '--reflink=auto', f"{self.dir}/.", home,
+                                                     stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.PIPE )
+        _, err = await proc.communicate()
+        if proc.returncode!=0:
+            logger.warning(f"copy of chrome profile template failed: {err.decode(errors='replace').strip()}")
+            return False
+        try:
+            os.unlink(os.path.join(home, MARKER))
+        except OSError:
+            pass
+        return True
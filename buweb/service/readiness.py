@@ -0,0 +1,82 @@
+import os
+import time
+import base64
+import asyncio
+from typing import Awaitable, Callable
+from logging import Logger,getLogger
+
+from buweb.service.ports import CanNotStartException
+
+logger:Logger = getLogger(__name__)
+
+# retry interval of the probes: starts small and grows up to the maximum
+BACKOFF_MIN:float = 0.01
+BACKOFF_MAX:float = 0.25
+# timeout of a single connection attempt
+CONNECT_TIMEOUT:float = 1.0
+
+def x_socket_path(display_num:int) -> str:
+    return f"/tmp/.X11-unix/X{display_num}"
+
+async def probe_x_display(display_num:int) -> bool:
+    """The X server accepts connections on its unix socket"""
+    path = x_socket_path(display_num)
+    if not os.path.exists(path):
+        return False
+    try:
+        _, writer = await asyncio.wait_for(asyncio.open_unix_connection(path), CONNECT_TIMEOUT)
+    except (OSError, asyncio.TimeoutError):
+        return False
+    writer.close()
+    return True
+
+async def _http_status(port:int, request:bytes) -> int:
+    """Send a request to localhost:port and return the HTTP status code of the response"""
+    try:
+        reader, writer = await asyncio.wait_for(asyncio.open_connection('127.0.0.1', port), CONNECT_TIMEOUT)
+    except (OSError, asyncio.TimeoutError):
+        return 0
+    try:
+        writer.write(request)
+        await writer.drain()
+        line = await asyncio.wait_for(reader.readline(), CONNECT_TIMEOUT)
+        parts = line.split()
+        if len(parts)>=2 and parts[0].startswith(b'HTTP/') and parts[1].isdigit():
+            return int(parts[1])
+        return 0
+    except (OSError, asyncio.TimeoutError):
+        return 0
+    finally:
+        writer.close()
+
+async def probe_websockify(port:int) -> bool:
+    """websockify completes a websocket handshake"""
+    key = base64.b64encode(os.urandom(16)).decode()
+    request = (
+        f"GET / HTTP/1.1\r\nHost: 127.0.0.1:{port}\r\n"
+        "Upgrade: websocket\r\nConnection: Upgrade\r\n"
+        f"Sec-WebSocket-Key: {key}\r\nSec-WebSocket-Version: 13\r\n"
+        "Sec-WebSocket-Protocol: binary\r\n\r\n"
+    ).encode()
+    return await _http_status(port, request) == 101
+
+async def probe_cdp(port:int) -> bool:
+    """Chrome answers /json/version on the DevTools port"""
+    request = f"GET /json/version HTTP/1.0\r\nHost: 127.0.0.1:{port}\r\n\r\n".encode()
+    return await _http_status(port, request) == 200
+
+async def wait_ready(probe:Callable[[],Awaitable[bool]], *, name:str, timeout_sec:float, alive:Callable[[],bool]|None=None) -> float:
+    """Retry the probe with backoff until it succeeds, and return the elapsed time"""
+    t0 = time.monotonic()
+    exit_sec = t0 + timeout_sec
+    delay = BACKOFF_MIN
+    while True:
+        if await probe():
+            return time.monotonic()-t0
+        if alive is not None and not alive():
+            raise CanNotStartException(f"{name} exited before becoming ready")
+        now = time.monotonic()
+        if now>exit_sec:
+            raise CanNotStartException(f"{name} was not ready in {timeout_sec}s")
+        await asyncio.sleep(min(delay, exit_sec-now))
+        delay = min(delay*2, BACKOFF_MAX)
@@ -0,0 +1,193 @@
+import os
+import time
+from collections import deque
+from typing import Any
+from logging import Logger,getLogger
+
+logger:Logger = getLogger(__name__)
+
+CLK_TCK:int = os.sysconf('SC_CLK_TCK')
+PAGE_SIZE:int = os.sysconf('SC_PAGE_SIZE')
+
+class ProcStat:
+    """The fields of /proc/<pid>/stat that the sampler uses"""
+    __slots__ = ('pid','ppid','cpu_ticks','threads','rss')
+
+    def __init__(self, pid:int, ppid:int, cpu_ticks:int, threads:int, rss:int):
+        self.pid:int = pid
+        self.ppid:int = ppid
+        self.cpu_ticks:int = cpu_ticks
+        self.threads:int = threads
+        self.rss:int = rss
+
+def read_stat(pid:int) -> ProcStat|None:
+    try:
+        with open(f"/proc/{pid}/stat", 'rb') as f:
+            data = f.read()
+    except OSError:
+        return None
+    # the command name is in parentheses and may contain spaces
+    fields = data[data.rfind(b')')+2:].split()
+    try:
+        return ProcStat( pid, int(fields[1]), int(fields[11])+int(fields[12]), int(fields[17]), int(fields[21])*PAGE_SIZE )
+    except (IndexError, ValueError):
+        return None
+
+def scan_procs() -> dict[int,ProcStat]:
+    """One pass over /proc: the stat of every process"""
+    procs:dict[int,ProcStat] = {}
+    for name in os.listdir('/proc'):
+        if name.isdigit():
+            st = read_stat(int(name))
+            if st is not None:
+                procs[st.pid] = st
+    return procs
+
+def count_fds(pid:int) -> int:
+    try:
+        return len(os.listdir(f"/proc/{pid}/fd"))
+    except OSError:
+        return 0
+
+def read_pss(pid:int) -> int:
+    """Proportional set size in bytes, from smaps_rollup"""
+    try:
+        with open(f"/proc/{pid}/smaps_rollup", 'rb') as f:
+            for line in f:
+                if line.startswith(b'Pss:'):
+                    return int(line.split()[1])*1024
+    except (OSError, ValueError, IndexError):
+        pass
+    return 0
+
+def descendants(roots:list[int], procs:dict[int,ProcStat], children:dict[int,list[int]]) -> list[int]:
+    """The roots that are alive and all processes below them"""
+    found:list[int] = []
+    stack = [ pid for pid in roots if pid in procs ]
+    while stack:
+        pid = stack.pop()
+        found.append(pid)
+        stack.extend(children.get(pid,()))
+    return found
+
+class Usage:
+    """Resources used by the process tree of one session at one point in time"""
+    __slots__ = ('t','procs','cpu','cpu_sec','rss','pss','threads','fds')
+
+    def __init__(self, t:float):
+        self.t:float = t
+        self.procs:int = 0
+        # percent of one CPU since the previous sample
+        self.cpu:float = 0.0
+        self.cpu_sec:float = 0.0
+        self.rss:int = 0
+        self.pss:int = 0
+        self.threads:int = 0
+        self.fds:int = 0
+
+    def to_dict(self) -> dict[str,Any]:
+        return {
+            't': round(self.t,1),
+            'procs': self.procs,
+            'cpu': round(self.cpu,1),
+            'cpu_sec': round(self.cpu_sec,2),
+            'rss': self.rss,
+            'pss': self.pss,
+            'threads': self.threads,
+            'fds': self.fds,
+        }
+
+class ResourceSampler:
+    """Samples CPU, memory, threads and fds of each session's process tree
+
+    One /proc scan per tick finds every process and its parent, so the trees of all
+    sessions cost the same as one. PSS needs smaps_rollup, which walks the page
+    tables, so it is read only every pss_every ticks and carried over in between.
+    """
+
+    def __init__(self, *, history:int=60, pss_every:int=10):
+        self._history:int = history
+        self._pss_every:int = pss_every
+        self._ticks:int = 0
+        self._series:dict[str,deque[Usage]] = {}
+        # cpu ticks of each process at the previous sample
+        self._prev_cpu:dict[int,int] = {}
+        self._prev_t:float = 0.0
+        self._pss:dict[int,int] = {}
+        # cost of the last sample, to keep an eye on the overhead
+        self.cost:float = 0.0
+        self.scanned:int = 0
+
+    def sample(self, roots:dict[str,list[int]]) -> dict[str,Usage]:
+        """Take one sample of every session given as {key: root pids}"""
+        if not roots:
+            # nothing to account for, skip the scan
+            self._series.clear()
+            self._prev_cpu = {}
+            self._prev_t = 0.0
+            return {}
+        t0 = time.monotonic()
+        procs = scan_procs()
+        children:dict[int,list[int]] = {}
+        for st in procs.values():
+            children.setdefault(st.ppid,[]).append(st.pid)
+        elapsed = t0-self._prev_t if self._prev_t>0 else 0.0
+        read_pss_now = self._ticks % self._pss_every == 0
+        cpu_now:dict[int,int] = {}
+        result:dict[str,Usage] = {}
+        for key,pids in roots.items():
+            usage = Usage(time.time())
+            delta = 0
+            for pid in descendants(pids, procs, children):
+                st = procs[pid]
+                usage.procs += 1
+                usage.cpu_sec += st.cpu_ticks/CLK_TCK
+                usage.rss += st.rss
+                usage.threads += st.threads
+                usage.fds += count_fds(pid)
+                if read_pss_now:
+                    self._pss[pid] = read_pss(pid)
+                usage.pss += self._pss.get(pid,0)
+                cpu_now[pid] = st.cpu_ticks
+                delta += st.cpu_ticks - self._prev_cpu.get(pid,st.cpu_ticks)
+            if elapsed>0:
+                usage.cpu = 100.0*delta/CLK_TCK/elapsed
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = deque(maxlen=self._history)
+            series.append(usage)
+            result[key] = usage
+        # forget sessions and processes that are gone
+        for key in [ k for k in self._series if k not in roots ]:
+            del self._series[key]
+        self._pss = { pid:v for pid,v in self._pss.items() if pid in cpu_now }
+        self._prev_cpu = cpu_now
+        self._prev_t = t0
+        self._ticks += 1
+        self.scanned = len(procs)
+        self.cost = time.monotonic()-t0
+        return result
+
+    def latest(self, key:str) -> Usage|None:
+        series = self._series.get(key)
+        return series[-1] if series else None
+
+    def series(self, key:str) -> list[dict[str,Any]]:
+        return [ u.to_dict() for u in self._series.get(key,()) ]
+
+    def get_status(self) -> dict[str,Any]:
+        """Latest usage of every session and the total"""
+        total = Usage(time.time())
+        sessions:dict[str,Any] = {}
+        for key,series in self._series.items():
+            if not series:
+                continue
+            u = series[-1]
+            for name in ('procs','cpu','cpu_sec','rss','pss','threads','fds'):
+                setattr(total, name, getattr(total,name)+getattr(u,name))
+            sessions[key] = { 'latest': u.to_dict(), 'series': self.series(key) }
+        return {
+            'total': total.to_dict(),
+            'sessions': sessions,
+            'sampler': { 'cost_ms': round(self.cost*1000,3), 'scanned': self.scanned, 'ticks': self._ticks },
+        }
@@ -1,10 +1,10 @@
-import sys, os, shutil, subprocess, traceback, tempfile
-from datetime import datetime, timedelta
+import sys, os, shutil, traceback, tempfile, signal
+from datetime import timedelta
 import time
 import json
-from queue import Queue, Empty
 from threading import Lock
 from concurrent.futures import ThreadPoolExecutor, Future
+from typing import Callable
 import asyncio
 from asyncio import Task
 import aiohttp
@@ -18,67 +18,52 @@ from buweb.model.translate import Translate
 from buweb.agent.buw_agent import BuwWriter
 from buweb.task.operator import BwTask
 from buweb.task.research import BwResearchTask
+from buweb.task.browser_link import BrowserLink
+from buweb.task.pw_runtime import PlaywrightRuntime, PlaywrightPool
+from buweb.service.warm_pool import WarmPool
+from buweb.service.ports import CanNotStartException, PortAllocator, PortLease
+from buweb.service.procs import SupervisedProcess
+from buweb.service.channel import MsgChannel, Subscription
+from buweb.service.sse import ReplayBuffer
+from buweb.service.admission import AdmissionQueue, Ticket, PRIORITY_NORMAL
+from buweb.service.readiness import wait_ready, probe_x_display, probe_websockify, probe_cdp
+from buweb.service.task_proc import TaskProcess, TaskSpec, run_task
+from buweb.service.resources import ResourceSampler, Usage
+from buweb.service.profile import ProfileTemplate
+from buweb.service.trash import TrashReaper
+from buweb.service.expiry import ExpiryScheduler
+from buweb.service.blocklist import Blocklist
+from buweb.service.cdp import CdpBlocker, capture_screenshot
+from buweb.service.vnc import VNC_PROFILES, DEFAULT_VNC_PROFILE, VIEWER_IDLE_TIMEOUT
+from buweb.service.upload import UploadError, FileWriter, safe_filename, upload_events, UPLOAD_MAX, UPLOAD_QUOTA, PROGRESS_INTERVAL
+from buweb.utils.metrics import BRINGUP_SECONDS, SSE_LAG_SECONDS, POOL_BUSY, TASK_PROCS
 from logging import Logger,getLogger
 logger:Logger = getLogger(__name__)
 
-class CanNotStartException(Exception):
-    pass
-
 HOSTSFILE:str = 'hosts.adblock'
+# the ad blocking hosts file is downloaded again when it is older than this
+HOSTS_MAX_AGE:float = 3600.0
+HOSTS_RETRY:float = 600.0
 
-def is_port_available(port: int) -> bool:
-    # Check if the specified port is available
-    import socket
-    try:
-        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-            s.bind(('localhost', port))
-            return True
-    except (socket.error, OSError):
-        return False
-
-def find_available_display() -> tuple[int,int]:
-    """Find available display numbers"""
-    for num in range(10, 100):
-        port = 5900 + num # Port for VNC server
-        if is_port_available(port):
-            return num, port
-    raise CanNotStartException("No available display number found")
-
-def find_ws_port() -> int:
-    for num in range(30, 100):
-        port = 5000 + num # port for websockify
-        if is_port_available(port):
-            return port
-    raise CanNotStartException("No available websock port found")
-
-def find_cdn_port() -> int:
-    """Find available display numbers"""
-    for num in range(0, 100):
-        port = 9222 + num # port for websockify
-        if is_port_available(port):
-            return port
-    raise CanNotStartException("No available CDN port found")
-
-def is_proc( proc:subprocess.Popen|None ):
-    if proc is not None and proc.poll() is None:
-        return True
-    return False
-    
-async def stop_proc( proc:subprocess.Popen|None ):
+# where tasks run: 'thread' (asyncio.run in the thread pool) or 'process' (one child process per task)
+TASK_BACKENDS:tuple[str,...] = ('thread','process')
+
+# on exit, sessions not torn down by then are killed
+SHUTDOWN_DEADLINE:float = 10.0
+
+# (n_task, n_agent, n_step, n_act, header, msg, progress)
+Msg = tuple[int,int,int,int,str,str,str|None]
+
+def is_proc( proc:SupervisedProcess|None ) -> bool:
+    # cached liveness, no system call
+    return proc is not None and proc.alive
+
+async def stop_proc( proc:SupervisedProcess|None ):
     if proc is not None:
         try:
-            proc.terminate()
-        except:
-            pass
-        try:
-            while True:
-                try:
-                    proc.wait(timeout=0.01)
-                    return
-                except subprocess.TimeoutExpired:
-                    await asyncio.sleep(1)
+            await proc.stop()
         except:
-            pass
+            logger.exception(f"error while stopping {proc.name}")
 
 async def download_hosts_file_async(save_path: str):
     url = "https://raw.githubusercontent.com/StevenBlack/hosts/master/hosts"
@@ -107,22 +92,51 @@ async def download_hosts_file_async(save_path: str):
         print(f"Error downloading `hosts` file: {e}")
 
 class BwSession:
-    def __init__(self,session_id:str, server_addr:str, client_addr:str|None, *, dir:str, hostsfile:str, Pool:ThreadPoolExecutor, lock:asyncio.Lock):
+    def __init__(self,session_id:str, server_addr:str, client_addr:str|None, *, dir:str, Pool:ThreadPoolExecutor, ports:PortAllocator, blocklist:Blocklist|None=None, playwright:PlaywrightRuntime|None=None, lock:asyncio.Lock|None=None):
         self.session_id:str = session_id
         self.server_addr:str = server_addr
         self.client_addr:str|None = client_addr
-        self.last_access:datetime = datetime.now()
+        # time.monotonic() of the last use, the session expires session_timeout after it
+        self.last_access:float = time.monotonic()
+        self.created_at:float = time.monotonic()
         self.WorkDir:str = dir
-        self.hostsfile:str = hostsfile
+        # applied to Chrome's requests over CDP
+        self.blocklist:Blocklist|None = blocklist
+        self.blocker:CdpBlocker|None = None
         self.Pool:ThreadPoolExecutor = Pool
-        self._lock:asyncio.Lock = lock
-        self.geometry = "1024x900"
-        self.vnc_proc:subprocess.Popen|None = None
-        self.chrome_process:subprocess.Popen|None = None
+        self._ports:PortAllocator = ports
+        self._lease:PortLease|None = None
+        # per-session lock, so that other sessions can start at the same time
+        self._lock:asyncio.Lock = lock if lock is not None else asyncio.Lock()
+        # child processes are bound to the loop that started them
+        self._loop:asyncio.AbstractEventLoop = asyncio.get_running_loop()
+        # depth, geometry and frame rate of Xvnc, a key of VNC_PROFILES
+        self.vnc_profile:str = DEFAULT_VNC_PROFILE
+        # Chrome without an X server: no VNC view, screenshots instead
+        self.headless:bool = False
+        self.vnc_proc:SupervisedProcess|None = None
+        # runs only while a noVNC client is attached
+        self.ws_proc:SupervisedProcess|None = None
+        self.chrome_process:SupervisedProcess|None = None
         self.display_num:int = 0
         self.vnc_port:int = 0
         self.ws_port:int = 0
         self.cdp_port:int = 0
+        # seconds spent in each bring-up stage
+        self.startup_times:dict[str,float] = {}
+        # Chrome profile that has already been through its first run
+        self.profile_template:ProfileTemplate|None = None
+        # the workdir is handed to it on cleanup
+        self.trash:TrashReaper|None = None
+        # latest resource usage of the session's process trees, set by the sampler
+        self.usage:Usage|None = None
+        # uploads: largest file, total per session and what has been stored so far
+        self.upload_max:int = UPLOAD_MAX
+        self.upload_quota:int = UPLOAD_QUOTA
+        # bytes of the stored uploads and of those in progress
+        self.upload_bytes:int = 0
+        # size of each stored upload by name, given back when it is replaced
+        self._uploads:dict[str,int] = {}
         # setting
         self._operator_llm:LLM = LLM.Gemini20Flash
         self._planner_llm:LLM|None = None
@@ -130,11 +144,27 @@ class BwSession:
         self._n_tasks:int = 0
         self._task_expand:bool = False
         self.task:BwTask|BwResearchTask|None = None
-        self.message_queue: Queue[tuple[int,int,int,int,str,str,str|None]] = Queue()
+        self.task_backend:str = 'thread'
+        # thread backend: tasks run on the loop of the Playwright runtime assigned to the session,
+        # shared with a few other sessions, and the connection to Chrome is kept across tasks
+        self.playwright:PlaywrightRuntime = playwright if playwright is not None else PlaywrightRuntime()
+        self.browser_link:BrowserLink = BrowserLink(self.playwright)
+        self._llm_cache_path:str|None = None
+        # process backend: the driving coroutine and the child process
+        self._task_job:Task|None = None
+        self.task_proc:TaskProcess|None = None
+        # written from task threads, read by the SSE stream
+        # each message is stamped with the time it was written
+        self.messages:MsgChannel[tuple[Msg,float]] = MsgChannel(self._loop)
+        self._msg_sub:Subscription[tuple[Msg,float]] = self.messages.subscribe()
+        # frames already sent to the client, and the generation of the stream that owns the session
+        self.replay:ReplayBuffer = ReplayBuffer(session_id)
+        self.stream_gen:int = 0
         self.current_future: Future|None = None
 
     def touch(self):
-        self.last_access:datetime = datetime.now()
+        # also called from task threads: a plain store, the expiry scheduler reads it when the deadline comes
+        self.last_access = time.monotonic()
 
     def _write_msg(self,msg):
         self._write_msg4( self._n_tasks,0,0,0,"",msg,None)
@@ -145,36 +175,48 @@ class BwSession:
             msgstr = json.dumps(msg,ensure_ascii=False)
         else:
             msgstr = str(msg)
-        self.message_queue.put( (n_task,n_agent,n_step,n_act,header,msgstr,progress) )
+        self.messages.publish( ((n_task,n_agent,n_step,n_act,header,msgstr,progress), time.monotonic()) )
 
     async def get_msg(self,*,timeout:float=1.0) ->tuple[int,int,int,int,str|None,str|None,str|None]:
-        break_time = time.time() + max(0, timeout)
-        while True:
-            try:
-                self.touch()
-                return self.message_queue.get_nowait()
-            except Empty as ex:
-                now = time.time()
-                if now<break_time:
-                    await asyncio.sleep(0.2)
-                    continue
-                return (0,0,0,0,None,None,None)
+        self.touch()
+        item = await self._msg_sub.get(max(0, timeout))
+        self.touch()
+        if item is None:
+            return (0,0,0,0,None,None,None)
+        return item[0]
+
+    async def get_msgs(self,*,timeout:float=1.0, window:float=0.05) ->list[Msg]:
+        """Wait for a message and return it together with the ones written shortly after"""
+        self.touch()
+        items = await self._msg_sub.get_batch(max(0, timeout), window)
+        self.touch()
+        if items:
+            # the oldest message in the batch waited the longest
+            SSE_LAG_SECONDS.observe(time.monotonic()-items[0][1])
+        return [ msg for msg,_ in items ]
+
+    def unread_msgs(self, items:list[Msg]) -> None:
+        """Return messages taken by a stream that lost the session to a newer one"""
+        now = time.monotonic()
+        self._msg_sub.unget([ (msg,now) for msg in items ])
 
     def is_vnc_running(self) -> int:
         return self.display_num if self.display_num>0 and is_proc(self.vnc_proc) else 0
 
     def is_websockify_running(self) -> int:
-        return self.ws_port if self.ws_port>0 and is_proc(self.vnc_proc) else 0
+        return self.ws_port if self.ws_port>0 and is_proc(self.ws_proc) else 0
 
     def is_chrome_running(self) -> int:
         return self.cdp_port if self.cdp_port>0 and is_proc(self.chrome_process) else 0
 
     def is_ready(self) -> bool:
-        return self.is_vnc_running()>0 and self.is_chrome_running()>0
+        return self.is_chrome_running()>0 and (self.headless or self.is_vnc_running()>0)
 
     def is_task(self) ->int:
         if self.current_future and self.current_future.running():
             return 1
+        elif self._task_job is not None and not self._task_job.done():
+            return 1
         else:
             return 0
 
@@ -187,17 +229,42 @@ class BwSession:
             'vnc': self.is_vnc_running(),
             'ws': self.is_websockify_running(),
             'br': self.is_chrome_running(),
+            'hl': 1 if self.headless else 0,
+            'vq': self.vnc_profile,
             'task': self.is_task(),
         }
+        if self.startup_times:
+            res['startup'] = dict(self.startup_times)
         return res
 
-    async def wait_port(self,proc:subprocess.Popen, port:int, timeout_sec:float):
-        exit_sec:float = time.time() + timeout_sec
-        while not is_port_available(port) and is_proc(proc):
-            self.touch()
-            if time.time()>exit_sec:
-                raise CanNotStartException(f"Port number {port} was not enabled")
-            await asyncio.sleep(.2)
+    def root_pids(self) -> list[int]:
+        """The processes whose trees make up this session"""
+        pids:list[int] = []
+        for proc in (self.vnc_proc, self.ws_proc, self.chrome_process):
+            if is_proc(proc):
+                pids.append(proc.pid)
+        task_proc = self.task_proc
+        if task_proc is not None and task_proc.running and task_proc.pid:
+            pids.append(task_proc.pid)
+        return pids
+
+    async def wait_stage(self, stage:str, proc:SupervisedProcess, probe, timeout_sec:float) -> None:
+        """Wait until the probe succeeds and record how long the stage took"""
+        self.touch()
+        elapsed = await wait_ready(probe, name=stage, timeout_sec=timeout_sec, alive=lambda: is_proc(proc))
+        self.startup_times[stage] = round(elapsed,3)
+        BRINGUP_SECONDS.observe(elapsed, stage)
+        logger.info(f"[{self.session_id}] {stage} ready in {elapsed:.3f}s")
+
+    def _get_lease(self) -> PortLease:
+        if self._lease is None:
+            self._lease = self._ports.lease(display=not self.headless)
+        return self._lease
+
+    def _release_lease(self) -> None:
+        if self._lease is not None:
+            self._lease.release()
+            self._lease = None
 
     async def setup_vnc_server(self) -> None:
         """Set up a VNC server and return the hostname and port"""
@@ -210,40 +277,43 @@ class BwSession:
         self.ws_port = 0
 
         await stop_proc(self.vnc_proc)
+        # a websockify left from an Xvnc that died
+        ws_proc, self.ws_proc = self.ws_proc, None
+        await stop_proc(ws_proc)
 
-        vnc_proc:subprocess.Popen|None = None
+        vnc_proc:SupervisedProcess|None = None
         try:
-            # Start a new VNC server (using a port in the 5900 range)
-            display_num,vnc_port = find_available_display()
-            # Start websockify (websockify uses 5900, VNC uses 6900)
-            ws_port = find_ws_port()
-            
+            # Display, VNC port (5900 range) and websockify port are reserved together
+            lease = self._get_lease()
+            display_num,vnc_port,ws_port = lease.display_num, lease.vnc_port, lease.ws_port
+            profile = VNC_PROFILES[self.vnc_profile]
+
             script_path = str(files('buweb.scripts').joinpath('start_vnc.sh'))
             if not os.access(script_path, os.X_OK):
                 print(f"Error: {script_path} is not executable.")
-            vnc_proc = subprocess.Popen( [
+            vnc_proc = await SupervisedProcess.start( [
                         script_path,
                         "--display", str(display_num),
-                        "--geometry", str(self.geometry),
+                        "--geometry", profile.geometry,
+                        "--depth", str(profile.depth),
+                        "--framerate", str(profile.frame_rate),
                         "--rfbport", str(vnc_port),
-                        "--wsport", str(ws_port)
-                    ], cwd=self.WorkDir, stderr=subprocess.DEVNULL)
-            # Wait for the VNC server to start
-            await self.wait_port( vnc_proc, vnc_port, 10.0)
-            # Wait for websockify to start
-            await self.wait_port(vnc_proc,ws_port,10.0)
-            if vnc_proc.poll() is not None:
+                    ], name=f"[{self.session_id}] Xvnc", cwd=self.WorkDir, stderr=asyncio.subprocess.DEVNULL)
+            self.startup_times = {}
+            # Wait for the X server to accept clients
+            await self.wait_stage('vnc', vnc_proc, lambda: probe_x_display(display_num), 10.0)
+            if not vnc_proc.alive:
                 raise CanNotStartException("Xvnc could not be started")
             
-            logger.info(f"[{self.session_id}] Started Xvnc pid:{vnc_proc.pid} :{display_num} port:{vnc_port} port:{ws_port}")
+            logger.info(f"[{self.session_id}] Started Xvnc pid:{vnc_proc.pid} :{display_num} port:{vnc_port} profile:{self.vnc_profile}")
             self.vnc_proc = vnc_proc
             self.display_num = display_num
             self.vnc_port = vnc_port
             self.ws_port = ws_port
-            await asyncio.sleep(0.5)
 
         except Exception as ex:
             await stop_proc(vnc_proc)
+            self._release_lease()
             raise ex
 
     async def launch_chrome(self) -> None:
@@ -252,37 +322,147 @@ class BwSession:
             return
         self.chrome_process = None
         self.cdp_port = 0
-        chrome_process:subprocess.Popen|None = None
+        chrome_process:SupervisedProcess|None = None
         try:
-            cdp_port = find_cdn_port()
+            cdp_port = self._get_lease().cdp_port
+            if self.headless:
+                # there is no vnc stage that starts the timings
+                self.startup_times = {}
+            if self.profile_template is not None:
+                t0 = time.monotonic()
+                if await self.profile_template.copy_to(self.WorkDir):
+                    self.startup_times['profile'] = round(time.monotonic()-t0,3)
+                    BRINGUP_SECONDS.observe(time.monotonic()-t0, 'profile')
             prof = f"{self.WorkDir}/.config/google-chrome/Default"
             os.makedirs(prof,exist_ok=True)
             script_path = str(files('buweb.scripts').joinpath('start_browser.sh'))
             if not os.access(script_path, os.X_OK):
                 print(f"Error: {script_path} is not executable.")
             bcmd=[ script_path,
-                "--display", str(self.display_num),
                 "--workdir", str(self.WorkDir),
                 "--cdpport", str(cdp_port),
             ]
-            if os.path.exists(self.hostsfile):
-                bcmd.extend( ["--hosts",self.hostsfile])
-            chrome_process = subprocess.Popen( bcmd, cwd=self.WorkDir, stdout=subprocess.DEVNULL )
-            await self.wait_port(chrome_process,cdp_port,30.0)
-            if chrome_process.poll() is not None:
+            if self.headless:
+                bcmd.append("--headless")
+            else:
+                bcmd.extend( ["--display", str(self.display_num)] )
+            chrome_process = await SupervisedProcess.start( bcmd, name=f"[{self.session_id}] chrome", cwd=self.WorkDir )
+            # Wait for the DevTools endpoint to answer
+            await self.wait_stage('chrome', chrome_process, lambda: probe_cdp(cdp_port), 30.0)
+            if not chrome_process.alive:
                 raise CanNotStartException("google-chrome could not be started")
             self.chrome_process = chrome_process
             self.cdp_port = cdp_port
+            await self.start_blocker()
         except Exception as ex:
             await stop_proc(chrome_process)
             raise ex
 
+    async def start_blocker(self) -> None:
+        """Apply the blocklist to the running Chrome"""
+        if self.blocklist is None or not self.blocklist.enabled or self.cdp_port<=0:
+            return
+        await self.stop_blocker()
+        t0 = time.monotonic()
+        blocker = CdpBlocker(self.cdp_port, self.blocklist, name=f"[{self.session_id}]")
+        try:
+            await blocker.start()
+        except Exception as ex:
+            # the browser still works, without blocking
+            logger.warning(f"[{self.session_id}] blocklist not applied: {ex}")
+            await blocker.stop()
+            return
+        self.blocker = blocker
+        self.startup_times['blocklist'] = round(time.monotonic()-t0,3)
+        BRINGUP_SECONDS.observe(time.monotonic()-t0, 'blocklist')
+
+    async def stop_blocker(self) -> None:
+        if self.blocker is not None:
+            blocker, self.blocker = self.blocker, None
+            await blocker.stop()
+
+    async def bring_up(self) -> None:
+        """Start Xvnc and Chrome if they are not running"""
+        async with self._lock:
+            was_ready = self.is_ready()
+            t0 = time.monotonic()
+            if not self.headless:
+                await self.setup_vnc_server()
+            if self.headless or is_proc(self.vnc_proc):
+                await self.launch_chrome()
+            if not was_ready and self.is_ready():
+                BRINGUP_SECONDS.observe(time.monotonic()-t0, 'total')
+
+    async def _on_session_loop(self, coro):
+        """Run a coroutine on the session's loop, also when called from a task thread"""
+        if asyncio.get_running_loop() is self._loop:
+            return await coro
+        return await asyncio.wrap_future( asyncio.run_coroutine_threadsafe(coro, self._loop) )
+
+    async def set_headless(self, headless:bool) -> None:
+        """Switch between a VNC and a headless browser, restarting a running one"""
+        if headless==self.headless:
+            return
+        if self.is_task():
+            raise RuntimeError("Task is running")
+        if is_proc(self.chrome_process) or is_proc(self.vnc_proc):
+            await self.stop_browser()
+        self.headless = headless
+
+    async def set_vnc_profile(self, name:str) -> None:
+        """Select a quality profile, restarting a running browser on the new display"""
+        if name not in VNC_PROFILES:
+            raise ValueError(f"invalid vnc profile {name}")
+        if name==self.vnc_profile:
+            return
+        if self.is_task():
+            raise RuntimeError("Task is running")
+        if is_proc(self.chrome_process) or is_proc(self.vnc_proc):
+            await self.stop_browser()
+        self.vnc_profile = name
+
+    async def attach_viewer(self) -> dict:
+        """Start websockify for a noVNC client; it exits by itself once no viewer is left"""
+        self.touch()
+        async with self._lock:
+            if self.is_vnc_running()>0 and not is_proc(self.ws_proc):
+                ws_proc:SupervisedProcess|None = None
+                ws_port = self.ws_port
+                try:
+                    script_path = str(files('buweb.scripts').joinpath('start_websockify.sh'))
+                    ws_proc = await SupervisedProcess.start( [
+                                script_path,
+                                "--rfbport", str(self.vnc_port),
+                                "--wsport", str(ws_port),
+                                "--idle-timeout", str(VIEWER_IDLE_TIMEOUT),
+                            ], name=f"[{self.session_id}] websockify", cwd=self.WorkDir, stderr=asyncio.subprocess.DEVNULL)
+                    # Wait for websockify to complete a handshake
+                    await self.wait_stage('ws', ws_proc, lambda: probe_websockify(ws_port), 10.0)
+                    self.ws_proc = ws_proc
+                except Exception:
+                    logger.exception(f"[{self.session_id}] websockify could not be started")
+                    await stop_proc(ws_proc)
+        return self.get_status()
+
+    async def detach_viewer(self) -> dict:
+        """The client closed its VNC view"""
+        async with self._lock:
+            ws_proc, self.ws_proc = self.ws_proc, None
+            await stop_proc(ws_proc)
+        return self.get_status()
+
+    async def screenshot(self, quality:int=60) -> bytes|None:
+        """JPEG of the page the browser shows, for clients that have no VNC view"""
+        port = self.is_chrome_running()
+        if port<=0:
+            return None
+        self.touch()
+        return await capture_screenshot(port, quality=quality)
+
     async def start_browser(self) ->dict:
         try:
             self.touch()
-            await self.setup_vnc_server()
-            if is_proc(self.vnc_proc):
-                await self.launch_chrome()
+            await self.bring_up()
         except CanNotStartException as ex:
             logger.warning(f"[{self.session_id}] {str(ex)}")
         except Exception as ex:
@@ -292,15 +472,22 @@ class BwSession:
     async def start_task(self, mode:int, task_info: str, llm:LLM, planner_llm:LLM|None, llm_cache:BaseCache|None, trans:Translate, sensitive_data:dict[str,str]|None) -> None:
         """Start task"""
         self.touch()
-        if self.task is not None or self.current_future is not None:
+        if self.task is not None or self.current_future is not None or self.is_task():
             raise RuntimeError("Task is already running")
+        elif self.task_backend=='process':
+            self._task_job = asyncio.create_task( self._run_task_process(mode, task_info, llm, planner_llm, trans, sensitive_data) )
         else:
             self.current_future = self.Pool.submit(self._start_task, mode, task_info, llm, planner_llm, llm_cache, trans, sensitive_data )
 
     def _start_task(self, mode:int, prompt: str, llm:LLM, planner_llm:LLM|None,  llm_cache:BaseCache|None, trans:Translate, sensitive_data:dict[str,str]|None ) ->None:
         #loop = asyncio.get_event_loop()
         #loop.run_until_complete(self._run_task(mode, prompt, llm, planner_llm, llm_cache, sensitive_data))
-        asyncio.run(self._run_task(mode, prompt, llm, planner_llm, llm_cache, trans, sensitive_data))
+        POOL_BUSY.inc()
+        try:
+            # the pool thread only waits: the number of running tasks stays bounded by the pool
+            self.playwright.run(self._run_task(mode, prompt, llm, planner_llm, llm_cache, trans, sensitive_data))
+        finally:
+            POOL_BUSY.dec()
 
     async def _run_task(self, mode:int, prompt: str, llm:LLM, planner_llm:LLM|None,  llm_cache:BaseCache|None, trans:Translate, sensitive_data:dict[str,str]|None) ->None:
         self._n_tasks+=1
@@ -308,20 +495,27 @@ class BwSession:
         try:
             self.touch()
             await buw.start_global_task(prompt)
-            async with self._lock:
-                await self.setup_vnc_server()
-                await self.launch_chrome()
+            await self._on_session_loop(self.bring_up())
+            browser, browser_context = None, None
+            try:
+                browser, browser_context = await self.browser_link.acquire(self.cdp_port)
+                BRINGUP_SECONDS.observe(self.browser_link.last_acquire, 'browser_link')
+            except Exception as ex:
+                # the task connects by itself
+                logger.warning(f"[{self.session_id}] browser link not available: {ex}")
             if mode==1:
                 self.task = BwResearchTask( dir=self.WorkDir,
                                 llm_cache=llm_cache, llm=llm, plan_llm=planner_llm,
                                 cdp_port=self.cdp_port,
                                 sensitive_data=sensitive_data,
+                                browser=browser, browser_context=browser_context,
                                 writer=buw)
             else:
                 self.task = BwTask( dir=self.WorkDir,
                                 llm_cache=llm_cache, llm=llm, plan_llm=planner_llm,
                                 cdp_port=self.cdp_port,
                                 sensitive_data=sensitive_data,
+                                browser=browser, browser_context=browser_context,
                                 writer=buw)
             await self.task.start(prompt)
             await self.task.stop()
@@ -336,8 +530,46 @@ class BwSession:
             self.task = None
             await buw.done_global_task()
 
+    async def _run_task_process(self, mode:int, prompt: str, llm:LLM, planner_llm:LLM|None, trans:Translate, sensitive_data:dict[str,str]|None) ->None:
+        """Run the task in a child process, so that agents do not share the server's GIL"""
+        self._n_tasks+=1
+        buw:BuwWriter = BuwWriter( n_task=self._n_tasks, writer=self._write_msg4, trans=trans )
+        try:
+            self.touch()
+            await buw.start_global_task(prompt)
+            await self.bring_up()
+            spec = TaskSpec( mode=mode, prompt=prompt, llm=llm.name, planner_llm=planner_llm.name if planner_llm else None,
+                            workdir=self.WorkDir, cdp_port=self.cdp_port, n_task=self._n_tasks,
+                            llm_cache_path=self._llm_cache_path, trans_lang=trans.lang if trans else None,
+                            trans_cachefile=trans.cachefile if trans else None, sensitive_data=sensitive_data )
+            self.task_proc = TaskProcess( run_task, (spec,), on_msg=self._write_msg4, name=f"task-{self.session_id}-{self._n_tasks}" )
+            logger.info(f"[{self.session_id}] task {self._n_tasks} in process {self.task_proc.pid}")
+            TASK_PROCS.inc()
+            try:
+                await self.task_proc.wait()
+            finally:
+                TASK_PROCS.dec()
+        except CanNotStartException as ex:
+            logger.warning(f"[{self.session_id}] {str(ex)}")
+            await buw.done_global_task(str(ex))
+        except Exception as ex:
+            logger.exception(f"[{self.session_id}] {str(ex)}")
+            await buw.done_global_task(str(ex))
+        finally:
+            self.task_proc = None
+            await buw.done_global_task()
+
     async def cancel_task(self) -> dict:
         """Cancel task"""
+        if self._task_job is not None:
+            # forwarded to the child, which stops its agent
+            task_proc = self.task_proc
+            if task_proc is not None:
+                await task_proc.stop()
+            if not self._task_job.done():
+                self._task_job.cancel()
+            self._task_job = None
+            return self.get_status()
         try:
             future:Future|None = self.current_future
             if future is not None:
@@ -351,55 +583,129 @@ class BwSession:
         return self.get_status()
 
     async def stop_browser(self) ->dict:
+        # Cancel task, without the lock: a thread backend task may be waiting for it
+        # in bring_up(), and cancel_task() waits for that task to end
+        logger.info(f"[{self.session_id}] stop_cancel_task")
+        try:
+            await self.cancel_task()
+        except Exception as e:
+            logger.exception(f"[{self.session_id}] Error occurred while cancelling the task: {str(e)}")
         async with self._lock:
             try:
-                logger.info(f"[{self.session_id}] stop_cancel_task")
-                # Cancel task
-                await self.cancel_task()
-                
+                # Chrome and Xvnc/websockify each run in their own process group
                 logger.info(f"[{self.session_id}] stop_browser")
-                await stop_proc( self.chrome_process )
+                t0 = time.monotonic()
+                await self.stop_blocker()
+                await asyncio.gather( stop_proc( self.chrome_process ), stop_proc( self.ws_proc ), stop_proc( self.vnc_proc ) )
+                logger.info(f"[{self.session_id}] stopped browser in {time.monotonic()-t0:.3f}s")
                 self.chrome_process = None
                 self.cdp_port = 0
-                logger.info(f"[{self.session_id}] stop_vnc")
-                await stop_proc( self.vnc_proc )
-                logger.info(f"[{self.session_id}] stop_kill")
                 self.vnc_proc = None
-                # Kill remaining processes
-                if self.display_num>0:
-                    cmd = f"pkill -f 'Xvnc.*:{self.display_num}'"
-                    subprocess.run(["/bin/bash", "-c", cmd], check=False)
-                if self.vnc_port>0 and self.ws_port>0:
-                    cmd = f"pkill -f 'websockify.*:{self.ws_port}|:{self.vnc_port}'"
-                    subprocess.run(["/bin/bash", "-c", cmd], check=False)
-                    cmd = f"pkill -f 'websockify.*:{self.vnc_port}|:{self.ws_port}'"
-                    subprocess.run(["/bin/bash", "-c", cmd], check=False)
+                self.ws_proc = None
                 self.display_num = 0
                 self.vnc_port = 0
                 self.ws_port = 0
+                self._release_lease()
             except Exception as e:
                 logger.exception(f"[{self.session_id}] Error occurred while stopping VNC server: {str(e)}")
         return self.get_status()
 
     async def store_file(self, file_path:str, data:bytes) -> None:
         """Save file"""
-        store_path = os.path.join(self.WorkDir, file_path)
-        with open(store_path, "wb") as f:
-            f.write(data)
+        await self._store_chunks(file_path, self._single(data), len(data))
+
+    @staticmethod
+    async def _single(data:bytes):
+        yield 'data', data
+        yield 'end', None
+
+    async def receive_upload(self, body, content_type:str|None, name:str|None, *, length:int|None=None) -> list[str]:
+        """Stream the uploaded file of a request body into the workdir, returns the stored names"""
+        stored:list[str] = []
+        events = upload_events(body, content_type, name)
+        try:
+            async for kind, value in events:
+                if kind=='file':
+                    stored.append( await self._store_chunks(value, events, length) )
+        finally:
+            await events.aclose()
+        return stored
+
+    async def _store_chunks(self, filename:str|None, events, length:int|None) -> str:
+        """Write ('data', chunk) events up to ('end', None) to a file, with progress on the session stream"""
+        name = safe_filename(filename)
+        if self.upload_bytes>=self.upload_quota:
+            raise UploadError(f"upload quota of {self.upload_quota>>20}MB used up", 413)
+        writer = FileWriter(self.WorkDir, name, limit=self.upload_max)
+        next_report = time.monotonic()+PROGRESS_INTERVAL
+        # each chunk is reserved before it is written, so that concurrent uploads cannot overrun the quota
+        reserved = 0
+        await writer.open()
+        try:
+            async for kind, chunk in events:
+                if kind=='end':
+                    break
+                if self.upload_bytes+len(chunk)>self.upload_quota:
+                    raise UploadError(f"upload quota of {self.upload_quota>>20}MB used up", 413)
+                self.upload_bytes += len(chunk)
+                reserved += len(chunk)
+                await writer.write(chunk)
+                if time.monotonic()>=next_report:
+                    next_report = time.monotonic()+PROGRESS_INTERVAL
+                    self._write_msg4(self._n_tasks,0,0,0,"upload",name,self._upload_progress(writer.size,length))
+            else:
+                raise UploadError('incomplete upload')
+            await writer.commit()
+        except BaseException:
+            self.upload_bytes -= reserved
+            await writer.abort()
+            raise
+        self.upload_bytes -= self._uploads.get(name, 0)
+        self._uploads[name] = writer.size
+        self._write_msg4(self._n_tasks,0,0,0,"upload",name,"100%")
+        logger.info(f"[{self.session_id}] stored {name} {writer.size} bytes, {self.upload_bytes>>20}MB of {self.upload_quota>>20}MB used")
+        return name
+
+    @staticmethod
+    def _upload_progress(size:int, length:int|None) -> str:
+        if length:
+            return f"{min(99, size*100//length)}%"
+        return f"{size>>10}KB"
+
+    def kill(self) -> None:
+        """Last resort on exit: SIGKILL every process group of the session without waiting"""
+        for proc in (self.chrome_process, self.ws_proc, self.vnc_proc):
+            if proc is not None:
+                proc.killpg(signal.SIGKILL)
+        task_proc = self.task_proc
+        if task_proc is not None:
+            task_proc.kill()
+        self._release_lease()
 
     async def cleanup(self) -> None:
         """Clean up resources"""
         await self.stop_browser()
+        self._release_lease()
         if self.task:
             await self.task.stop()
+        if self.browser_link.browser is not None:
+            try:
+                await asyncio.wrap_future( self.playwright.submit(self.browser_link.close()) )
+            except Exception:
+                logger.exception(f"[{self.session_id}] error while closing the browser link")
         try:
-            shutil.rmtree(self.WorkDir)
+            if self.trash is not None:
+                # a rename only, the reaper thread deletes the files
+                elapsed = self.trash.discard(self.WorkDir)
+                logger.info(f"[{self.session_id}] workdir moved to trash in {elapsed*1000:.3f}ms")
+            else:
+                await asyncio.to_thread(shutil.rmtree, self.WorkDir)
         except Exception as e:
             logger.exception(f"[{self.session_id}] Error while stopping: {str(e)}")
 
 # Dictionary to store session data
 class SessionStore:
-    def __init__(self, *, max_sessions:int=3, dir:str="tmp/sessions", Pool:ThreadPoolExecutor|None=None):
+    def __init__(self, *, max_sessions:int=3, dir:str="tmp/sessions", Pool:ThreadPoolExecutor|None=None, playwright:PlaywrightPool|None=None):
         self._lock = asyncio.Lock()
         self._connect:int = 0
         self._max_sessions:int = max_sessions
@@ -407,65 +713,83 @@ class SessionStore:
         self.SessionsDir:str = os.path.abspath(dir)
         os.makedirs(self.SessionsDir,exist_ok=True)
         self.hostsfile:str = os.path.join(self.SessionsDir,'hosts.adblock')
+        # compiled from the downloaded hosts file and any local lists
+        self.blocklist:Blocklist = Blocklist([self.hostsfile])
         self.Pool:ThreadPoolExecutor = Pool if isinstance(Pool,ThreadPoolExecutor) else ThreadPoolExecutor()
-        self._lock2:asyncio.Lock = asyncio.Lock()
-        self.cleanup_interval:timedelta = timedelta(minutes=30)
+        self.ports:PortAllocator = PortAllocator()
+        # a few Playwright drivers, each with its own loop, shared by the sessions
+        self.playwright:PlaywrightPool = playwright if playwright is not None else PlaywrightPool()
         self.session_timeout:timedelta = timedelta(hours=2)
-        self._last_cleanup:datetime = datetime.now()
-        self._sweeper_task:Task|None = None
+        self._expiry:ExpiryScheduler = ExpiryScheduler(self._session_deadline, self._expire_session)
+        self._hosts_task:Task|None = None
+        # sessions whose client disconnected are kept for this long
+        self.stream_grace:float = 30.0
+        self._detached:dict[str,Task] = {}
+        # called with the id of each removed session
+        self.on_removed:Callable[[str],None]|None = None
         self._llm_cache_path:str = os.path.join(self.SessionsDir,'langchain_cache.db')
         self._llm_cache:BaseCache = SQLiteCache(self._llm_cache_path)
         self._trans:Translate = Translate('ja', os.path.join(self.SessionsDir,'translate_cache.json'))
+        self.task_backend:str = 'thread'
+        # quality profile of new sessions and of the warm pool
+        self.vnc_profile:str = DEFAULT_VNC_PROFILE
+        # limits of the uploads into a session's workdir
+        self.upload_max:int = UPLOAD_MAX
+        self.upload_quota:int = UPLOAD_QUOTA
+        self.profile_template:ProfileTemplate = ProfileTemplate(os.path.join(self.SessionsDir,'profile_template'), ports=self.ports)
+        self.trash:TrashReaper = TrashReaper(os.path.join(self.SessionsDir,'.trash'))
+        # per-session resource accounting
+        self.resources:ResourceSampler = ResourceSampler()
+        self.resource_interval:float = 1.0
+        self._resource_task:Task|None = None
         # setting
         self._operator_llm:LLM = LLM.Gemini20Flash
         self._planner_llm:LLM|None = None
+        # pre-started sandboxes
+        self._warm_pool:WarmPool = WarmPool(self._create_warm_session, self._discard_session, self._warm_capacity)
+        # clients waiting for a free session slot
+        self._admission:AdmissionQueue = AdmissionQueue(lambda: self._max_sessions - len(self.sessions))
 
-    async def _start_sweeper(self):
-        if self._sweeper_task is None:
-            self._sweeper_task = asyncio.create_task(self._sweeper_loop())
-
-    async def _sweeper_loop(self):
-        try:
-            logger.info("start sweeper")
-            while True:
-                # Update the hosts file for ad blocking
-                now = time.time()
-                last_mod_sec:float = os.path.getmtime(self.hostsfile) if os.path.exists(self.hostsfile) else 0.0
-                if (now-last_mod_sec)>3600.0:
-                    await download_hosts_file_async(self.hostsfile)
-                # Clean up the session
-                await self.cleanup_old_sessions()
-                if len(self.sessions)==0:
-                    self._sweeper_task = None
-                    return
-                await asyncio.sleep(2.0)
-        except:
-            logger.exception("error in sweeper")
-        finally:
-            logger.info("end sweeper")
-            self._sweeper_task = None
+    def _session_deadline(self, session_id:str) -> float|None:
+        session = self.sessions.get(session_id)
+        if session is None:
+            return None
+        return session.last_access + self.session_timeout.total_seconds()
 
-    async def cleanup_old_sessions(self):
-        """Clean up old sessions"""
-        now = datetime.now()
-        if now - self._last_cleanup < self.cleanup_interval:
+    async def _expire_session(self, session_id:str) -> None:
+        session = self.sessions.get(session_id)
+        if session is None:
             return
-        
-        expired_sessions = [
-            sid for sid, session in self.sessions.items()
-            if now - session.last_access > self.session_timeout
-        ]
-        
-        for sid in expired_sessions:
-            session = self.sessions[sid]
-            await session.cleanup()
-            del self.sessions[sid]
-        
-        self._last_cleanup = now
+        logger.info(f"[{session_id}] session expired")
+        await self.remove(session_id)
+
+    async def _hosts_loop(self):
+        """Keep the hosts file for ad blocking fresh"""
+        while True:
+            try:
+                last_mod_sec:float = os.path.getmtime(self.hostsfile) if os.path.exists(self.hostsfile) else 0.0
+                age = time.time()-last_mod_sec
+                if age<HOSTS_MAX_AGE:
+                    await asyncio.sleep(HOSTS_MAX_AGE-age)
+                    continue
+                await download_hosts_file_async(self.hostsfile)
+                if os.path.exists(self.hostsfile) and time.time()-os.path.getmtime(self.hostsfile)<HOSTS_MAX_AGE:
+                    await self.blocklist.reload()
+                    continue
+            except asyncio.CancelledError:
+                raise
+            except:
+                logger.exception("error while updating the hosts file")
+            # the download failed
+            await asyncio.sleep(HOSTS_RETRY)
 
     def setup_session( self, session:BwSession ):
         session._operator_llm = self._operator_llm
         session._planner_llm = self._planner_llm
+        session.task_backend = self.task_backend
+        session._llm_cache_path = self._llm_cache_path
+        session.upload_max = self.upload_max
+        session.upload_quota = self.upload_quota
 
     def setup_sessions( self ):
         for session_id,session in self.sessions.items():
@@ -478,6 +802,54 @@ class SessionStore:
         self._planner_llm = planner_llm
         self._max_sessions = max_sessions
         self.setup_sessions()
+        self._admission.wake()
+        self._warm_pool.kick()
+
+    def configure_warm_pool(self, low:int, high:int):
+        if high>20:
+            raise ValueError(f"invalid number {high}")
+        self._warm_pool.configure(low,high)
+        self._warm_pool.kick()
+
+    def get_warm_pool_status(self) ->dict:
+        return self._warm_pool.get_metrics()
+
+    async def start(self):
+        """Called once the event loop is running"""
+        self.trash.start()
+        # workdirs of a previous run that ended without cleanup
+        self.trash.reclaim(self.SessionsDir, 'session_')
+        self.profile_template.start()
+        self._expiry.start()
+        self.blocklist.start()
+        if self._hosts_task is None and self.hostsfile in self.blocklist.paths:
+            self._hosts_task = asyncio.create_task(self._hosts_loop())
+        self._warm_pool.kick()
+        if self._resource_task is None and self.resource_interval>0:
+            self._resource_task = asyncio.create_task(self._resource_loop())
+
+    async def _resource_loop(self):
+        while True:
+            try:
+                roots = { sid:session.root_pids() for sid,session in self.sessions.items() }
+                # /proc reads block, keep them off the loop
+                usage = await asyncio.to_thread(self.resources.sample, roots)
+                for sid,u in usage.items():
+                    session = self.sessions.get(sid)
+                    if session is not None:
+                        session.usage = u
+            except asyncio.CancelledError:
+                raise
+            except:
+                logger.exception("error in resource sampler")
+            await asyncio.sleep(self.resource_interval)
+
+    def get_resource_status(self) ->dict:
+        res = self.resources.get_status()
+        res['trash'] = self.trash.get_status()
+        res['expiry'] = self._expiry.get_status()
+        res['playwright'] = self.playwright.get_status()
+        return res
 
     async def incr(self):
         async with self._lock:
@@ -486,9 +858,42 @@ class SessionStore:
         async with self._lock:
             self._connect-=1
 
-    async def get_status(self) ->tuple[int,int,int]:
+    async def get_status(self) ->tuple[int,int,int,int]:
         async with self._lock:
-            return self._connect, len(self.sessions), self._max_sessions
+            return self._connect, len(self.sessions), self._max_sessions, self._admission.depth
+
+    async def get_capacity(self) ->dict:
+        """Slots and sessions of this node, as reported to a cluster coordinator"""
+        async with self._lock:
+            return {
+                'max_sessions': self._max_sessions,
+                'sessions': len(self.sessions),
+                'queue': self._admission.depth,
+                'session_ids': list(self.sessions.keys()),
+            }
+
+    def session_rows(self) -> list[dict]:
+        """Ports, state and message cursor of every session, for the shared session directory"""
+        return [ {
+            'session_id': sid,
+            'display': s.display_num,
+            'ws_port': s.ws_port,
+            'cdp_port': s.cdp_port,
+            'status': { 'vnc': s.is_vnc_running(), 'ws': s.is_websockify_running(), 'br': s.is_chrome_running(), 'hl': 1 if s.headless else 0, 'task': s.is_task() },
+            'msg_seq': s.replay.seq,
+        } for sid,s in self.sessions.items() ]
+
+    def admit(self, priority:int=PRIORITY_NORMAL) -> Ticket:
+        """Take a place in the admission queue"""
+        return self._admission.enter(priority)
+
+    def leave(self, ticket:Ticket) -> None:
+        self._admission.cancel(ticket)
+
+    def queue_position(self, ticket:Ticket) -> tuple[int,float|None]:
+        """Position in the queue and estimated seconds to wait"""
+        pos = self._admission.position(ticket)
+        return pos, self._admission.eta(pos, self._max_sessions)
 
     async def get(self, session_id: str|None) -> BwSession | None:
         """Get the session and update the timestamp"""
@@ -498,35 +903,182 @@ class SessionStore:
             return session
         return None
 
-    async def create(self, server_addr:str, client_addr:str|None ) -> BwSession|None:
-        "Create a new session"
-        if len(self.sessions)>=self._max_sessions:
-            return None
+    def _new_session(self, server_addr:str, client_addr:str|None ) -> BwSession:
         while True:
-            session_id = session_id = ''.join(random.choices(string.ascii_lowercase + string.digits, k=8))
+            session_id = ''.join(random.choices(string.ascii_lowercase + string.digits, k=8))
             if session_id not in self.sessions:
                 break
         workdir = os.path.join( self.SessionsDir, f"session_{session_id}")
-        logger.info(f"[{session_id}] create session")
         os.makedirs(workdir,exist_ok=False)
-        session = BwSession(session_id, server_addr=server_addr, client_addr=client_addr, dir=workdir, hostsfile=self.hostsfile, Pool=self.Pool, lock=self._lock2)
-        self.setup_session(session)
-        self.sessions[session_id] = session
-        await self._start_sweeper()
+        session = BwSession(session_id, server_addr=server_addr, client_addr=client_addr, dir=workdir, Pool=self.Pool, ports=self.ports, blocklist=self.blocklist, playwright=self.playwright.assign(session_id))
+        session.profile_template = self.profile_template
+        session.trash = self.trash
+        session.vnc_profile = self.vnc_profile
+        return session
+
+    def _warm_capacity(self) -> int:
+        return self._max_sessions - len(self.sessions) - len(self._warm_pool) - self._warm_pool._filling
+
+    async def _create_warm_session(self) -> BwSession:
+        session = self._new_session("", None)
+        logger.info(f"[{session.session_id}] create warm session")
+        try:
+            await session.start_browser()
+        except:
+            await self._discard_session(session)
+            raise
+        if not session.is_ready():
+            await self._discard_session(session)
+            raise CanNotStartException(f"[{session.session_id}] warm session could not be started")
+        return session
+
+    async def _discard_session(self, session:BwSession) -> None:
+        try:
+            await session.cleanup()
+        except:
+            logger.exception(f"[{session.session_id}] error while discarding session")
+        finally:
+            self.playwright.release(session.session_id)
+
+    async def create(self, server_addr:str, client_addr:str|None, ticket:Ticket|None=None, *, headless:bool=False, vnc_profile:str|None=None ) -> BwSession|None:
+        "Create a new session"
+        if vnc_profile is not None and vnc_profile not in VNC_PROFILES:
+            raise ValueError(f"invalid vnc profile {vnc_profile}")
+        if ticket is not None:
+            if not ticket.granted:
+                return None
+            self._admission.use(ticket)
+        elif self._admission.available()<=0 or self._admission.depth>0:
+            return None
+        session:BwSession|None = None
+        try:
+            # the warm pool holds VNC sessions of the default profile
+            warm = not headless and vnc_profile in (None, self.vnc_profile)
+            session = self._warm_pool.take() if warm else None
+            if session is not None:
+                logger.info(f"[{session.session_id}] create session from warm pool")
+                session.server_addr = server_addr
+                session.client_addr = client_addr
+                # the session's lifetime starts now, not when the pool started it
+                session.created_at = time.monotonic()
+                session.touch()
+            else:
+                session = self._new_session(server_addr, client_addr)
+                session.headless = headless
+                if vnc_profile is not None:
+                    session.vnc_profile = vnc_profile
+                logger.info(f"[{session.session_id}] create {'headless ' if headless else ''}session")
+            self.setup_session(session)
+            self.sessions[session.session_id] = session
+            self._expiry.add(session.session_id, session.last_access + self.session_timeout.total_seconds())
+        except:
+            # the ticket's slot was taken; give it to the next client
+            if session is not None:
+                self.sessions.pop(session.session_id, None)
+                self._expiry.discard(session.session_id)
+                await self._discard_session(session)
+            self._admission.wake()
+            self._warm_pool.kick()
+            raise
+        return session
+
+    def attach(self, session_id:str) -> BwSession|None:
+        """Reattach a reconnecting client to its session"""
+        task = self._detached.pop(session_id, None)
+        if task is not None:
+            task.cancel()
+        session = self.sessions.get(session_id)
+        if session is not None:
+            logger.info(f"[{session_id}] reattach session")
+            session.touch()
+            # a stream that still holds the session stops at its next frame
+            session.stream_gen += 1
         return session
 
+    async def detach(self, session_id:str, stream_gen:int) -> None:
+        """The client's stream ended: remove the session unless it reconnects within the grace period"""
+        session = self.sessions.get(session_id)
+        if session is None or session.stream_gen!=stream_gen:
+            return
+        if self.stream_grace<=0:
+            await self.remove(session_id)
+            return
+        logger.info(f"[{session_id}] detach session")
+        self._detached[session_id] = asyncio.create_task(self._remove_later(session_id))
+
+    async def _remove_later(self, session_id:str) -> None:
+        try:
+            await asyncio.sleep(self.stream_grace)
+        except asyncio.CancelledError:
+            return
+        self._detached.pop(session_id, None)
+        await self.remove(session_id)
+
     async def remove(self, session_id: str) -> None:
         """Delete session"""
+        task = self._detached.pop(session_id, None)
+        if task is not None and task is not asyncio.current_task():
+            task.cancel()
         if session_id in self.sessions:
             logger.info(f"[{session_id}] remove session")
             session = self.sessions[session_id]
             await session.cleanup()
             del self.sessions[session_id]
+            self.playwright.release(session_id)
+            if self.on_removed is not None:
+                self.on_removed(session_id)
+            self._expiry.discard(session_id)
+            self._admission.record_duration(time.monotonic()-session.created_at)
+            self._admission.wake()
+            self._warm_pool.kick()
 
-    async def cleanup_all(self):
+    async def cleanup_all(self, deadline:float=SHUTDOWN_DEADLINE) -> dict:
+        """Tear down every session at once; whatever is still up at the deadline is killed"""
+        t_start = time.monotonic()
+        end = t_start + deadline
+        report:dict = { 'sessions': len(self.sessions), 'warm': len(self._warm_pool) }
+
+        # tasks: nothing new starts, and the running ones are all cancelled together
+        t0 = time.monotonic()
         try:
-            self.Pool.shutdown(wait=True,cancel_futures=True)
+            self.Pool.shutdown(wait=False,cancel_futures=True)
         except:
             pass
-        for session_id in list(self.sessions.keys()):
-            await self.remove(session_id)
+        report['cancelled'] = self.playwright.cancel_all()
+        for task in (self._hosts_task, self._resource_task):
+            if task is not None:
+                task.cancel()
+        self._hosts_task = self._resource_task = None
+        await asyncio.gather( self._expiry.close(), self.blocklist.close() )
+        report['tasks'] = time.monotonic()-t0
+
+        # sessions: every teardown runs in parallel
+        t0 = time.monotonic()
+        warm = self._warm_pool.idle()
+        jobs = [ asyncio.create_task(self.remove(session_id)) for session_id in list(self.sessions.keys()) ]
+        jobs.append( asyncio.create_task(self._warm_pool.close()) )
+        _, pending = await asyncio.wait(jobs, timeout=max(0.0, end-time.monotonic()))
+        report['teardown'] = time.monotonic()-t0
+
+        # kill: process groups of the sessions that did not make it
+        t0 = time.monotonic()
+        stragglers = list(self.sessions.values()) + [ session for session in warm if session.WorkDir and os.path.exists(session.WorkDir) ]
+        for session in stragglers:
+            logger.warning(f"[{session.session_id}] not stopped by the deadline, killing")
+            session.kill()
+        for job in pending:
+            job.cancel()
+        if pending:
+            await asyncio.wait(pending, timeout=1.0)
+        for session in stragglers:
+            try:
+                self.trash.discard(session.WorkDir)
+            except Exception:
+                pass
+        self.sessions.clear()
+        report['killed'] = len(stragglers)
+        report['kill'] = time.monotonic()-t0
+
+        report['total'] = time.monotonic()-t_start
+        logger.info( "shutdown: " + " ".join( f"{k}:{v:.3f}s" if isinstance(v,float) else f"{k}:{v}" for k,v in report.items() ) )
+        return report
@@ -0,0 +1,96 @@
+import json
+import zlib
+from collections import deque
+from typing import Any
+
+# messages produced within this window are sent in one frame
+SSE_BATCH_WINDOW:float = 0.05
+# how often the session status is checked for changes
+SSE_STATUS_INTERVAL:float = 1.0
+# a comment is sent when nothing else was sent for this long
+SSE_HEARTBEAT:float = 15.0
+# reconnection delay requested from the EventSource
+SSE_RETRY_MS:int = 1000
+
+class SseEncoder:
+    """Encodes one client's event stream
+
+    Every frame carries only the status fields that changed since the previous frame,
+    plus the messages collected since then as rows in 'msgs'. The client merges the
+    fields into the status it already has.
+    """
+
+    def __init__(self, *, gzip:bool=False):
+        self._last_status:dict[str,Any] = {}
+        self._compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if gzip else None
+
+    @property
+    def gzip(self) -> bool:
+        return self._compressor is not None
+
+    def frame(self, status:dict[str,Any], msgs:list|None=None) -> str|None:
+        """Return the next frame, or None when there is nothing new to send"""
+        delta = { k:v for k,v in status.items() if k not in self._last_status or self._last_status[k]!=v }
+        for k in self._last_status:
+            if k not in status:
+                delta[k] = None
+        if not delta and not msgs:
+            return None
+        self._last_status = dict(status)
+        if msgs:
+            delta['msgs'] = msgs
+        return f"data: {json.dumps(delta, ensure_ascii=False)}\n\n"
+
+    def heartbeat(self) -> str:
+        return ": hb\n\n"
+
+    def retry(self, msec:int) -> str:
+        return f"retry: {msec}\n\n"
+
+    def reset(self) -> None:
+        """Send the full status with the next frame"""
+        self._last_status = {}
+
+    def encode(self, text:str) -> bytes:
+        data = text.encode('utf-8')
+        if self._compressor is not None:
+            # sync flush, so that the client can decode the frame right away
+            data = self._compressor.compress(data) + self._compressor.flush(zlib.Z_SYNC_FLUSH)
+        return data
+
+class ReplayBuffer:
+    """Numbered ring buffer of the frames sent for one session, replayed after a reconnect"""
+
+    def __init__(self, prefix:str, maxlen:int=256):
+        self._prefix:str = prefix
+        self._frames:deque[tuple[int,str]] = deque(maxlen=maxlen)
+        self._seq:int = 0
+
+    def add(self, frame:str) -> str:
+        """Number the frame, keep it, and return it with its id line"""
+        self._seq += 1
+        text = f"id: {self._prefix}.{self._seq}\n{frame}"
+        self._frames.append( (self._seq,text) )
+        return text
+
+    @property
+    def seq(self) -> int:
+        return self._seq
+
+    def since(self, seq:int) -> list[str]|None:
+        """Frames sent after seq, or None if some of them are no longer kept"""
+        if seq>self._seq:
+            return None
+        oldest = self._frames[0][0] if self._frames else self._seq+1
+        if oldest>seq+1:
+            return None
+        return [ text for n,text in self._frames if n>seq ]
+
+def parse_event_id(event_id:str|None) -> tuple[str,int]|None:
+    """Split a Last-Event-ID of the form '<session_id>.<seq>'"""
+    if not event_id:
+        return None
+    sid, _, seq = event_id.strip().rpartition('.')
+    if not sid or not seq.isdigit():
+        return None
+    return sid, int(seq)
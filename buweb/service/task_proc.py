@@ -0,0 +1,194 @@
+import os
+import asyncio
+import multiprocessing
+from multiprocessing.connection import Connection
+from typing import Any, Awaitable, Callable, NamedTuple
+from logging import Logger,getLogger
+
+from buweb.utils.metrics import REGISTRY
+
+logger:Logger = getLogger(__name__)
+
+# after a cancel request the task gets this long to stop by itself before it is cancelled
+CANCEL_GRACE:float = 3.0
+
+# spawn, not fork: the parent has an event loop and many threads
+_mp = multiprocessing.get_context('spawn')
+
+Writer = Callable[...,None]
+
+class TaskSpec(NamedTuple):
+    """Everything a task process needs, as plain values: objects stay in the parent, paths are passed"""
+    mode:int
+    prompt:str
+    llm:str
+    planner_llm:str|None
+    workdir:str
+    cdp_port:int
+    n_task:int
+    llm_cache_path:str|None
+    trans_lang:str|None
+    trans_cachefile:str|None
+    sensitive_data:dict[str,str]|None
+
+async def run_task(writer:Writer, cancel:asyncio.Event, spec:TaskSpec) -> None:
+    """Child side: run a browser task, reporting through the writer"""
+    # imported here, so that spawning a process for another target stays light
+    from langchain_community.cache import SQLiteCache
+    from buweb.agent.buw_agent import BuwWriter
+    from buweb.model.model import LLM
+    from buweb.model.translate import Translate
+    from buweb.task.operator import BwTask
+    from buweb.task.research import BwResearchTask
+
+    trans = Translate(spec.trans_lang, spec.trans_cachefile) if spec.trans_lang else None
+    buw = BuwWriter( n_task=spec.n_task, writer=writer, trans=trans )
+    llm_cache = SQLiteCache(spec.llm_cache_path) if spec.llm_cache_path else None
+    llm = LLM[spec.llm]
+    planner_llm = LLM[spec.planner_llm] if spec.planner_llm else None
+    if spec.mode==1:
+        task = BwResearchTask( dir=spec.workdir,
+                        llm_cache=llm_cache, llm=llm, plan_llm=planner_llm,
+                        cdp_port=spec.cdp_port,
+                        sensitive_data=spec.sensitive_data,
+                        writer=buw)
+    else:
+        task = BwTask( dir=spec.workdir,
+                        llm_cache=llm_cache, llm=llm, plan_llm=planner_llm,
+                        cdp_port=spec.cdp_port,
+                        sensitive_data=spec.sensitive_data,
+                        writer=buw)
+    async def stop_on_cancel():
+        await cancel.wait()
+        await task.stop()
+    watcher = asyncio.create_task(stop_on_cancel())
+    try:
+        await task.start(spec.prompt)
+    finally:
+        watcher.cancel()
+        await task.stop()
+
+def _process_main(target:Callable[...,Awaitable[None]], args:tuple, conn:Connection) -> None:
+    asyncio.run(_process_run(target, args, conn))
+
+async def _process_run(target:Callable[...,Awaitable[None]], args:tuple, conn:Connection) -> None:
+    loop = asyncio.get_running_loop()
+    main = asyncio.current_task()
+    cancel = asyncio.Event()
+
+    def force_cancel() -> None:
+        if main is not None:
+            main.cancel()
+
+    def on_command() -> None:
+        try:
+            cmd = conn.recv()
+        except (EOFError, OSError):
+            # the parent is gone
+            cmd = 'cancel'
+        if cmd=='cancel' and not cancel.is_set():
+            loop.remove_reader(conn.fileno())
+            cancel.set()
+            loop.call_later(CANCEL_GRACE, force_cancel)
+
+    def send(*row:Any) -> None:
+        try:
+            conn.send(('msg',row))
+        except (BrokenPipeError, OSError):
+            pass
+
+    def send_obs(name:str, labels:tuple[str,...], value:float) -> None:
+        try:
+            conn.send(('obs',(name,labels,value)))
+        except (BrokenPipeError, OSError):
+            pass
+
+    # metrics are kept by the parent, which serves /metrics
+    REGISTRY.forward = send_obs
+    loop.add_reader(conn.fileno(), on_command)
+    try:
+        await target(send, cancel, *args)
+    except asyncio.CancelledError:
+        pass
+    except Exception as ex:
+        logger.exception(f"task process {os.getpid()}: {ex}")
+        send(0,0,0,0,'',f"error: {ex}",None)
+    finally:
+        conn.close()
+
+class TaskProcess:
+    """A task running in a child process
+
+    Progress rows come back over a pipe and are handed to on_msg on the event loop,
+    with no thread in between. The child shares nothing with the parent but the
+    pipe, so it has its own GIL.
+    """
+
+    def __init__(self, target:Callable[...,Awaitable[None]], args:tuple, *, on_msg:Writer, name:str='task'):
+        self._loop:asyncio.AbstractEventLoop = asyncio.get_running_loop()
+        self._on_msg:Writer = on_msg
+        self._conn, child_conn = _mp.Pipe()
+        self._proc = _mp.Process(target=_process_main, args=(target, args, child_conn), name=name, daemon=True)
+        self._proc.start()
+        # keep only our end, so that the child's exit closes the pipe
+        child_conn.close()
+        self.pid:int|None = self._proc.pid
+        self._done:asyncio.Event = asyncio.Event()
+        self._loop.add_reader(self._conn.fileno(), self._on_readable)
+
+    def _on_readable(self) -> None:
+        try:
+            while self._conn.poll():
+                kind, payload = self._conn.recv()
+                if kind=='msg':
+                    self._on_msg(*payload)
+                elif kind=='obs':
+                    REGISTRY.observe(*payload)
+        except (EOFError, OSError):
+            self._finish()
+        except Exception:
+            logger.exception(f"task process {self.pid}: bad message")
+
+    def _finish(self) -> None:
+        if not self._done.is_set():
+            self._loop.remove_reader(self._conn.fileno())
+            self._conn.close()
+            self._done.set()
+
+    @property
+    def running(self) -> bool:
+        return not self._done.is_set()
+
+    async def wait(self, timeout:float|None=None) -> bool:
+        """Wait until the child has finished, and return True if it has"""
+        try:
+            await asyncio.wait_for(self._done.wait(), timeout)
+        except asyncio.TimeoutError:
+            return False
+        # the pipe is closed, the process is exiting
+        await asyncio.to_thread(self._proc.join, 5.0)
+        return True
+
+    def cancel(self) -> None:
+        """Ask the task to stop"""
+        if self.running:
+            try:
+                self._conn.send('cancel')
+            except (BrokenPipeError, OSError):
+                pass
+
+    def kill(self) -> None:
+        """SIGKILL the child without waiting"""
+        if self._proc.is_alive():
+            self._proc.kill()
+
+    async def stop(self, deadline:float=CANCEL_GRACE+5.0) -> None:
+        """Cancel the task, and terminate the process if it does not finish in time"""
+        self.cancel()
+        if await self.wait(deadline):
+            return
+        logger.warning(f"task process {self.pid} did not stop in {deadline}s, terminating")
+        self._proc.terminate()
+        if not await self.wait(2.0):
+            self._proc.kill()
+            await self.wait()
@@ -0,0 +1,166 @@
+import os
+import time
+import fcntl
+import threading
+from logging import Logger,getLogger
+
+from buweb.utils.metrics import TEARDOWN_BLOCK_SECONDS, TRASH_PENDING
+
+logger:Logger = getLogger(__name__)
+
+class TrashReaper:
+    """Deletes session directories in the background
+
+    discard() only renames the directory into the trash, which is one metadata
+    operation on the same filesystem. A low-priority thread then deletes the trash,
+    sleeping between batches so that it does not saturate the disk. Whatever is left
+    in the trash when the server stops is deleted after the next start.
+    """
+
+    def __init__(self, trash_dir:str, *, bytes_per_sec:int=64*1024*1024, batch_files:int=256):
+        self.trash_dir:str = trash_dir
+        self.bytes_per_sec:int = bytes_per_sec
+        self.batch_files:int = batch_files
+        self._cond:threading.Condition = threading.Condition()
+        self._thread:threading.Thread|None = None
+        self._pending:int = 0
+        # entries that could not be deleted, not retried until restart
+        self._failed:set[str] = set()
+        self._lockfile = None
+        self.reaped:int = 0
+        self.bytes_freed:int = 0
+        # time the caller was blocked in discard()
+        self.block_last:float = 0.0
+        self.block_max:float = 0.0
+
+    def start(self) -> None:
+        os.makedirs(self.trash_dir, exist_ok=True)
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='trash-reaper', daemon=True)
+            self._thread.start()
+        self._wake()
+
+    def reclaim(self, parent:str, prefix:str) -> int:
+        """Move leftover directories from a previous run into the trash
+
+        Only done when no other server uses the parent directory, which is checked
+        with a lock that is held until this process exits.
+        """
+        self._lockfile = open(os.path.join(parent,'.lock'),'w')
+        try:
+            fcntl.flock(self._lockfile, fcntl.LOCK_EX|fcntl.LOCK_NB)
+        except OSError:
+            logger.info(f"{parent} is shared with another server, leftovers are not reclaimed")
+            return 0
+        n = 0
+        for name in os.listdir(parent):
+            path = os.path.join(parent,name)
+            if name.startswith(prefix) and os.path.isdir(path) and not os.path.islink(path):
+                self.discard(path)
+                n += 1
+        if n:
+            logger.info(f"reclaimed {n} leftover directories")
+        return n
+
+    def discard(self, path:str) -> float:
+        """Move the directory into the trash and return how long that took"""
+        t0 = time.monotonic()
+        dest = os.path.join(self.trash_dir, f"{os.path.basename(path)}.{time.time_ns()}")
+        try:
+            os.rename(path, dest)
+        except FileNotFoundError:
+            pass
+        except OSError as ex:
+            # not on the same filesystem: leave it in place, it is not worth a blocking copy
+            logger.warning(f"can not move {path} to the trash: {ex}")
+        elapsed = time.monotonic()-t0
+        self.block_last = elapsed
+        self.block_max = max(self.block_max, elapsed)
+        TEARDOWN_BLOCK_SECONDS.observe(elapsed)
+        self._wake()
+        return elapsed
+
+    def _wake(self) -> None:
+        with self._cond:
+            self._cond.notify()
+
+    def _run(self) -> None:
+        try:
+            # lowest CPU priority for this thread only (Linux schedules threads separately)
+            os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), 19)
+        except (OSError, AttributeError):
+            pass
+        while True:
+            try:
+                entries = [ name for name in os.listdir(self.trash_dir) if name not in self._failed ]
+            except OSError:
+                entries = []
+            self._pending = len(entries)
+            TRASH_PENDING.set(self._pending)
+            if not entries:
+                with self._cond:
+                    self._cond.wait(60.0)
+                continue
+            for name in entries:
+                path = os.path.join(self.trash_dir,name)
+                self._delete(path)
+                if os.path.lexists(path):
+                    self._failed.add(name)
+                else:
+                    self.reaped += 1
+                self._pending -= 1
+                TRASH_PENDING.set(self._pending)
+
+    def _delete(self, top:str) -> None:
+        """rmtree, paced to bytes_per_sec"""
+        t0 = time.monotonic()
+        freed = 0
+        files = 0
+        for root, dirs, names in os.walk(top, topdown=False):
+            for name in names:
+                path = os.path.join(root,name)
+                try:
+                    st = os.lstat(path)
+                    os.unlink(path)
+                    freed += st.st_blocks*512
+                except FileNotFoundError:
+                    pass
+                except OSError as ex:
+                    logger.debug(f"can not delete {path}: {ex}")
+                files += 1
+                if files % self.batch_files == 0:
+                    # sleep until the deletion rate is back under the limit
+                    ahead = freed/self.bytes_per_sec - (time.monotonic()-t0)
+                    if ahead>0:
+                        time.sleep(ahead)
+            for name in dirs:
+                path = os.path.join(root,name)
+                try:
+                    if os.path.islink(path):
+                        os.unlink(path)
+                    else:
+                        os.rmdir(path)
+                except FileNotFoundError:
+                    pass
+                except OSError as ex:
+                    logger.debug(f"can not delete {path}: {ex}")
+        try:
+            os.rmdir(top)
+        except FileNotFoundError:
+            pass
+        except OSError:
+            # a file, or something that could not be emptied
+            try:
+                os.unlink(top)
+            except OSError as ex:
+                logger.warning(f"can not delete {top}: {ex}")
+        self.bytes_freed += freed
+
+    def get_status(self) -> dict:
+        return {
+            'pending': self._pending,
+            'reaped': self.reaped,
+            'bytes_freed': self.bytes_freed,
+            'block_last_ms': round(self.block_last*1000,3),
+            'block_max_ms': round(self.block_max*1000,3),
+        }
@@ -0,0 +1,133 @@
+import os
+import asyncio
+from typing import AsyncIterable, AsyncIterator
+from logging import Logger,getLogger
+
+from werkzeug.http import parse_options_header
+from werkzeug.sansio.multipart import MultipartDecoder, NeedData, File, Field, Data, Epilogue
+
+logger:Logger = getLogger(__name__)
+
+# largest single upload and total uploaded bytes per session
+UPLOAD_MAX:int = 100*1024*1024
+UPLOAD_QUOTA:int = 512*1024*1024
+# bytes collected before each write in the thread pool
+WRITE_CHUNK:int = 1024*1024
+# seconds between progress messages on the session stream
+PROGRESS_INTERVAL:float = 0.5
+
+class UploadError(Exception):
+    def __init__(self, msg:str, status:int=400):
+        super().__init__(msg)
+        self.status:int = status
+
+def safe_filename(filename:str|None) -> str:
+    """The last path component of a client supplied name, so that it stays in the workdir"""
+    name = os.path.basename((filename or '').replace('\\','/')).strip()
+    if name in ('','.','..') or '\0' in name:
+        raise UploadError('No selected file')
+    return name
+
+class FileWriter:
+    """Writes one upload to a part file in the thread pool and renames it into place when complete"""
+
+    def __init__(self, dir:str, filename:str, *, limit:int):
+        self.path:str = os.path.join(dir, filename)
+        self.part_path:str = os.path.join(dir, f".upload-{filename}.part")
+        self.limit:int = limit
+        self.size:int = 0
+        self._buf:bytearray = bytearray()
+        self._file = None
+
+    async def open(self) -> None:
+        self._file = await asyncio.to_thread(open, self.part_path, 'wb')
+
+    async def write(self, data:bytes) -> None:
+        self.size += len(data)
+        if self.size>self.limit:
+            raise UploadError(f"file too large, limit {self.limit:,} bytes", 413)
+        self._buf += data
+        if len(self._buf)>=WRITE_CHUNK:
+            await self._flush()
+
+    async def _flush(self) -> None:
+        if self._buf and self._file is not None:
+            buf, self._buf = bytes(self._buf), bytearray()
+            await asyncio.to_thread(self._file.write, buf)
+
+    async def commit(self) -> None:
+        await self._flush()
+        f, self._file = self._file, None
+        if f is not None:
+            await asyncio.to_thread(f.close)
+        await asyncio.to_thread(os.replace, self.part_path, self.path)
+
+    async def abort(self) -> None:
+        f, self._file = self._file, None
+        self._buf = bytearray()
+        def remove():
+            if f is not None:
+                f.close()
+            try:
+                os.remove(self.part_path)
+            except FileNotFoundError:
+                pass
+        await asyncio.to_thread(remove)
+
+def _next_event(decoder:MultipartDecoder):
+    try:
+        return decoder.next_event()
+    except ValueError as ex:
+        raise UploadError(f"invalid upload: {ex}")
+
+async def upload_events(body:AsyncIterable[bytes], content_type:str|None, name:str|None) -> AsyncIterator[tuple[str,bytes|str|None]]:
+    """('file', filename), then ('data', chunk)..., then ('end', None) for the 'file' part of a
+    multipart/form-data body, or for a raw body with the name given in the query"""
+    mimetype, options = parse_options_header(content_type or '')
+    if mimetype!='multipart/form-data':
+        if not name:
+            raise UploadError('No file part')
+        yield 'file', name
+        async for chunk in body:
+            if chunk:
+                yield 'data', chunk
+        yield 'end', None
+        return
+    boundary = options.get('boundary')
+    if not boundary:
+        raise UploadError('missing multipart boundary')
+    decoder = MultipartDecoder(boundary.encode('latin-1'))
+    in_file = found = done = False
+    async def chunks() -> AsyncIterator[bytes|None]:
+        async for chunk in body:
+            yield chunk
+        # end of the body
+        yield None
+    async for chunk in chunks():
+        if done:
+            continue
+        decoder.receive_data(chunk)
+        event = _next_event(decoder)
+        while not isinstance(event, NeedData):
+            if isinstance(event, File):
+                in_file = event.name=='file' and not found
+                if in_file:
+                    found = True
+                    yield 'file', event.filename
+            elif isinstance(event, Field):
+                in_file = False
+            elif isinstance(event, Data):
+                if in_file:
+                    if event.data:
+                        yield 'data', event.data
+                    if not event.more_data:
+                        in_file = False
+                        yield 'end', None
+            elif isinstance(event, Epilogue):
+                done = True
+                break
+            event = _next_event(decoder)
+    if not found:
+        raise UploadError('No file part')
+    if in_file:
+        raise UploadError('incomplete upload')
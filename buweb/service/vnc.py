@@ -0,0 +1,18 @@
+from typing import NamedTuple
+
+class VncProfile(NamedTuple):
+    """How a session's Xvnc framebuffer is exported"""
+    depth:int
+    geometry:str
+    # cap on the framebuffer updates Xvnc sends per second
+    frame_rate:int
+
+VNC_PROFILES:dict[str,VncProfile] = {
+    'high': VncProfile(24, "1024x900", 60),
+    'standard': VncProfile(24, "1024x900", 30),
+    'low': VncProfile(16, "1024x768", 10),
+}
+DEFAULT_VNC_PROFILE:str = 'high'
+
+# websockify exits once it has had no viewer for this long
+VIEWER_IDLE_TIMEOUT:int = 30
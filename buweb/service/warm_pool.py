@@ -0,0 +1,129 @@
+import time
+import asyncio
+from asyncio import Task
+from collections import deque
+from typing import TYPE_CHECKING, Awaitable, Callable
+from logging import Logger,getLogger
+if TYPE_CHECKING:
+    from buweb.service.session import BwSession
+
+logger:Logger = getLogger(__name__)
+
+class WarmPool:
+    """Keeps pre-started display+Chrome sandboxes ready to be handed out to new sessions"""
+
+    def __init__(self, factory:"Callable[[],Awaitable[BwSession]]", discard:"Callable[[BwSession],Awaitable[None]]", capacity:Callable[[],int], *, low:int=0, high:int=0):
+        self._factory = factory
+        self._discard = discard
+        # number of additional sandboxes that may be started right now
+        self._capacity:Callable[[],int] = capacity
+        self.low:int = 0
+        self.high:int = 0
+        self._ready:"deque[BwSession]" = deque()
+        self._filling:int = 0
+        self._refill_task:Task|None = None
+        self._closed:bool = False
+        # metrics
+        self.hits:int = 0
+        self.misses:int = 0
+        self.refills:int = 0
+        self.refill_failures:int = 0
+        self.refill_time_total:float = 0.0
+        self.refill_time_last:float = 0.0
+        self.configure(low,high)
+
+    def configure(self, low:int, high:int) -> None:
+        if low<0 or high<0 or low>high:
+            raise ValueError(f"invalid watermarks low:{low} high:{high}")
+        self.low = low
+        self.high = high
+
+    def __len__(self) -> int:
+        return len(self._ready)
+
+    def take(self) -> "BwSession|None":
+        """Hand out a ready sandbox, or None if the pool is empty"""
+        session:BwSession|None = None
+        while self._ready:
+            candidate = self._ready.popleft()
+            if candidate.is_ready():
+                session = candidate
+                break
+            # the browser died while waiting in the pool
+            logger.info(f"[{candidate.session_id}] discard dead warm session")
+            asyncio.create_task(self._discard(candidate))
+        if session is not None:
+            self.hits += 1
+        else:
+            self.misses += 1
+        self.kick()
+        return session
+
+    def kick(self) -> None:
+        """Start refilling in the background when the pool is below the low watermark"""
+        if self._closed or self._refill_task is not None:
+            return
+        if len(self._ready) >= max(self.low,1):
+            return
+        if self.high<=0 or self._capacity()<=0:
+            return
+        self._refill_task = asyncio.create_task(self._refill_loop())
+
+    async def _refill_loop(self) -> None:
+        try:
+            while not self._closed and len(self._ready)+self._filling < self.high and self._capacity()>0:
+                self._filling += 1
+                t0 = time.monotonic()
+                try:
+                    session = await self._factory()
+                except Exception as ex:
+                    self.refill_failures += 1
+                    logger.warning(f"failed to start warm session: {ex}")
+                    return
+                finally:
+                    self._filling -= 1
+                self.refill_time_last = time.monotonic()-t0
+                self.refill_time_total += self.refill_time_last
+                self.refills += 1
+                if self._closed:
+                    await self._discard(session)
+                    return
+                self._ready.append(session)
+                logger.info(f"[{session.session_id}] warm session ready in {self.refill_time_last:.3f}s ({len(self._ready)}/{self.high})")
+        except:
+            logger.exception("error in warm pool refill")
+        finally:
+            self._refill_task = None
+
+    def get_metrics(self) -> dict:
+        total = self.hits+self.misses
+        return {
+            'ready': len(self._ready),
+            'filling': self._filling,
+            'low': self.low,
+            'high': self.high,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits/total if total>0 else 0.0,
+            'refills': self.refills,
+            'refill_failures': self.refill_failures,
+            'refill_time_last': round(self.refill_time_last,3),
+            'refill_time_avg': round(self.refill_time_total/self.refills,3) if self.refills>0 else 0.0,
+        }
+
+    def idle(self) -> "list[BwSession]":
+        return list(self._ready)
+
+    async def close(self) -> None:
+        """Stop refilling and tear down every idle sandbox"""
+        self._closed = True
+        task = self._refill_task
+        if task is not None:
+            task.cancel()
+            try:
+                await task
+            except BaseException:
+                pass
+        ready = list(self._ready)
+        self._ready.clear()
+        await asyncio.gather( *[ self._discard(session) for session in ready ] )
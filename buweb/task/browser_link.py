@@ -0,0 +1,101 @@
+import time
+import asyncio
+from browser_use import Browser, BrowserConfig
+from browser_use.browser.context import BrowserContext, BrowserContextConfig
+from buweb.task.pw_runtime import PlaywrightRuntime, SharedBrowser
+from logging import Logger,getLogger
+
+logger:Logger = getLogger(__name__)
+
+# a round trip to Chrome that takes longer means the connection is not usable
+HEALTH_TIMEOUT:float = 2.0
+
+def context_config() -> BrowserContextConfig:
+    return BrowserContextConfig(
+        maximum_wait_page_load_time=1.2,
+        viewport_expansion=0,
+        browser_window_size={'width':1366,'height':768},
+    )
+
+class BrowserLink:
+    """A browser_use Browser and BrowserContext attached to a session's Chrome and kept across its tasks
+
+    Connecting over CDP, discovering the targets and injecting the context's scripts is
+    done once. Tasks borrow the objects and must not close them. The objects belong to
+    the event loop that created them, so every task of the session has to run on that loop.
+    """
+
+    def __init__(self, runtime:PlaywrightRuntime|None=None):
+        # connect through the shared Playwright driver, or start one for this link
+        self.runtime:PlaywrightRuntime|None = runtime
+        self.cdp_port:int = 0
+        self.browser:Browser|None = None
+        self.context:BrowserContext|None = None
+        self.connects:int = 0
+        self.reuses:int = 0
+        # time spent in the last acquire()
+        self.last_acquire:float = 0.0
+
+    async def _healthy(self, cdp_port:int) -> bool:
+        if self.browser is None or self.context is None or self.cdp_port!=cdp_port:
+            return False
+        pw_browser = self.browser.playwright_browser
+        if pw_browser is None or not pw_browser.is_connected():
+            return False
+        session = self.context.session
+        if session is None:
+            return False
+        # between tasks nobody reads the connection, so a restarted Chrome is only noticed by asking it
+        try:
+            await asyncio.wait_for(session.context.cookies(), HEALTH_TIMEOUT)
+            return True
+        except Exception:
+            return False
+
+    async def acquire(self, cdp_port:int) -> tuple[Browser,BrowserContext]:
+        """The connected browser and context, reconnecting if Chrome was restarted"""
+        t0 = time.monotonic()
+        if await self._healthy(cdp_port):
+            self.reuses += 1
+        else:
+            if self.browser is not None:
+                logger.info(f"reconnect to chrome on port {cdp_port}")
+            await self.close()
+            config = BrowserConfig( cdp_url=f"http://127.0.0.1:{cdp_port}" )
+            browser = SharedBrowser( config, self.runtime ) if self.runtime is not None else Browser( config )
+            context = BrowserContext( browser, context_config() )
+            try:
+                # connect and set up the context now, not in the agent's first step
+                await context.get_session()
+            except:
+                await _safe_close(context)
+                await _safe_close(browser)
+                raise
+            self.browser, self.context, self.cdp_port = browser, context, cdp_port
+            self.connects += 1
+        self.last_acquire = time.monotonic()-t0
+        assert self.browser is not None and self.context is not None
+        return self.browser, self.context
+
+    async def close(self) -> None:
+        context, browser = self.context, self.browser
+        self.context = self.browser = None
+        self.cdp_port = 0
+        if context is not None:
+            await _safe_close(context)
+        if browser is not None:
+            await _safe_close(browser)
+
+    def get_status(self) -> dict:
+        return {
+            'connected': self.browser is not None,
+            'connects': self.connects,
+            'reuses': self.reuses,
+            'last_acquire_ms': round(self.last_acquire*1000,1),
+        }
+
+async def _safe_close(obj) -> None:
+    try:
+        await obj.close()
+    except:
+        pass
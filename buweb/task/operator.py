@@ -33,6 +33,7 @@ from logging import Logger,getLogger, ERROR as LogError
 from buweb.agent.buw_agent import BuwWriter, BuwAgent
 from buweb.controller.buw_controller import BwController
 from buweb.model.model import LLM, create_model
+from buweb.task.browser_link import context_config
 
 logger:Logger = getLogger(__name__)
 
@@ -44,6 +45,7 @@ class BwTask:
                 llm_cache:BaseCache|None=None, llm:LLM=LLM.Gpt4oMini, plan_llm:LLM|None=None,
                 chrome_instance_path:str|None=None, cdp_port:int|None=None, trace_path:str|None=None,
                 sensitive_data:dict[str,str]|None=None,
+                browser:Browser|None=None, browser_context:BrowserContext|None=None,
                 writer:BuwWriter|None=None):
         self._work_dir:str = dir
         if llm_cache is None:
@@ -53,30 +55,30 @@ class BwTask:
         self._llm_cache:BaseCache = llm_cache
         self._writer:BuwWriter = writer if writer is not None else BuwWriter()
         self.cdp_port:int|None = cdp_port
-        bw_context_config:BrowserContextConfig = BrowserContextConfig(
-            maximum_wait_page_load_time=1.2,
-            viewport_expansion=0,
-            browser_window_size={'width':1366,'height':768},
-        )
-        if isinstance(cdp_port,int) and cdp_port>0:
-            bw_config = BrowserConfig(
-                cdp_url=f"http://127.0.0.1:{cdp_port}"
-            )
+        # borrowed from the session, which keeps them connected across tasks: not closed here
+        self._borrowed:bool = browser is not None and browser_context is not None
+        if browser is not None and browser_context is not None:
+            self._browser:Browser = browser
+            self._browser_context:BrowserContext = browser_context
         else:
-            p = None
-            for p in [ chrome_instance_path, "/Applications/Google Chrome.app/Contents/MacOS/Google Chrome", "/usr/bin/google-chrome", "/opt/google/chrome/google-chrome" ]:
-                if p and os.path.exists( p ):
-                    chrome_instance_path = p
-                    break
-            if p is None:
-                raise ValueError("")
-            bw_config = BrowserConfig(
-                #chrome_instance_path=chrome_instance_path,
-                #extra_chromium_args=[str(self.display_number)],
-            )
-
-        self._browser:Browser = Browser( bw_config )
-        self._browser_context:BrowserContext = BrowserContext( self._browser, bw_context_config)
+            if isinstance(cdp_port,int) and cdp_port>0:
+                bw_config = BrowserConfig(
+                    cdp_url=f"http://127.0.0.1:{cdp_port}"
+                )
+            else:
+                p = None
+                for p in [ chrome_instance_path, "/Applications/Google Chrome.app/Contents/MacOS/Google Chrome", "/usr/bin/google-chrome", "/opt/google/chrome/google-chrome" ]:
+                    if p and os.path.exists( p ):
+                        chrome_instance_path = p
+                        break
+                if p is None:
+                    raise ValueError("")
+                bw_config = BrowserConfig(
+                    #chrome_instance_path=chrome_instance_path,
+                    #extra_chromium_args=[str(self.display_number)],
+                )
+            self._browser = Browser( bw_config )
+            self._browser_context = BrowserContext( self._browser, context_config())
         self._agent:BuwAgent|None = None
         self._sensitive_data=sensitive_data
 
@@ -0,0 +1,186 @@
+import time
+import asyncio
+import threading
+from concurrent.futures import Future
+from typing import Any, Coroutine
+from playwright.async_api import async_playwright, Playwright, Browser as PlaywrightBrowser
+from browser_use import Browser, BrowserConfig
+from logging import Logger,getLogger
+
+logger:Logger = getLogger(__name__)
+
+class PlaywrightRuntime:
+    """One Playwright driver and the event loop it belongs to
+
+    The driver is a Node.js process, and it and every Playwright object made from it
+    belong to one event loop. That loop runs in its own thread, and the tasks of the
+    sessions assigned to it run on it; each session still has its own CDP connection.
+    """
+
+    def __init__(self, name:str='playwright'):
+        self.name:str = name
+        self._loop:asyncio.AbstractEventLoop|None = None
+        self._thread:threading.Thread|None = None
+        self._thread_lock:threading.Lock = threading.Lock()
+        self._pw:Playwright|None = None
+        self._pw_lock:asyncio.Lock|None = None
+        # coroutines submitted from other threads and not finished yet
+        self._futures:set[Future] = set()
+        self.starts:int = 0
+        # time it took to start the driver
+        self.start_time:float = 0.0
+
+    @property
+    def loop(self) -> asyncio.AbstractEventLoop:
+        with self._thread_lock:
+            if self._loop is None:
+                loop = asyncio.new_event_loop()
+                self._thread = threading.Thread(target=loop.run_forever, name=self.name, daemon=True)
+                self._thread.start()
+                self._loop = loop
+            return self._loop
+
+    def submit(self, coro:Coroutine[Any,Any,Any]) -> Future:
+        """Schedule a coroutine on the runtime loop"""
+        fut = asyncio.run_coroutine_threadsafe(coro, self.loop)
+        self._futures.add(fut)
+        fut.add_done_callback(self._futures.discard)
+        return fut
+
+    def cancel_all(self) -> int:
+        """Cancel every submitted coroutine; the threads waiting in run() get CancelledError"""
+        futures = list(self._futures)
+        for fut in futures:
+            fut.cancel()
+        return len(futures)
+
+    def run(self, coro:Coroutine[Any,Any,Any]) -> Any:
+        """Run a coroutine on the runtime loop and wait for it, from another thread"""
+        return self.submit(coro).result()
+
+    def driver_pid(self) -> int|None:
+        try:
+            # not public: the asyncio subprocess behind the pipe transport
+            return self._pw._impl_obj._connection._transport._proc.pid # type: ignore
+        except Exception:
+            return None
+
+    def _driver_alive(self) -> bool:
+        try:
+            return self._pw._impl_obj._connection._transport._proc.returncode is None # type: ignore
+        except Exception:
+            return self._pw is not None
+
+    async def get(self) -> Playwright:
+        """The shared Playwright, started on first use and again if the driver died; call on the runtime loop"""
+        if self._pw_lock is None:
+            self._pw_lock = asyncio.Lock()
+        async with self._pw_lock:
+            if self._pw is not None and not self._driver_alive():
+                logger.warning("playwright driver exited, restarting")
+                self._pw = None
+            if self._pw is None:
+                t0 = time.monotonic()
+                self._pw = await async_playwright().start()
+                self.start_time = time.monotonic()-t0
+                self.starts += 1
+                logger.info(f"playwright driver {self.driver_pid()} started in {self.start_time*1000:.0f}ms")
+            return self._pw
+
+    async def _stop(self) -> None:
+        pw, self._pw = self._pw, None
+        if pw is not None:
+            try:
+                await pw.stop()
+            except Exception:
+                pass
+
+    def stop(self) -> None:
+        """Stop the driver and the loop, from another thread"""
+        with self._thread_lock:
+            loop, thread = self._loop, self._thread
+            self._loop = self._thread = None
+        if loop is None or thread is None:
+            return
+        # a task left running would keep its pool thread waiting forever
+        self.cancel_all()
+        try:
+            asyncio.run_coroutine_threadsafe(self._stop(), loop).result(10.0)
+        except Exception:
+            logger.exception("error while stopping playwright")
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join(5.0)
+        loop.close()
+
+    def get_status(self) -> dict:
+        return {
+            'name': self.name,
+            'running': self._pw is not None,
+            'driver_pid': self.driver_pid(),
+            'starts': self.starts,
+            'start_ms': round(self.start_time*1000,1),
+        }
+
+class PlaywrightPool:
+    """A few runtimes, each session assigned to the least loaded one
+
+    A task that blocks its loop only stalls the sessions on the same loop, and
+    the number of drivers stays small however many sessions there are.
+    """
+
+    def __init__(self, size:int=4):
+        self.runtimes:list[PlaywrightRuntime] = [ PlaywrightRuntime(f"playwright-{i}") for i in range(max(1,size)) ]
+        self._assigned:dict[str,PlaywrightRuntime] = {}
+        self._lock:threading.Lock = threading.Lock()
+
+    def assign(self, session_id:str) -> PlaywrightRuntime:
+        with self._lock:
+            runtime = self._assigned.get(session_id)
+            if runtime is None:
+                load = { id(rt): 0 for rt in self.runtimes }
+                for rt in self._assigned.values():
+                    load[id(rt)] += 1
+                runtime = self._assigned[session_id] = min(self.runtimes, key=lambda rt: load[id(rt)])
+            return runtime
+
+    def release(self, session_id:str) -> None:
+        with self._lock:
+            self._assigned.pop(session_id, None)
+
+    def cancel_all(self) -> int:
+        return sum( rt.cancel_all() for rt in self.runtimes )
+
+    def stop(self) -> None:
+        for rt in self.runtimes:
+            rt.stop()
+
+    def get_status(self) -> dict:
+        with self._lock:
+            sessions = { rt.name: 0 for rt in self.runtimes }
+            for rt in self._assigned.values():
+                sessions[rt.name] += 1
+        return { 'loops': [ dict(rt.get_status(), sessions=sessions[rt.name]) for rt in self.runtimes ] }
+
+class SharedBrowser(Browser):
+    """browser_use Browser that connects through the shared runtime instead of starting its own driver"""
+
+    def __init__(self, config:BrowserConfig, runtime:PlaywrightRuntime):
+        super().__init__(config)
+        self.runtime:PlaywrightRuntime = runtime
+
+    async def _init(self) -> PlaywrightBrowser:
+        playwright = await self.runtime.get()
+        browser = await self._setup_browser(playwright)
+        self.playwright = playwright
+        self.playwright_browser = browser
+        return browser
+
+    async def close(self) -> None:
+        # disconnect from Chrome, the driver is not ours to stop
+        browser, self.playwright_browser = self.playwright_browser, None
+        self.playwright = None
+        if browser is not None:
+            try:
+                await browser.close()
+            except Exception as ex:
+                logger.debug(f"error while disconnecting: {ex}")
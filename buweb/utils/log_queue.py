@@ -0,0 +1,19 @@
+import queue
+import logging
+from logging.handlers import QueueHandler, QueueListener
+
+def install_queue_logging() -> QueueListener:
+    """Put the root logger's handlers behind a queue, so that a log call never waits for the terminal or a file"""
+    root = logging.getLogger()
+    handlers = [ h for h in root.handlers if not isinstance(h, QueueHandler) ]
+    if not handlers:
+        handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+        handlers = [handler]
+    for handler in handlers:
+        root.removeHandler(handler)
+    q:queue.SimpleQueue = queue.SimpleQueue()
+    root.addHandler(QueueHandler(q))
+    listener = QueueListener(q, *handlers, respect_handler_level=True)
+    listener.start()
+    return listener
@@ -0,0 +1,170 @@
+import time
+import threading
+from bisect import bisect_left
+from typing import Callable, Iterator
+
+# seconds, from a cached LLM answer up to a slow research step
+DEFAULT_BUCKETS:tuple[float,...] = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+def _escape(value:str) -> str:
+    return value.replace('\\','\\\\').replace('"','\\"').replace('\n','\\n')
+
+def _labels(names:tuple[str,...], values:tuple[str,...], extra:str='') -> str:
+    parts = [ f'{n}="{_escape(v)}"' for n,v in zip(names,values) ]
+    if extra:
+        parts.append(extra)
+    return '{' + ','.join(parts) + '}' if parts else ''
+
+def _fmt(value:float) -> str:
+    if value==float('inf'):
+        return '+Inf'
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+class Histogram:
+    """Cumulative histogram with fixed buckets, safe to observe from any thread"""
+
+    def __init__(self, name:str, help:str, labelnames:tuple[str,...]=(), buckets:tuple[float,...]=DEFAULT_BUCKETS):
+        self.name:str = name
+        self.help:str = help
+        self.labelnames:tuple[str,...] = labelnames
+        self.buckets:tuple[float,...] = tuple(sorted(buckets))
+        self._lock:threading.Lock = threading.Lock()
+        # labels -> [count per bucket (+Inf last), sum]
+        self._data:dict[tuple[str,...],tuple[list[int],list[float]]] = {}
+
+    def observe(self, value:float, *labels:str) -> None:
+        forward = REGISTRY.forward
+        if forward is not None:
+            forward(self.name, labels, value)
+            return
+        idx = bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._data.get(labels)
+            if entry is None:
+                entry = self._data[labels] = ([0]*(len(self.buckets)+1), [0.0])
+            entry[0][idx] += 1
+            entry[1][0] += value
+
+    def time(self, *labels:str) -> "_Timer":
+        """with histogram.time('label'): ..."""
+        return _Timer(self, labels)
+
+    def render(self) -> Iterator[str]:
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} histogram"
+        with self._lock:
+            items = [ (k,list(v[0]),v[1][0]) for k,v in self._data.items() ]
+        for labels,counts,total in items:
+            acc = 0
+            for le,n in zip(self.buckets+(float('inf'),), counts):
+                acc += n
+                le_label = 'le="' + _fmt(le) + '"'
+                yield f"{self.name}_bucket{_labels(self.labelnames,labels,le_label)} {acc}"
+            yield f"{self.name}_sum{_labels(self.labelnames,labels)} {_fmt(total)}"
+            yield f"{self.name}_count{_labels(self.labelnames,labels)} {acc}"
+
+class _Timer:
+    def __init__(self, hist:Histogram, labels:tuple[str,...]):
+        self._hist:Histogram = hist
+        self._labels:tuple[str,...] = labels
+        self._t0:float = 0.0
+
+    def __enter__(self) -> "_Timer":
+        self._t0 = time.monotonic()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self._hist.observe(time.monotonic()-self._t0, *self._labels)
+
+class Gauge:
+    """Current value, either set directly or read from a function at scrape time"""
+
+    def __init__(self, name:str, help:str, labelnames:tuple[str,...]=()):
+        self.name:str = name
+        self.help:str = help
+        self.labelnames:tuple[str,...] = labelnames
+        self._lock:threading.Lock = threading.Lock()
+        self._values:dict[tuple[str,...],float] = {}
+        self._fn:Callable[[],float]|None = None
+
+    def set(self, value:float, *labels:str) -> None:
+        with self._lock:
+            self._values[labels] = value
+
+    def inc(self, amount:float=1.0, *labels:str) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels,0.0) + amount
+
+    def dec(self, amount:float=1.0, *labels:str) -> None:
+        self.inc(-amount, *labels)
+
+    def set_function(self, fn:Callable[[],float]) -> None:
+        self._fn = fn
+
+    def render(self) -> Iterator[str]:
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} gauge"
+        if self._fn is not None:
+            yield f"{self.name} {_fmt(self._fn())}"
+            return
+        with self._lock:
+            items = list(self._values.items())
+        for labels,value in items:
+            yield f"{self.name}{_labels(self.labelnames,labels)} {_fmt(value)}"
+
+class Registry:
+    def __init__(self):
+        self._metrics:dict[str,Histogram|Gauge] = {}
+        # set in a task process: observations are sent to the parent instead of kept
+        self.forward:Callable[[str,tuple[str,...],float],None]|None = None
+
+    def histogram(self, name:str, help:str, labelnames:tuple[str,...]=(), buckets:tuple[float,...]=DEFAULT_BUCKETS) -> Histogram:
+        metric = self._metrics.get(name)
+        if metric is None:
+            metric = self._metrics[name] = Histogram(name, help, labelnames, buckets)
+        assert isinstance(metric,Histogram)
+        return metric
+
+    def gauge(self, name:str, help:str, labelnames:tuple[str,...]=()) -> Gauge:
+        metric = self._metrics.get(name)
+        if metric is None:
+            metric = self._metrics[name] = Gauge(name, help, labelnames)
+        assert isinstance(metric,Gauge)
+        return metric
+
+    def observe(self, name:str, labels:tuple[str,...], value:float) -> None:
+        """Record an observation forwarded from a task process"""
+        metric = self._metrics.get(name)
+        if isinstance(metric,Histogram):
+            metric.observe(value, *labels)
+
+    def render(self) -> str:
+        """Prometheus text exposition format"""
+        lines:list[str] = []
+        for metric in list(self._metrics.values()):
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+REGISTRY:Registry = Registry()
+
+BRINGUP_SECONDS = REGISTRY.histogram('buw_session_bringup_seconds', 'Session bring-up time per stage', ('stage',))
+LLM_SECONDS = REGISTRY.histogram('buw_llm_call_seconds', 'LLM call latency', ('llm',))
+STEP_SECONDS = REGISTRY.histogram('buw_agent_step_seconds', 'Agent step duration')
+ACTION_SECONDS = REGISTRY.histogram('buw_action_seconds', 'Controller action duration', ('action',))
+SSE_LAG_SECONDS = REGISTRY.histogram('buw_sse_frame_lag_seconds', 'Time from writing a message to taking it into an SSE frame',
+                                     buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5))
+TRANSLATE_SECONDS = REGISTRY.histogram('buw_translate_seconds', 'Translation latency')
+RATE_LIMIT_WAIT_SECONDS = REGISTRY.histogram('buw_llm_rate_limit_wait_seconds', 'Time an LLM call waited for its rate limit', ('llm',),
+                                             buckets=(0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0, 3600.0))
+TEARDOWN_BLOCK_SECONDS = REGISTRY.histogram('buw_teardown_block_seconds', 'Event loop time spent moving a session directory to the trash',
+                                            buckets=(0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1))
+
+SESSIONS = REGISTRY.gauge('buw_sessions', 'Active sessions')
+MAX_SESSIONS = REGISTRY.gauge('buw_sessions_max', 'Configured session slots')
+CONNECTIONS = REGISTRY.gauge('buw_connections', 'Open session streams')
+QUEUE_DEPTH = REGISTRY.gauge('buw_admission_queue_depth', 'Clients waiting for a session slot')
+WARM_READY = REGISTRY.gauge('buw_warm_pool_ready', 'Pre-started sandboxes ready to hand out')
+POOL_BUSY = REGISTRY.gauge('buw_threadpool_busy', 'Thread pool workers running a task')
+POOL_SIZE = REGISTRY.gauge('buw_threadpool_size', 'Thread pool size')
+TASK_PROCS = REGISTRY.gauge('buw_task_processes', 'Tasks running in child processes')
+TRASH_PENDING = REGISTRY.gauge('buw_trash_pending', 'Session directories waiting to be deleted')
@@ -0,0 +1,157 @@
+import sys, os, time, random, string, shutil, tempfile, subprocess, threading
+import asyncio
+import argparse
+from importlib.resources import files
+from http.server import ThreadingHTTPServer, SimpleHTTPRequestHandler
+sys.path.append('.')
+
+from buweb.service.blocklist import Blocklist, compile_lists, is_blocked
+from buweb.service.cdp import CdpConnection, CdpBlocker
+from buweb.service.procs import SupervisedProcess
+from bench_util import free_port
+from buweb.service.readiness import wait_ready, probe_cdp
+
+def rand_name(labels:int) -> str:
+    return '.'.join( ''.join(random.choices(string.ascii_lowercase, k=random.randint(3,10))) for _ in range(labels) ) + random.choice(('.com','.net','.io'))
+
+def make_fixture(dir:str, n:int) -> tuple[str,list[str],list[str]]:
+    """A hosts file with n entries, and blocked/allowed names to look up"""
+    names = [ rand_name(random.randint(1,3)) for _ in range(n) ]
+    path = os.path.join(dir,'hosts')
+    with open(path,'w') as f:
+        f.write("127.0.0.1 localhost\n::1 localhost\n")
+        for name in names:
+            f.write(f"0.0.0.0 {name}\n")
+    blocked = random.sample(names, min(1000,n))
+    allowed = [ 'www.'+rand_name(2) for _ in range(1000) ]
+    return path, blocked, allowed
+
+def bench_lookup(path:str, blocked:list[str], allowed:list[str], rounds:int) -> None:
+    t0 = time.monotonic()
+    compiled = compile_lists([path])
+    print(f"compile: {len(compiled)} entries in {(time.monotonic()-t0)*1000:.0f}ms")
+    hosts = blocked+allowed
+    t0 = time.perf_counter()
+    for _ in range(rounds):
+        for host in hosts:
+            is_blocked(compiled, host)
+    dt = (time.perf_counter()-t0)/(rounds*len(hosts))
+    print(f"engine lookup: {dt*1e9:.0f}ns")
+    # what every lookup through the hosts file costs: the whole file is read
+    # and parsed by glibc; measured with getent in a sandbox that sees the file
+    def sandbox(hosts_path:str, name:str) -> list[str]|None:
+        if shutil.which('bwrap'):
+            return ['bwrap','--bind','/','/','--dev','/dev','--ro-bind',hosts_path,'/etc/hosts','getent','hosts',name]
+        if shutil.which('unshare'):
+            # a user and mount namespace, where the file can be bind mounted over /etc/hosts
+            return ['unshare','-rm','sh','-c','mount --bind "$0" /etc/hosts && exec getent hosts "$1"',hosts_path,name]
+        return None
+    if shutil.which('getent') and sandbox(path, 'localhost') is not None:
+        def getent(hosts_path:str, names:list[str]) -> float:
+            t0 = time.monotonic()
+            for name in names:
+                subprocess.run(sandbox(hosts_path, name), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL) # type: ignore
+            return (time.monotonic()-t0)/len(names)
+        small = os.path.join(os.path.dirname(path),'hosts.small')
+        with open(small,'w') as f:
+            f.write("127.0.0.1 localhost\n")
+        sample = allowed[:50]
+        base = getent(small, sample)
+        full = getent(path, sample)
+        print(f"hosts file lookup: {(full-base)*1e6:.0f}us more than with a 1-line hosts file (getent, {len(sample)} names)")
+    else:
+        print("hosts file lookup: getent, or bwrap and unshare, not found, skipped")
+
+def serve(dir:str) -> tuple[ThreadingHTTPServer,int]:
+    class Handler(SimpleHTTPRequestHandler):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, directory=dir, **kwargs)
+        def log_message(self, *args):
+            pass
+    httpd = ThreadingHTTPServer(('127.0.0.1',0), Handler)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    return httpd, httpd.server_address[1]
+
+async def page_load(port:int, url:str, rounds:int) -> list[float]:
+    conn = await CdpConnection.connect(port)
+    try:
+        target = await conn.send('Target.createTarget', {'url':'about:blank'})
+        sid = (await conn.send('Target.attachToTarget', {'targetId':target['targetId'],'flatten':True}))['sessionId']
+        loaded = asyncio.Event()
+        conn.on('Page.loadEventFired', lambda params, session_id: loaded.set())
+        await conn.send('Page.enable', None, sid)
+        await conn.send('Network.enable', None, sid)
+        await conn.send('Network.setCacheDisabled', {'cacheDisabled':True}, sid)
+        times = []
+        for _ in range(rounds):
+            loaded.clear()
+            t0 = time.monotonic()
+            await conn.send('Page.navigate', {'url':url}, sid)
+            await asyncio.wait_for(loaded.wait(), 60.0)
+            times.append(time.monotonic()-t0)
+        return times
+    finally:
+        await conn.close()
+
+async def bench_page(dir:str, hosts_path:str, blocked:list[str], n_res:int, rounds:int) -> None:
+    # half of the resources come from the local server, half from blocked hosts
+    html = ["<html><body>"]
+    for i in range(n_res):
+        html.append(f'<img src="/img.png?{i}">')
+        html.append(f'<img src="http://{blocked[i%len(blocked)]}/ad.png?{i}">')
+    html.append("</body></html>")
+    www = os.path.join(dir,'www')
+    os.makedirs(www)
+    with open(os.path.join(www,'index.html'),'w') as f:
+        f.write('\n'.join(html))
+    with open(os.path.join(www,'img.png'),'wb') as f:
+        f.write(b'\x89PNG\r\n\x1a\n' + os.urandom(1024))
+    httpd, http_port = serve(www)
+    url = f"http://127.0.0.1:{http_port}/index.html"
+    script_path = str(files('buweb.scripts').joinpath('start_browser.sh'))
+    blocklist = Blocklist([hosts_path])
+    await blocklist.reload(force=True)
+    try:
+        for title in ('hosts file','engine'):
+            home = os.path.join(dir,title.replace(' ','_'))
+            os.makedirs(home)
+            port = free_port()
+            cmd = [script_path, "--headless", "--workdir", home, "--cdpport", str(port)]
+            if title=='hosts file':
+                cmd.extend(["--hosts", hosts_path])
+            proc = await SupervisedProcess.start(cmd, name="bench chrome", cwd=home)
+            blocker:CdpBlocker|None = None
+            try:
+                await wait_ready(lambda: probe_cdp(port), name="bench chrome", timeout_sec=60.0, alive=lambda: proc.alive)
+                if title=='engine':
+                    blocker = CdpBlocker(port, blocklist)
+                    await blocker.start()
+                times = sorted(await page_load(port, url, rounds))
+                print(f"{title:10s} page load p50:{times[len(times)//2]*1000:7.1f}ms max:{times[-1]*1000:7.1f}ms"
+                      + (f" intercepted:{blocker.requests} blocked:{blocker.blocked}" if blocker else ""))
+            finally:
+                if blocker is not None:
+                    await blocker.stop()
+                await proc.stop()
+    finally:
+        httpd.shutdown()
+
+async def main():
+    parser = argparse.ArgumentParser(description="blocklist engine against a hosts file: lookup cost and page load")
+    parser.add_argument("-n", type=int, default=100000, help="entries in the fixture hosts file")
+    parser.add_argument("--rounds", type=int, default=20)
+    parser.add_argument("--chrome", action="store_true", help="also measure page loads in Chrome")
+    parser.add_argument("--resources", type=int, default=50, help="allowed and blocked resources on the test page")
+    args = parser.parse_args()
+    random.seed(1)
+    dir = tempfile.mkdtemp(prefix='buw_bench_', dir='./tmp' if os.path.isdir('./tmp') else None)
+    try:
+        path, blocked, allowed = make_fixture(dir, args.n)
+        bench_lookup(path, blocked, allowed, args.rounds)
+        if args.chrome:
+            await bench_page(dir, path, blocked, args.resources, 5)
+    finally:
+        shutil.rmtree(dir, ignore_errors=True)
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,54 @@
+import sys, os, time, shutil, tempfile
+import asyncio
+import argparse
+from importlib.resources import files
+sys.path.append('.')
+
+from browser_use import Browser, BrowserConfig
+from browser_use.browser.context import BrowserContext
+from buweb.task.browser_link import BrowserLink, context_config
+from buweb.service.procs import SupervisedProcess
+from bench_util import free_port
+from buweb.service.readiness import wait_ready, probe_cdp
+
+async def per_task(port:int) -> float:
+    """Before: every task connected and set up its own Browser and BrowserContext"""
+    t0 = time.monotonic()
+    browser = Browser( BrowserConfig( cdp_url=f"http://127.0.0.1:{port}" ) )
+    context = BrowserContext( browser, context_config() )
+    await context.get_session()
+    dt = time.monotonic()-t0
+    await context.close()
+    await browser.close()
+    return dt
+
+async def main():
+    parser = argparse.ArgumentParser(description="per-task browser setup: new connection per task against a session-owned link")
+    parser.add_argument("-n", type=int, default=10)
+    args = parser.parse_args()
+    home = tempfile.mkdtemp(prefix='buw_bench_', dir='./tmp' if os.path.isdir('./tmp') else None)
+    port = free_port()
+    script_path = str(files('buweb.scripts').joinpath('start_browser.sh'))
+    proc = await SupervisedProcess.start([script_path, "--headless", "--workdir", home, "--cdpport", str(port)], name="bench chrome", cwd=home)
+    link = BrowserLink()
+    try:
+        await wait_ready(lambda: probe_cdp(port), name="bench chrome", timeout_sec=60.0, alive=lambda: proc.alive)
+        for title in ("per task","link"):
+            times = []
+            for _ in range(args.n):
+                if title=="per task":
+                    times.append(await per_task(port))
+                else:
+                    await link.acquire(port)
+                    times.append(link.last_acquire)
+            first = times[0]
+            times.sort()
+            print(f"{title:8s} first:{first*1000:8.1f}ms p50:{times[len(times)//2]*1000:8.1f}ms max:{times[-1]*1000:8.1f}ms")
+        print(link.get_status())
+    finally:
+        await link.close()
+        await proc.stop()
+        shutil.rmtree(home, ignore_errors=True)
+
+if __name__ == "__main__":
+    asyncio.run(main())
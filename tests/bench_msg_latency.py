@@ -0,0 +1,67 @@
+import sys, time, random, threading
+import asyncio
+import argparse
+from queue import Queue, Empty
+sys.path.append('.')
+
+from buweb.service.channel import MsgChannel
+
+def writer(put, n:int, interval:float):
+    """Agent thread: writes messages stamped with the time they were produced"""
+    for i in range(n):
+        time.sleep(random.uniform(0, interval*2))
+        put( (i, time.perf_counter()) )
+    put( (-1, time.perf_counter()) )
+
+async def bench_queue(n:int, interval:float) -> list[float]:
+    """Before: queue.Queue polled with get_nowait + sleep(0.2)"""
+    queue:Queue = Queue()
+    th = threading.Thread(target=writer, args=(queue.put, n, interval))
+    th.start()
+    lat:list[float] = []
+    while True:
+        try:
+            i, t = queue.get_nowait()
+        except Empty:
+            await asyncio.sleep(0.2)
+            continue
+        if i<0:
+            break
+        lat.append( time.perf_counter()-t )
+    th.join()
+    return lat
+
+async def bench_channel(n:int, interval:float) -> list[float]:
+    """After: MsgChannel woken with call_soon_threadsafe"""
+    channel:MsgChannel = MsgChannel()
+    sub = channel.subscribe()
+    th = threading.Thread(target=writer, args=(channel.publish, n, interval))
+    th.start()
+    lat:list[float] = []
+    while True:
+        item = await sub.get(timeout=1.0)
+        if item is None:
+            continue
+        i, t = item
+        if i<0:
+            break
+        lat.append( time.perf_counter()-t )
+    th.join()
+    return lat
+
+def report(title:str, lat:list[float]):
+    lat.sort()
+    p50 = lat[len(lat)//2]*1000
+    p99 = lat[int(len(lat)*0.99)]*1000
+    print(f"{title:22s} n:{len(lat)} mean:{sum(lat)/len(lat)*1000:8.3f}ms p50:{p50:8.3f}ms p99:{p99:8.3f}ms max:{lat[-1]*1000:8.3f}ms")
+
+async def main():
+    parser = argparse.ArgumentParser(description="latency from writer thread to SSE reader")
+    parser.add_argument("-n", type=int, default=200)
+    parser.add_argument("--interval", type=float, default=0.02)
+    args = parser.parse_args()
+    report("Queue + 0.2s polling", await bench_queue(args.n, args.interval))
+    report("MsgChannel", await bench_channel(args.n, args.interval))
+
+if __name__ == "__main__":
+    asyncio.run(main())
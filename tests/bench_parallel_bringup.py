@@ -0,0 +1,50 @@
+import sys, os, time, shutil
+import asyncio
+import argparse
+sys.path.append('.')
+from concurrent.futures import ThreadPoolExecutor
+
+from buweb.service.session import BwSession
+from buweb.service.ports import PortAllocator
+
+async def bringup(n:int, shared_lock:bool) -> list[float]:
+    """Start n sessions at the same time and return the bring-up time of each"""
+    basedir = os.path.abspath("tmp/bench_bringup")
+    os.makedirs(basedir,exist_ok=True)
+    Pool = ThreadPoolExecutor(n)
+    ports = PortAllocator()
+    # before: one lock shared by every session, after: a lock per session
+    lock = asyncio.Lock() if shared_lock else None
+    sessions:list[BwSession] = []
+    for i in range(n):
+        workdir = os.path.join(basedir, f"session_{i:03d}")
+        os.makedirs(workdir,exist_ok=True)
+        sessions.append( BwSession(f"bench{i:03d}", "localhost", None, dir=workdir, Pool=Pool, ports=ports, lock=lock) )
+
+    async def start(ses:BwSession) -> float:
+        t0 = time.monotonic()
+        await ses.start_browser()
+        if not ses.is_ready():
+            print(f"[{ses.session_id}] could not be started")
+        return time.monotonic()-t0
+
+    try:
+        return await asyncio.gather( *[start(ses) for ses in sessions] )
+    finally:
+        await asyncio.gather( *[ses.stop_browser() for ses in sessions] )
+        Pool.shutdown()
+        shutil.rmtree(basedir,ignore_errors=True)
+
+async def main():
+    parser = argparse.ArgumentParser(description="bring-up time of simultaneous sessions")
+    parser.add_argument("-n", type=int, default=10)
+    args = parser.parse_args()
+    for title,shared in (("shared lock (before)",True),("per-session lock (after)",False)):
+        t0 = time.monotonic()
+        times = await bringup(args.n, shared)
+        total = time.monotonic()-t0
+        times.sort()
+        print(f"{title:26s} sessions:{args.n} total:{total:.2f}s min:{times[0]:.2f}s median:{times[len(times)//2]:.2f}s max:{times[-1]:.2f}s")
+
+if __name__ == "__main__":
+    asyncio.run(main())
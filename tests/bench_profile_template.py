@@ -0,0 +1,89 @@
+import sys, os, time, shutil, tempfile
+import asyncio
+import argparse
+from importlib.resources import files
+sys.path.append('.')
+
+from buweb.service.profile import ProfileTemplate
+from bench_util import free_port
+from buweb.service.procs import SupervisedProcess
+from buweb.service.readiness import wait_ready, probe_cdp
+from buweb.service.resources import scan_procs, descendants
+
+def tree_write_bytes(pid:int) -> int:
+    """Bytes the process tree has caused to be written to storage"""
+    procs = scan_procs()
+    children:dict[int,list[int]] = {}
+    for st in procs.values():
+        children.setdefault(st.ppid,[]).append(st.pid)
+    total = 0
+    for p in descendants([pid], procs, children):
+        try:
+            with open(f"/proc/{p}/io") as f:
+                for line in f:
+                    if line.startswith('write_bytes:'):
+                        total += int(line.split()[1])
+        except OSError:
+            pass
+    return total
+
+def du(path:str) -> int:
+    total = 0
+    for root, _, names in os.walk(path):
+        for name in names:
+            try:
+                total += os.lstat(os.path.join(root,name)).st_blocks*512
+            except OSError:
+                pass
+    return total
+
+async def launch(home:str, template:ProfileTemplate|None, settle:float) -> tuple[float,float,int]:
+    """Return (profile copy time, time to CDP ready, bytes written)"""
+    t0 = time.monotonic()
+    if template is not None:
+        await template.copy_to(home)
+    t_copy = time.monotonic()-t0
+    os.makedirs(os.path.join(home,'.config','google-chrome','Default'), exist_ok=True)
+    port = free_port()
+    script_path = str(files('buweb.scripts').joinpath('start_browser.sh'))
+    proc = await SupervisedProcess.start([script_path, "--headless", "--workdir", home, "--cdpport", str(port)], name="bench chrome", cwd=home)
+    try:
+        t_ready = await wait_ready(lambda: probe_cdp(port), name="bench chrome", timeout_sec=60.0, alive=lambda: proc.alive)
+        await asyncio.sleep(settle)
+        written = tree_write_bytes(proc.pid)
+    finally:
+        await proc.stop()
+    return t_copy, t_ready, written
+
+async def main():
+    parser = argparse.ArgumentParser(description="time to CDP ready and disk writes, with and without a profile template")
+    parser.add_argument("-n", type=int, default=5)
+    parser.add_argument("--settle", type=float, default=2.0, help="seconds to keep each browser running before measuring writes")
+    args = parser.parse_args()
+    base = tempfile.mkdtemp(prefix='buw_bench_', dir='./tmp' if os.path.isdir('./tmp') else None)
+    try:
+        template = ProfileTemplate(os.path.join(base,'template'))
+        t0 = time.monotonic()
+        template.start()
+        if template._preparing is not None:
+            await template._preparing
+        if not template.ready:
+            print("template could not be prepared")
+            return
+        print(f"template prepared in {time.monotonic()-t0:.1f}s, {du(template.dir)/1e6:.1f}MB")
+        for title,tmpl in (("empty",None),("template",template)):
+            rows = []
+            for i in range(args.n):
+                home = os.path.join(base,f"{title}_{i}")
+                rows.append( (*await launch(home, tmpl, args.settle), du(home)) )
+            copy = sum(r[0] for r in rows)/len(rows)
+            ready = sorted(r[1] for r in rows)
+            written = sum(r[2] for r in rows)/len(rows)
+            used = sum(r[3] for r in rows)/len(rows)
+            print(f"{title:9s} copy:{copy*1000:7.1f}ms cdp-ready p50:{ready[len(ready)//2]*1000:7.1f}ms max:{ready[-1]*1000:7.1f}ms"
+                  f" written:{written/1e6:6.1f}MB home:{used/1e6:6.1f}MB")
+    finally:
+        shutil.rmtree(base, ignore_errors=True)
+
+if __name__ == "__main__":
+    asyncio.run(main())
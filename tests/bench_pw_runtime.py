@@ -0,0 +1,65 @@
+import sys, os, time, shutil, tempfile
+import asyncio
+import argparse
+from importlib.resources import files
+sys.path.append('.')
+
+from browser_use import Browser, BrowserConfig
+from buweb.task.pw_runtime import PlaywrightRuntime, SharedBrowser
+from buweb.service.procs import SupervisedProcess
+from bench_util import free_port
+from buweb.service.readiness import wait_ready, probe_cdp
+from buweb.service.resources import scan_procs, descendants, read_pss
+
+def drivers_pss(exclude:int) -> tuple[int,int]:
+    """Number and PSS of our child processes, leaving out the Chrome tree"""
+    procs = scan_procs()
+    children:dict[int,list[int]] = {}
+    for st in procs.values():
+        children.setdefault(st.ppid,[]).append(st.pid)
+    chrome = set(descendants([exclude], procs, children))
+    pids = [ p for p in descendants([os.getpid()], procs, children) if p!=os.getpid() and p not in chrome ]
+    return len(pids), sum(read_pss(p) for p in pids)
+
+async def connect(n:int, port:int, runtime:PlaywrightRuntime|None, chrome_pid:int) -> tuple[list[float],int,int]:
+    """Connect n browsers at once, as n sessions starting a task would, and return each latency and the driver memory"""
+    config = BrowserConfig( cdp_url=f"http://127.0.0.1:{port}" )
+    browsers = [ SharedBrowser(config, runtime) if runtime is not None else Browser(config) for _ in range(n) ]
+    async def one(browser:Browser) -> float:
+        t0 = time.monotonic()
+        await browser.get_playwright_browser()
+        return time.monotonic()-t0
+    try:
+        times = await asyncio.gather( *[one(b) for b in browsers] )
+        count, pss = drivers_pss(chrome_pid)
+        return list(times), count, pss
+    finally:
+        for b in browsers:
+            await b.close()
+
+async def main():
+    parser = argparse.ArgumentParser(description="Playwright driver per Browser against one shared driver")
+    parser.add_argument("-n", type=int, default=20, help="browsers connected at the same time")
+    args = parser.parse_args()
+    home = tempfile.mkdtemp(prefix='buw_bench_', dir='./tmp' if os.path.isdir('./tmp') else None)
+    port = free_port()
+    script_path = str(files('buweb.scripts').joinpath('start_browser.sh'))
+    proc = await SupervisedProcess.start([script_path, "--headless", "--workdir", home, "--cdpport", str(port)], name="bench chrome", cwd=home)
+    runtime = PlaywrightRuntime()
+    try:
+        await wait_ready(lambda: probe_cdp(port), name="bench chrome", timeout_sec=60.0, alive=lambda: proc.alive)
+        # the runtime's objects belong to its loop, so the shared case runs there
+        cases = ( ("per browser", lambda: connect(args.n, port, None, proc.pid)),
+                  ("shared", lambda: asyncio.wrap_future(runtime.submit(connect(args.n, port, runtime, proc.pid)))) )
+        for title, run in cases:
+            times, count, pss = await run()
+            times.sort()
+            print(f"{title:11s} connect p50:{times[len(times)//2]*1000:7.1f}ms max:{times[-1]*1000:7.1f}ms"
+                  f" driver processes:{count:3d} pss:{pss/1e6:7.1f}MB")
+    finally:
+        await asyncio.to_thread(runtime.stop)
+        await proc.stop()
+        shutil.rmtree(home, ignore_errors=True)
+
+if __name__ == "__main__":
+    asyncio.run(main())
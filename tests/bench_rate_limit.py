@@ -0,0 +1,52 @@
+import sys, os, time
+import asyncio
+import argparse
+import tempfile
+import multiprocessing as mp
+sys.path.append('.')
+
+from buweb.model.rate_limit import RateBucket, RateLimits
+
+def acquire_cost(path:str|None, n:int) -> float:
+    """Microseconds per acquire that does not wait"""
+    bucket = RateBucket('bench', RateLimits(rpm=10**9), path)
+    t0 = time.perf_counter()
+    for _ in range(n):
+        bucket.try_acquire()
+    dt = time.perf_counter()-t0
+    bucket.close()
+    return dt*1e6/n
+
+def worker(path:str, rpm:int, seconds:float, q) -> None:
+    async def run() -> int:
+        bucket = RateBucket('bench', RateLimits(rpm=rpm), path)
+        end = time.time()+seconds
+        n = 0
+        while True:
+            await bucket.aacquire()
+            if time.time()>=end:
+                return n
+            n += 1
+    q.put(asyncio.run(run()))
+
+def main():
+    parser = argparse.ArgumentParser(description="shared rate limiter: acquire cost and accuracy of one budget across processes")
+    parser.add_argument("--procs", type=int, default=4)
+    parser.add_argument("--rpm", type=int, default=600)
+    parser.add_argument("--seconds", type=float, default=5.0)
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as tmp:
+        print(f"acquire: in process {acquire_cost(None, 100000):.2f}us, shared file {acquire_cost(os.path.join(tmp,'cost.bucket'), 100000):.2f}us")
+        q = mp.Queue()
+        procs = [ mp.Process(target=worker, args=(os.path.join(tmp,'share.bucket'), args.rpm, args.seconds, q)) for _ in range(args.procs) ]
+        for p in procs:
+            p.start()
+        for p in procs:
+            p.join()
+        counts = [ q.get() for _ in procs ]
+        # a full bucket at the start, then the refill rate
+        expected = args.rpm + args.rpm*args.seconds/60.0
+        print(f"{args.procs} processes, {args.seconds}s at {args.rpm} rpm: {sum(counts)} requests {sorted(counts)}, budget {expected:.0f}")
+
+if __name__ == "__main__":
+    main()
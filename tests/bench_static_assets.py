@@ -0,0 +1,95 @@
+import sys, time, re
+import asyncio
+import argparse
+sys.path.append('.')
+
+import aiohttp
+from buweb.service.assets import StaticAssets, brotli
+
+NOVNC_DIR = 'third_party/noVNC-1.5.0'
+
+def page_set(novnc:StaticAssets) -> list[str]:
+    """What the browser loads for the main page with a VNC view"""
+    paths = ['/', '/style.css', '/novnc/vnc_lite.html']
+    for p in sorted(novnc.paths()):
+        if p.endswith('.js') and (p.startswith('core/') or p.startswith('vendor/pako/')):
+            paths.append('/novnc/'+p)
+    return paths
+
+def offline(static:StaticAssets, novnc:StaticAssets) -> list[str]:
+    for assets in (static, novnc):
+        t0 = time.monotonic()
+        assets.build()
+        print(f"build {assets.root}: {time.monotonic()-t0:.2f}s")
+    paths = page_set(novnc)
+    sizes = {'':0, 'gzip':0, 'br':0}
+    for path in paths:
+        if path.startswith('/novnc/'):
+            asset = novnc.lookup(path[len('/novnc/'):])
+        else:
+            asset = static.lookup('index.html' if path=='/' else path[1:])
+        if asset is None:
+            continue
+        for enc in sizes:
+            sizes[enc] += len((asset.variants.get(enc) or asset.variants['']).body)
+    print(f"page set: {len(paths)} files, identity {sizes['']>>10}KB gzip {sizes['gzip']>>10}KB"
+          + (f" br {sizes['br']>>10}KB" if brotli is not None else " (brotli not installed)"))
+    return paths
+
+def max_age(cache_control:str) -> int:
+    m = re.search(r'max-age=(\d+)', cache_control or '')
+    return int(m.group(1)) if m else 0
+
+async def load(http:aiohttp.ClientSession, url:str, paths:list[str], cache:dict[str,tuple[str,str]], parallel:int) -> tuple[float,int,int,int]:
+    """One page load like a browser with the given cache: (seconds, requests, wire bytes, 304s)"""
+    sem = asyncio.Semaphore(parallel)
+    requests = wire = not_modified = 0
+    async def get(path:str) -> None:
+        nonlocal requests, wire, not_modified
+        headers = {'Accept-Encoding': 'gzip, deflate, br'}
+        cached = cache.get(path)
+        if cached is not None:
+            etag, cache_control = cached
+            if max_age(cache_control)>0:
+                # fresh in the browser cache, no request at all
+                return
+            if etag:
+                headers['If-None-Match'] = etag
+        async with sem:
+            async with http.get(url+path, headers=headers) as resp:
+                body = await resp.read()
+                requests += 1
+                wire += len(body)
+                if resp.status==304:
+                    not_modified += 1
+                cache[path] = ( resp.headers.get('ETag',''), resp.headers.get('Cache-Control','') )
+    t0 = time.monotonic()
+    await asyncio.gather( *[ get(p) for p in paths ] )
+    return time.monotonic()-t0, requests, wire, not_modified
+
+async def main():
+    parser = argparse.ArgumentParser(description="static assets: precompressed sizes, and cold/warm page loads against a running server")
+    parser.add_argument("--url", default='', help="server to load the page set from, e.g. http://127.0.0.1:5000")
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--parallel", type=int, default=6, help="connections per host, as in a browser")
+    args = parser.parse_args()
+    static = StaticAssets('static', cache_control='no-cache')
+    novnc = StaticAssets(NOVNC_DIR, cache_control='')
+    paths = offline(static, novnc)
+    if not args.url:
+        return
+    # wire bytes: do not decompress
+    async with aiohttp.ClientSession(auto_decompress=False) as http:
+        for title in ('cold','warm'):
+            times = []
+            for _ in range(args.rounds):
+                cache:dict[str,tuple[str,str]] = {}
+                if title=='warm':
+                    await load(http, args.url, paths, cache, args.parallel)
+                dt, n, wire, nm = await load(http, args.url, paths, cache, args.parallel)
+                times.append(dt)
+            times.sort()
+            print(f"{title}: p50 {times[len(times)//2]*1000:7.1f}ms requests:{n} 304:{nm} bytes:{wire>>10}KB")
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,80 @@
+import sys, time, json, re
+import asyncio
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+sys.path.append('.')
+
+from quart import Quart
+
+from buweb.service.task_proc import TaskProcess
+
+app = Quart(__name__)
+
+@app.route('/ping')
+async def ping():
+    return 'pong'
+
+async def fake_agent(writer, cancel:asyncio.Event, steps:int, size:int):
+    """CPU work of an agent step: build a DOM string, dump and parse the history, scan it"""
+    history:list[dict] = []
+    for step in range(steps):
+        if cancel.is_set():
+            break
+        dom = "".join( f'<div id="e{i}" class="c{i%7}">[{i}] item {i} text</div>\n' for i in range(size) )
+        history.append( {'step': step, 'dom': dom[:2000], 'actions': [ {'click': i} for i in range(50) ]} )
+        data = json.loads( json.dumps(history) )
+        len(re.findall(r'\[(\d+)\]', dom))
+        writer(1, 1, step, 0, '', f"step {step} {len(data)}", None)
+        # waiting for the LLM
+        await asyncio.sleep(0.05)
+
+async def measure(client, duration:float, interval:float) -> list[float]:
+    lat:list[float] = []
+    end = time.perf_counter() + duration
+    while time.perf_counter()<end:
+        t0 = time.perf_counter()
+        await client.get('/ping')
+        lat.append( time.perf_counter()-t0 )
+        await asyncio.sleep(interval)
+    return lat
+
+def report(title:str, lat:list[float]):
+    lat.sort()
+    p50 = lat[len(lat)//2]*1000
+    p99 = lat[int(len(lat)*0.99)]*1000
+    print(f"{title:10s} n:{len(lat)} mean:{sum(lat)/len(lat)*1000:8.3f}ms p50:{p50:8.3f}ms p99:{p99:8.3f}ms max:{lat[-1]*1000:8.3f}ms")
+
+async def run_threads(n:int, steps:int, size:int):
+    pool = ThreadPoolExecutor(n)
+    loop = asyncio.get_running_loop()
+    msgs:list = []
+    writer = lambda *row: loop.call_soon_threadsafe(msgs.append, row)
+    futures = [ loop.run_in_executor(pool, asyncio.run, fake_agent(writer, asyncio.Event(), steps, size)) for _ in range(n) ]
+    return futures, msgs
+
+async def run_processes(n:int, steps:int, size:int):
+    msgs:list = []
+    procs = [ TaskProcess(fake_agent, (steps, size), on_msg=lambda *row: msgs.append(row), name=f"bench-{i}") for i in range(n) ]
+    return [ asyncio.ensure_future(p.wait()) for p in procs ], msgs
+
+async def main():
+    parser = argparse.ArgumentParser(description="Quart latency while tasks run in threads or in processes")
+    parser.add_argument("-n", type=int, default=10, help="concurrent tasks")
+    parser.add_argument("--steps", type=int, default=40)
+    parser.add_argument("--size", type=int, default=20000, help="DOM elements per step")
+    parser.add_argument("--interval", type=float, default=0.01)
+    args = parser.parse_args()
+    client = app.test_client()
+    report("idle", await measure(client, 2.0, args.interval))
+    for title,start in (("thread",run_threads),("process",run_processes)):
+        t0 = time.perf_counter()
+        futures, msgs = await start(args.n, args.steps, args.size)
+        lat:list[float] = []
+        while not all( f.done() for f in futures ):
+            lat += await measure(client, 0.5, args.interval)
+        await asyncio.gather(*futures)
+        report(title, lat)
+        print(f"{'':10s} {len(msgs)} messages in {time.perf_counter()-t0:.1f}s")
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,11 @@
+import sys
+sys.path.append('.')
+
+from buweb.service.ports import CanNotStartException, is_port_available
+
+def free_port(start:int=9400, end:int=9500) -> int:
+    """A free port for a benchmark's Chrome, outside the ranges of a PortAllocator"""
+    for port in range(start,end):
+        if is_port_available(port):
+            return port
+    raise CanNotStartException("No available port for the benchmark browser")
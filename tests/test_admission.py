@@ -0,0 +1,81 @@
+import sys, asyncio
+sys.path.append('.')
+
+from buweb.service.admission import AdmissionQueue, PRIORITY_HIGH, PRIORITY_LOW
+
+class Slots:
+    """Session slots, taken by the tickets that are used"""
+    def __init__(self, total:int):
+        self.total:int = total
+        self.taken:int = 0
+    def free(self) -> int:
+        return self.total-self.taken
+
+def test_grant_while_slots_are_free():
+    slots = Slots(2)
+    queue = AdmissionQueue(slots.free)
+    a, b, c = queue.enter(), queue.enter(), queue.enter()
+    assert a.granted and b.granted and not c.granted
+    assert queue.available()==0
+    assert queue.depth==1
+    assert queue.position(c)==1
+
+def test_used_slot_is_granted_to_the_next_ticket_on_wake():
+    slots = Slots(1)
+    queue = AdmissionQueue(slots.free)
+    a, b = queue.enter(), queue.enter()
+    queue.use(a)
+    slots.taken += 1
+    assert not b.granted
+    # the session of a is removed
+    slots.taken -= 1
+    queue.wake()
+    assert b.granted and queue.depth==0
+
+def test_priority_goes_first_then_fifo():
+    slots = Slots(1)
+    queue = AdmissionQueue(slots.free)
+    first = queue.enter()
+    low = queue.enter(PRIORITY_LOW)
+    normal = queue.enter()
+    high = queue.enter(PRIORITY_HIGH)
+    assert [ queue.position(t) for t in (high, normal, low) ]==[1,2,3]
+    queue.cancel(first)
+    assert high.granted and not normal.granted
+
+def test_cancel_releases_a_reserved_slot_or_a_place():
+    slots = Slots(1)
+    queue = AdmissionQueue(slots.free)
+    a, b, c = queue.enter(), queue.enter(), queue.enter()
+    queue.cancel(b)
+    assert queue.depth==1 and queue.position(c)==1
+    queue.cancel(a)
+    assert c.granted and queue.depth==0
+    # cancelling twice or after use changes nothing
+    queue.use(c)
+    queue.cancel(c)
+    queue.cancel(b)
+    assert queue.available()==1 and queue.depth==0
+
+def test_wait_returns_when_granted():
+    async def run():
+        slots = Slots(1)
+        queue = AdmissionQueue(slots.free)
+        a, b = queue.enter(), queue.enter()
+        assert await a.wait(0.1)
+        assert not await b.wait(0.05)
+        asyncio.get_running_loop().call_later(0.05, queue.cancel, a)
+        assert await b.wait(1.0)
+    asyncio.run(run())
+
+def test_eta():
+    queue = AdmissionQueue(lambda: 0)
+    assert queue.eta(0, 2)==0.0
+    # nothing to base an estimate on yet
+    assert queue.eta(1, 2) is None
+    queue.record_duration(100.0)
+    queue.record_duration(200.0)
+    assert queue.eta(1, 2)==75.0
+    assert queue.eta(2, 2)==75.0
+    assert queue.eta(3, 2)==225.0
+    assert queue.eta(1, 0) is None
@@ -0,0 +1,64 @@
+import sys, os, gzip
+sys.path.append('.')
+
+from buweb.service.assets import StaticAssets, accepted, etag_matches, brotli
+
+def make_root(tmp_path) -> StaticAssets:
+    (tmp_path/'js').mkdir()
+    (tmp_path/'js'/'app.js').write_text("function hello() { return 'hello'; }\n"*100)
+    (tmp_path/'small.css').write_text("body{}")
+    (tmp_path/'logo.png').write_bytes(os.urandom(2048))
+    (tmp_path/'.git').mkdir()
+    (tmp_path/'.git'/'HEAD').write_text("ref")
+    assets = StaticAssets(str(tmp_path), cache_control='no-cache')
+    assets.build()
+    return assets
+
+def test_accepted():
+    assert accepted('gzip, deflate, br')=={'gzip','deflate','br'}
+    assert accepted('GZip;q=0.5, br;q=0')=={'gzip'}
+    assert accepted('br; q=0.000 , identity')=={'identity'}
+    assert accepted('')==set()
+
+def test_build_and_lookup(tmp_path):
+    assets = make_root(tmp_path)
+    assert sorted(assets.paths())==['js/app.js','logo.png','small.css']
+    app = assets.lookup('js/app.js')
+    # text/ or application/ depending on the mimetypes tables
+    assert app is not None and app.content_type.endswith('javascript; charset=utf-8')
+    assert gzip.decompress(app.variants['gzip'].body)==app.variants[''].body
+    # too small, or not compressible
+    assert list(assets.lookup('small.css').variants)==[''] # type: ignore
+    assert list(assets.lookup('logo.png').variants)==[''] # type: ignore
+    assert assets.lookup('missing.js') is None
+
+def test_changed_file_is_not_served_from_memory(tmp_path):
+    assets = make_root(tmp_path)
+    path = tmp_path/'small.css'
+    path.write_text("body{color:red}")
+    mtime = os.path.getmtime(path)+10
+    os.utime(path, (mtime,mtime))
+    assert assets.lookup('small.css') is None
+
+def test_select(tmp_path):
+    assets = make_root(tmp_path)
+    app = assets.lookup('js/app.js')
+    assert app is not None
+    assert assets.select(app, 'gzip').encoding=='gzip'
+    assert assets.select(app, 'deflate').encoding==''
+    assert assets.select(app, 'gzip;q=0').encoding==''
+    assert assets.select(app, 'gzip, br').encoding==('br' if brotli is not None else 'gzip')
+    # no variant to choose from
+    assert assets.select(assets.lookup('logo.png'), 'gzip').encoding=='' # type: ignore
+
+def test_etag_matches(tmp_path):
+    assets = make_root(tmp_path)
+    app = assets.lookup('js/app.js')
+    assert app is not None
+    plain, gz = app.variants[''].etag, app.variants['gzip'].etag
+    assert plain!=gz
+    assert etag_matches(plain, app)
+    assert etag_matches(f'"other", W/{gz}', app)
+    assert etag_matches('*', app)
+    assert not etag_matches('"other"', app)
+    assert not etag_matches(plain, assets.lookup('small.css')) # type: ignore
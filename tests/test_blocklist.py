@@ -0,0 +1,66 @@
+import sys, os, asyncio
+sys.path.append('.')
+
+from buweb.service.blocklist import Blocklist, compile_lists, is_blocked
+
+HOSTS = """\
+# comment
+127.0.0.1 localhost
+0.0.0.0 ads.example.com tracker.example.net  # two names
+192.168.1.10 intranet.example.com
+"""
+DOMAINS = """\
+Example.ORG
+*.cdn.example.io
+localhost
+"""
+
+def write(path, text:str) -> str:
+    with open(path,'w') as f:
+        f.write(text)
+    return str(path)
+
+def test_is_blocked(tmp_path):
+    compiled = compile_lists([ write(tmp_path/'hosts', HOSTS), write(tmp_path/'domains.txt', DOMAINS) ])
+    # hosts file entries block that host only
+    assert is_blocked(compiled, 'ads.example.com')
+    assert is_blocked(compiled, 'tracker.example.net')
+    assert not is_blocked(compiled, 'sub.ads.example.com')
+    assert not is_blocked(compiled, 'example.com')
+    # only names pointed at a sink address
+    assert not is_blocked(compiled, 'intranet.example.com')
+    assert not is_blocked(compiled, 'localhost')
+    # a domain blocks itself and its subdomains
+    assert is_blocked(compiled, 'example.org')
+    assert is_blocked(compiled, 'a.b.example.org')
+    assert not is_blocked(compiled, 'notexample.org')
+    # a wildcard blocks the subdomains only
+    assert is_blocked(compiled, 'img.cdn.example.io')
+    assert not is_blocked(compiled, 'cdn.example.io')
+    assert len(compiled)==4
+
+def test_missing_source_is_skipped(tmp_path):
+    compiled = compile_lists([ str(tmp_path/'missing'), write(tmp_path/'hosts', HOSTS) ])
+    assert compiled.mtimes[str(tmp_path/'missing')] is None
+    assert is_blocked(compiled, 'ads.example.com')
+
+def test_blocklist_normalizes_the_host(tmp_path):
+    blocklist = Blocklist([ write(tmp_path/'hosts', HOSTS) ])
+    assert not blocklist.blocked('ads.example.com')
+    assert asyncio.run(blocklist.reload())
+    assert blocklist.blocked('ADS.example.com.')
+    assert not Blocklist().enabled
+
+def test_reload_only_when_a_source_changed(tmp_path):
+    async def run():
+        path = write(tmp_path/'hosts', HOSTS)
+        blocklist = Blocklist([path])
+        assert await blocklist.reload()
+        assert not await blocklist.reload()
+        write(path, "0.0.0.0 new.example.com\n")
+        mtime = os.path.getmtime(path)+10
+        os.utime(path, (mtime,mtime))
+        assert await blocklist.reload()
+        assert blocklist.version==2
+        assert blocklist.blocked('new.example.com') and not blocklist.blocked('ads.example.com')
+    asyncio.run(run())
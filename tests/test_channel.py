@@ -0,0 +1,47 @@
+import sys, asyncio, threading
+sys.path.append('.')
+
+from buweb.service.channel import MsgChannel
+
+def test_publish_wakes_a_waiting_get():
+    async def run():
+        channel:MsgChannel[str] = MsgChannel()
+        sub = channel.subscribe()
+        asyncio.get_running_loop().call_later(0.02, channel.publish, 'a')
+        assert await sub.get(1.0)=='a'
+        assert await sub.get(0.02) is None
+    asyncio.run(run())
+
+def test_publish_from_another_thread():
+    async def run():
+        channel:MsgChannel[int] = MsgChannel()
+        sub = channel.subscribe()
+        threading.Thread(target=lambda: [ channel.publish(i) for i in range(3) ]).start()
+        assert await sub.get_batch(1.0, 0.1)==[0,1,2]
+    asyncio.run(run())
+
+def test_second_get_takes_over_from_the_first():
+    async def run():
+        channel:MsgChannel[str] = MsgChannel()
+        sub = channel.subscribe()
+        # the old stream of a client is still waiting when it resumes on a new one
+        old = asyncio.create_task(sub.get(10.0))
+        await asyncio.sleep(0.01)
+        new = asyncio.create_task(sub.get(10.0))
+        assert await asyncio.wait_for(old, 1.0) is None
+        channel.publish('a')
+        assert await asyncio.wait_for(new, 1.0)=='a'
+    asyncio.run(run())
+
+def test_overflow():
+    async def run():
+        channel:MsgChannel[int] = MsgChannel(maxsize=2)
+        oldest, newest = channel.subscribe(overflow='drop_new'), channel.subscribe()
+        for i in range(4):
+            channel.publish(i)
+        assert [ oldest.get_nowait() for _ in range(2) ]==[0,1]
+        assert [ newest.get_nowait() for _ in range(2) ]==[2,3]
+        assert oldest.dropped==newest.dropped==2
+        newest.unget([7,8])
+        assert [ newest.get_nowait(), newest.get_nowait(), newest.get_nowait() ]==[7,8,None]
+    asyncio.run(run())
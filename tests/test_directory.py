@@ -0,0 +1,86 @@
+import sys, time, asyncio
+sys.path.append('.')
+import pytest
+
+# cluster.py, where WorkerNode lives, needs aiohttp
+pytest.importorskip('aiohttp')
+from buweb.service.directory import SessionDirectory, DirectoryPublisher
+
+def rows(*session_ids:str) -> list[dict]:
+    return [ {'session_id': sid, 'display': 10+i, 'ws_port': 5030+i, 'cdp_port': 9222+i, 'status': {'task': False}, 'msg_seq': i}
+             for i, sid in enumerate(session_ids) ]
+
+def test_publish_and_owner(tmp_path):
+    path = str(tmp_path/'directory.db')
+    # each worker process has its own connection to the file
+    w0, w1 = SessionDirectory(path), SessionDirectory(path)
+    try:
+        w0.publish('worker0', 'http://127.0.0.1:5001/', 100, {'max_sessions': 3, 'sessions': 2}, rows('aaa','bbb'))
+        w1.publish('worker1', 'http://127.0.0.1:5002', 101, {'max_sessions': 3, 'sessions': 1}, rows('ccc'))
+        owner = w1.owner('aaa')
+        assert owner is not None
+        assert (owner.node_id, owner.url, owner.sessions) == ('worker0', 'http://127.0.0.1:5001', 2)
+        assert w0.owner('ccc').node_id=='worker1' # type: ignore
+        assert w0.owner('zzz') is None and w0.owner(None) is None
+        assert [ n.node_id for n in w0.live_nodes() ]==['worker0','worker1']
+        assert [ (s['session_id'], s['node_id'], s['cdp_port']) for s in w1.sessions() ]==[('aaa','worker0',9222),('bbb','worker0',9223),('ccc','worker1',9222)]
+    finally:
+        w0.close()
+        w1.close()
+
+def test_publish_replaces_the_sessions_of_the_worker(tmp_path):
+    directory = SessionDirectory(str(tmp_path/'directory.db'))
+    try:
+        directory.publish('worker0', 'http://127.0.0.1:5001', 100, {}, rows('aaa','bbb'))
+        directory.publish('worker0', 'http://127.0.0.1:5001', 100, {}, rows('bbb'))
+        assert directory.owner('aaa') is None
+        assert directory.owner('bbb') is not None
+        directory.drop('worker0')
+        assert directory.owner('bbb') is None and directory.live_nodes()==[]
+    finally:
+        directory.close()
+
+def test_expired_worker_owns_nothing(tmp_path):
+    directory = SessionDirectory(str(tmp_path/'directory.db'), expire=0.2)
+    try:
+        directory.publish('worker0', 'http://127.0.0.1:5001', 100, {}, rows('aaa'))
+        assert directory.owner('aaa') is not None
+        time.sleep(0.3)
+        assert directory.owner('aaa') is None
+        assert directory.live_nodes()==[]
+        # the rows stay until the worker publishes again or is dropped
+        assert len(directory.sessions())==1
+    finally:
+        directory.close()
+
+def test_kick_publishes_without_waiting_for_the_interval(tmp_path):
+    path = str(tmp_path/'directory.db')
+    async def run():
+        sessions:list[str] = []
+        async def snapshot():
+            return {'sessions': len(sessions)}, rows(*sessions)
+        w0, w1 = SessionDirectory(path), SessionDirectory(path)
+        # far longer than the test takes: only a kick can publish
+        publisher = DirectoryPublisher(w0, 'worker0', 'http://127.0.0.1:5001', snapshot, interval=60.0)
+        publisher.start()
+        try:
+            async def published(n:int) -> None:
+                while publisher.published<n:
+                    await asyncio.sleep(0.01)
+            await asyncio.wait_for(published(1), 5.0)
+            assert w1.owner('aaa') is None
+            # the worker created a session
+            sessions.append('aaa')
+            publisher.kick()
+            await asyncio.wait_for(published(2), 1.0)
+            assert w1.owner('aaa').node_id=='worker0' # type: ignore
+            # and removed it
+            sessions.clear()
+            publisher.kick()
+            await asyncio.wait_for(published(3), 1.0)
+            assert w1.owner('aaa') is None
+        finally:
+            await publisher.close()
+            w0.close()
+            w1.close()
+    asyncio.run(run())
@@ -0,0 +1,83 @@
+import sys, time, asyncio
+sys.path.append('.')
+
+from buweb.service.expiry import ExpiryScheduler
+
+class Keys:
+    """Deadlines of live keys, and the order in which they expired"""
+    def __init__(self):
+        self.deadlines:dict[str,float] = {}
+        self.expired:list[str] = []
+        # keys whose cleanup fails
+        self.failing:set[str] = set()
+    def deadline_of(self, key:str) -> float|None:
+        return self.deadlines.get(key)
+    async def on_expire(self, key:str) -> None:
+        self.deadlines.pop(key, None)
+        if key in self.failing:
+            raise RuntimeError(key)
+        self.expired.append(key)
+    def add(self, sched:ExpiryScheduler, key:str, after:float) -> None:
+        self.deadlines[key] = time.monotonic()+after
+        sched.add(key, self.deadlines[key])
+
+def run(test) -> None:
+    async def main():
+        keys = Keys()
+        sched = ExpiryScheduler(keys.deadline_of, keys.on_expire)
+        sched.start()
+        try:
+            await test(keys, sched)
+        finally:
+            await sched.close()
+    asyncio.run(main())
+
+def test_expires_in_deadline_order():
+    async def test(keys:Keys, sched:ExpiryScheduler):
+        keys.add(sched, 'b', 0.10)
+        keys.add(sched, 'a', 0.05)
+        keys.add(sched, 'c', 10.0)
+        await asyncio.sleep(0.2)
+        assert keys.expired==['a','b']
+        assert len(sched)==1 and sched.expired==2
+    run(test)
+
+def test_earlier_deadline_wakes_the_scheduler():
+    async def test(keys:Keys, sched:ExpiryScheduler):
+        keys.add(sched, 'late', 10.0)
+        await asyncio.sleep(0.02)
+        keys.add(sched, 'soon', 0.05)
+        await asyncio.sleep(0.15)
+        assert keys.expired==['soon']
+    run(test)
+
+def test_extended_deadline_is_requeued():
+    async def test(keys:Keys, sched:ExpiryScheduler):
+        keys.add(sched, 'k', 0.05)
+        # touched: only the deadline moves, the scheduler asks for it when the old one comes due
+        keys.deadlines['k'] = time.monotonic()+0.15
+        await asyncio.sleep(0.1)
+        assert keys.expired==[] and len(sched)==1
+        await asyncio.sleep(0.15)
+        assert keys.expired==['k']
+    run(test)
+
+def test_discarded_or_removed_keys_do_not_expire():
+    async def test(keys:Keys, sched:ExpiryScheduler):
+        keys.add(sched, 'discarded', 0.05)
+        keys.add(sched, 'removed', 0.05)
+        sched.discard('discarded')
+        del keys.deadlines['removed']
+        await asyncio.sleep(0.1)
+        assert keys.expired==[] and len(sched)==0
+        assert sched.get_status()['heap']==0
+    run(test)
+
+def test_error_in_on_expire_does_not_stop_the_scheduler():
+    async def test(keys:Keys, sched:ExpiryScheduler):
+        keys.failing.add('bad')
+        keys.add(sched, 'bad', 0.02)
+        keys.add(sched, 'good', 0.05)
+        await asyncio.sleep(0.1)
+        assert keys.expired==['good'] and sched.expired==2
+    run(test)
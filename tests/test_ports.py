@@ -0,0 +1,68 @@
+import sys, socket, threading
+sys.path.append('.')
+import pytest
+
+from buweb.service.ports import PortAllocator, CanNotStartException
+
+def allocator(n:int=4) -> PortAllocator:
+    # ranges that nothing else on the host uses
+    return PortAllocator(displays=range(500,500+n), ws_ports=range(47030,47030+n), cdp_ports=range(47230,47230+n))
+
+def test_leases_are_distinct():
+    ports = allocator()
+    leases = [ ports.lease() for _ in range(4) ]
+    assert len({ l.display_num for l in leases })==4
+    assert len({ l.ws_port for l in leases })==4
+    assert len({ l.cdp_port for l in leases })==4
+    assert all( l.vnc_port==5900+l.display_num for l in leases )
+    assert ports.get_status()=={'displays':4, 'ws_ports':4, 'cdp_ports':4}
+    with pytest.raises(CanNotStartException):
+        ports.lease()
+
+def test_release_returns_the_ports_once():
+    ports = allocator(2)
+    a = ports.lease()
+    ports.lease()
+    a.release()
+    a.release()
+    assert ports.get_status()['cdp_ports']==1
+    b = ports.lease()
+    assert b.cdp_port==a.cdp_port
+
+def test_next_fit_does_not_reuse_a_released_port_at_once():
+    ports = allocator()
+    a = ports.lease()
+    a.release()
+    assert ports.lease().cdp_port!=a.cdp_port
+
+def test_lease_without_display():
+    ports = allocator()
+    lease = ports.lease(display=False)
+    assert lease.display_num==0 and lease.vnc_port==0 and lease.ws_port==0
+    assert ports.get_status()=={'displays':0, 'ws_ports':0, 'cdp_ports':1}
+
+def test_port_in_use_is_skipped():
+    ports = allocator(2)
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind(('localhost', 47230))
+        assert ports.lease(display=False).cdp_port==47231
+
+def test_restrict_splits_the_ranges():
+    parts = []
+    for index in range(2):
+        ports = PortAllocator(displays=range(500,504), ws_ports=range(47030,47034), cdp_ports=range(47230,47234))
+        ports.restrict(index, 2)
+        parts.append( { ports.lease().cdp_port for _ in range(2) } )
+    assert parts==[{47230,47231},{47232,47233}]
+
+def test_parallel_leases():
+    ports = allocator(16)
+    leases = []
+    def take():
+        leases.append(ports.lease())
+    threads = [ threading.Thread(target=take) for _ in range(16) ]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len({ l.cdp_port for l in leases })==16
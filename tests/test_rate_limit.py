@@ -0,0 +1,122 @@
+import sys, os, asyncio
+import multiprocessing as mp
+from datetime import datetime
+sys.path.append('.')
+import pytest
+
+import buweb.model.rate_limit as rate_limit
+from buweb.model.rate_limit import RateBucket, RateLimits, parse_limits
+
+class Clock:
+    def __init__(self, now:float):
+        self.now:float = now
+    def __call__(self) -> float:
+        return self.now
+
+@pytest.fixture
+def clock(monkeypatch) -> Clock:
+    # local noon, far from the daily reset
+    clock = Clock(datetime(2026,1,1,12).timestamp())
+    monkeypatch.setattr(rate_limit.time, 'time', clock)
+    return clock
+
+def test_parse_limits():
+    assert parse_limits('gemini-2.0-flash-exp=10/1500/1000000, openai=500//;ollama=/100')=={
+        'gemini-2.0-flash-exp': RateLimits(10,1500,1000000), 'openai': RateLimits(500), 'ollama': RateLimits(None,100) }
+    assert parse_limits('')=={}
+    with pytest.raises(ValueError):
+        parse_limits('x=1/2/3/4')
+
+def test_rpm_refill(clock:Clock):
+    bucket = RateBucket('t', RateLimits(rpm=60))
+    # a new bucket starts full
+    assert all( bucket.try_acquire()==0.0 for _ in range(60) )
+    assert bucket.try_acquire()==pytest.approx(1.0)
+    clock.now += 0.5
+    assert bucket.try_acquire()==pytest.approx(0.5)
+    clock.now += 0.5
+    assert bucket.try_acquire()==0.0
+    clock.now += 3600
+    # never more than one minute of requests
+    assert bucket.get_status()['rpm_tokens']==60.0
+
+def test_rpd_waits_for_the_next_day(clock:Clock):
+    bucket = RateBucket('t', RateLimits(rpd=2))
+    assert bucket.try_acquire()==0.0 and bucket.try_acquire()==0.0
+    wait = bucket.try_acquire()
+    assert wait==pytest.approx(12*3600)
+    clock.now += wait
+    assert bucket.try_acquire()==0.0 and bucket.get_status()['requests_today']==1
+
+def test_tpm_debt(clock:Clock):
+    bucket = RateBucket('t', RateLimits(tpm=6000))
+    assert bucket.try_acquire()==0.0
+    bucket.charge_tokens(9000)
+    # 3000 tokens of debt at 100 tokens a second
+    assert bucket.try_acquire()==pytest.approx(30.0)
+    clock.now += 30
+    assert bucket.try_acquire()==0.0
+
+def test_acquire(clock:Clock, monkeypatch):
+    slept:list[float] = []
+    async def sleep(sec:float) -> None:
+        slept.append(sec)
+        clock.now += sec
+    bucket = RateBucket('t', RateLimits(rpm=1))
+    assert bucket.acquire()
+    assert not bucket.acquire(blocking=False)
+    async def run():
+        monkeypatch.setattr(rate_limit.asyncio, 'sleep', sleep)
+        assert await bucket.aacquire()
+        # the blocking path would stop the loop
+        with pytest.raises(RuntimeError):
+            bucket.acquire()
+    asyncio.run(run())
+    assert slept==[pytest.approx(60.0)]
+
+def test_unlimited_bucket_never_waits():
+    bucket = RateBucket('t', RateLimits())
+    assert all( bucket.try_acquire()==0.0 for _ in range(1000) )
+
+def _take(path:str, n:int, q) -> None:
+    bucket = RateBucket('shared', RateLimits(rpm=100), path)
+    q.put(sum( 1 for _ in range(n) if bucket.try_acquire()==0.0 ))
+    bucket.close()
+
+def test_budget_is_shared_across_processes(tmp_path):
+    path = str(tmp_path/'openai_gpt.bucket')
+    ctx = mp.get_context('fork')
+    q = ctx.Queue()
+    procs = [ ctx.Process(target=_take, args=(path, 60, q)) for _ in range(4) ]
+    for p in procs:
+        p.start()
+    for p in procs:
+        p.join(30)
+    taken = sum( q.get(timeout=5) for _ in procs )
+    # 100 at the start, and less than one more refilled while they ran
+    assert 100<=taken<=101
+    # the state outlives the processes
+    bucket = RateBucket('shared', RateLimits(rpm=100), path)
+    assert bucket.get_status()['rpm_tokens']<1.0
+    bucket.close()
+
+def test_old_record_file_is_replaced(tmp_path):
+    path = tmp_path/'limit.json'
+    path.write_text('{"requests": [1700000000.0, 1700000001.0], "day": "2025-01-01"}')
+    bucket = RateBucket('old', RateLimits(rpm=5), str(path))
+    assert os.path.getsize(path)==40
+    assert bucket.get_status()['rpm_tokens']==5.0
+    bucket.close()
+
+def test_registry_reads_the_dir_when_built(tmp_path, monkeypatch):
+    monkeypatch.setattr(rate_limit, '_registry', None)
+    monkeypatch.setenv('BUW_RATE_LIMITS', 'gpt-4o=10//')
+    monkeypatch.setenv('BUW_RATE_LIMIT_DIR', str(tmp_path))
+    registry = rate_limit.get_registry()
+    try:
+        bucket = registry.bucket('openai', 'gpt-4o')
+        assert bucket is not None and bucket.path==str(tmp_path/'openai_gpt-4o.bucket')
+        assert registry.bucket('openai', 'gpt-4o') is bucket
+        assert registry.bucket('openai', 'other') is None
+    finally:
+        registry.close()
@@ -0,0 +1,45 @@
+import sys
+sys.path.append('.')
+
+from buweb.service.sse import ReplayBuffer, parse_event_id
+
+def frames(buf:ReplayBuffer, n:int) -> list[str]:
+    return [ buf.add(f"data: {i}\n\n") for i in range(n) ]
+
+def test_add_numbers_frames():
+    buf = ReplayBuffer('abc')
+    sent = frames(buf, 3)
+    assert sent[0]=="id: abc.1\ndata: 0\n\n"
+    assert sent[2].startswith("id: abc.3\n")
+    assert buf.seq==3
+
+def test_since_returns_the_missed_frames():
+    buf = ReplayBuffer('abc')
+    sent = frames(buf, 5)
+    assert buf.since(2)==sent[2:]
+    assert buf.since(5)==[]
+    assert buf.since(0)==sent
+
+def test_since_after_the_oldest_kept_frame_is_gone():
+    buf = ReplayBuffer('abc', maxlen=3)
+    sent = frames(buf, 5)
+    # frames 3..5 are kept
+    assert buf.since(2)==sent[2:]
+    assert buf.since(1) is None
+    assert buf.since(0) is None
+
+def test_since_a_seq_that_was_never_sent():
+    buf = ReplayBuffer('abc')
+    frames(buf, 2)
+    assert buf.since(3) is None
+    assert ReplayBuffer('x').since(0)==[]
+
+def test_parse_event_id():
+    assert parse_event_id('abc123.42')==('abc123',42)
+    assert parse_event_id(' abc.7 \n')==('abc',7)
+    # only the last dot separates the sequence number
+    assert parse_event_id('a.b.3')==('a.b',3)
+
+def test_parse_event_id_invalid():
+    for event_id in (None, '', 'abc', '.5', 'abc.', 'abc.x1', 'abc.-1'):
+        assert parse_event_id(event_id) is None
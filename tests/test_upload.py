@@ -0,0 +1,89 @@
+import sys, os, asyncio
+sys.path.append('.')
+import pytest
+
+pytest.importorskip('werkzeug')
+from buweb.service.upload import UploadError, FileWriter, safe_filename, upload_events
+
+BOUNDARY = 'buwtestboundary'
+CONTENT_TYPE = f'multipart/form-data; boundary={BOUNDARY}'
+
+def multipart(*parts:tuple[str,str|None,bytes]) -> bytes:
+    """(field name, filename or None for a plain field, content)"""
+    body = b''
+    for name, filename, data in parts:
+        disposition = f'form-data; name="{name}"' + (f'; filename="{filename}"' if filename is not None else '')
+        body += f'--{BOUNDARY}\r\nContent-Disposition: {disposition}\r\n'.encode()
+        if filename is not None:
+            body += b'Content-Type: application/octet-stream\r\n'
+        body += b'\r\n' + data + b'\r\n'
+    return body + f'--{BOUNDARY}--\r\n'.encode()
+
+async def chunked(data:bytes, size:int):
+    for i in range(0, len(data), size):
+        yield data[i:i+size]
+
+def collect(body:bytes, content_type:str|None, name:str|None=None, size:int=7) -> list[tuple[str,bytes|str|None]]:
+    async def run():
+        events = []
+        async for kind, value in upload_events(chunked(body, size), content_type, name):
+            if kind=='data' and events and events[-1][0]=='data':
+                # chunk boundaries depend on the parser, join them
+                events[-1] = ('data', events[-1][1]+value)
+            else:
+                events.append((kind, value))
+        return events
+    return asyncio.run(run())
+
+def test_safe_filename():
+    assert safe_filename('report.pdf')=='report.pdf'
+    assert safe_filename('../../etc/passwd')=='passwd'
+    assert safe_filename('C:\\Users\\me\\data.csv')=='data.csv'
+    assert safe_filename('  a b.txt ')=='a b.txt'
+    for bad in (None, '', '.', '..', 'dir/', 'a\0b'):
+        with pytest.raises(UploadError):
+            safe_filename(bad)
+
+def test_multipart_file_part():
+    data = os.urandom(3000)
+    body = multipart(('note', None, b'hello'), ('file', 'a.bin', data), ('other', 'b.bin', b'ignored'))
+    for size in (1, 7, 1024, len(body)):
+        assert collect(body, CONTENT_TYPE, size=size)==[('file','a.bin'), ('data',data), ('end',None)]
+
+def test_multipart_empty_file():
+    assert collect(multipart(('file', 'empty.txt', b'')), CONTENT_TYPE)==[('file','empty.txt'), ('end',None)]
+
+def test_multipart_errors():
+    with pytest.raises(UploadError, match='No file part'):
+        collect(multipart(('note', None, b'hello')), CONTENT_TYPE)
+    with pytest.raises(UploadError, match='boundary'):
+        collect(b'', 'multipart/form-data')
+    # the body stops in the middle of the file
+    body = multipart(('file', 'a.bin', b'x'*1000))
+    with pytest.raises(UploadError):
+        collect(body[:600], CONTENT_TYPE)
+
+def test_raw_body():
+    assert collect(b'abcdef', 'application/octet-stream', 'raw.bin', size=2)==[('file','raw.bin'), ('data',b'abcdef'), ('end',None)]
+    with pytest.raises(UploadError, match='No file part'):
+        collect(b'abc', None)
+
+def test_file_writer(tmp_path):
+    async def run():
+        writer = FileWriter(str(tmp_path), 'out.bin', limit=10)
+        await writer.open()
+        await writer.write(b'12345')
+        await writer.write(b'678')
+        await writer.commit()
+        assert (tmp_path/'out.bin').read_bytes()==b'12345678' and writer.size==8
+        writer = FileWriter(str(tmp_path), 'out.bin', limit=10)
+        await writer.open()
+        await writer.write(b'abcdef')
+        with pytest.raises(UploadError) as ex:
+            await writer.write(b'ghijk')
+        assert ex.value.status==413
+        await writer.abort()
+        # the stored file is untouched and the part file is gone
+        assert sorted(os.listdir(tmp_path))==['out.bin']
+        assert (tmp_path/'out.bin').read_bytes()==b'12345678'
+    asyncio.run(run())